@@ -0,0 +1,1059 @@
+"""
+Benchmarks for the detection scripts. Each subcommand prints one JSON summary line and exits non-zero on regression.
+
+Usage:
+    $ python benchmarks.py startup [--max-ms 3000] [--runs 3]   # cold import of detect_custom.py via -X importtime
+    $ python benchmarks.py onnx --weights best.pt images/        # ONNX Runtime vs PyTorch parity and CPU latency
+    $ python benchmarks.py conf-tiers --weights best.pt images/  # single-pass confidence fallback vs two passes
+    $ python benchmarks.py tiles --weights best.pt images/       # tiled vs single-shot latency and label recall
+    $ python benchmarks.py decode [images/]                      # full vs reduced-resolution JPEG decode + letterbox
+    $ python benchmarks.py preprocess images/                    # fused preprocessing into reusable input buffers
+    $ python benchmarks.py video --weights best.pt walk.mp4      # sampled walk-around scan vs every frame
+    $ python benchmarks.py grids                                 # Detect grid cache under mixed-aspect traffic
+    $ python benchmarks.py load --weights best.pt                # .pt vs memory-mapped .safetensors model load
+    $ python benchmarks.py ensemble --weights a.pt b.pt images/  # sequential vs parallel ensemble, NMS vs WBF
+    $ python benchmarks.py tta --weights best.pt images/         # sequential vs batched test-time augmentation
+    $ python benchmarks.py nms [--batch-sizes 1 8 32]            # per-image vs cross-image batched NMS
+    $ python benchmarks.py nms-kernels                           # torchvision vs torch / NumPy tiled NMS
+    $ python benchmarks.py prefilter --weights best.pt images/   # Detect objectness pre-filter vs dense decode
+    $ python benchmarks.py topk --weights best.pt --data data.yaml  # per-class NMS candidate cap, mAP and latency
+    $ python benchmarks.py label-cache [--images 10000 100000]   # pickled vs columnar memory-mapped labels cache
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from functools import partial
+from pathlib import Path
+
+ML_DIR = Path(__file__).resolve().parent
+
+# Modules an inference-only detect_custom.py process must not import (training, plotting and logging dependencies)
+STARTUP_FORBIDDEN = ('pandas', 'matplotlib', 'seaborn', 'pkg_resources', 'wandb', 'PIL', 'yaml', 'tqdm', 'requests',
+                     'scipy', 'thop', 'tensorboard')
+
+# Fresh-interpreter attempt_load() of one weights file: load time, output on a fixed input and memory of the process
+LOAD_CODE = '''
+import json, sys, time
+sys.path[:0] = [{yolov5!r}, {ml!r}]
+import torch
+from models.experimental import attempt_load
+t = time.perf_counter()
+model = attempt_load({weights!r}, map_location='cpu')
+load_s = time.perf_counter() - t
+torch.manual_seed(0)
+with torch.no_grad():
+    y = model(torch.rand(1, 3, {imgsz}, {imgsz}))[0].double()
+mem = {{}}
+try:
+    for line in open('/proc/self/smaps_rollup'):
+        k, v = line.split()[:2]
+        if k[:-1] in ('Rss', 'Pss', 'Shared_Clean', 'Private_Clean', 'Private_Dirty'):
+            mem[k[:-1].lower() + '_mb'] = round(int(v) / 1024, 1)
+except OSError:
+    pass
+print(json.dumps({{'load_s': load_s, 'sum': float(y.sum()), 'abs_sum': float(y.abs().sum()), **mem}}))
+'''
+
+# Fresh-interpreter read of one labels cache as LoadImagesAndLabels does it: load time, resident memory added by the
+# load, then a strided pass over the labels (checksum)
+LABEL_CACHE_CODE = '''
+import json, sys, time
+sys.path[:0] = [{yolov5!r}, {ml!r}]
+from pathlib import Path
+import numpy as np
+from utils.datasets import RaggedArray, load_label_cache
+
+
+def rss_mb():
+    for line in open('/proc/self/status'):
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1]) / 1024
+    return 0.0
+
+
+rss = rss_mb()
+t = time.perf_counter()
+if {columnar}:
+    x = load_label_cache(Path({path!r}))
+    labels, files = RaggedArray(x['labels'], x['label_index']), x['files']
+    shapes = np.array(x['shapes'], dtype=np.float64)
+else:  # cache_version 0.5, pickled dict of per-image arrays
+    x = np.load({path!r}, allow_pickle=True).item()
+    [x.pop(k) for k in ('hash', 'version', 'msgs', 'results')]
+    labels, shapes, segments = zip(*x.values())
+    labels, shapes, files = list(labels), np.array(shapes, dtype=np.float64), list(x.keys())
+load_s = time.perf_counter() - t
+rss_load = rss_mb() - rss
+t = time.perf_counter()
+checksum = sum(float(labels[i].sum()) for i in range(0, len(labels), {stride}))
+access_s = time.perf_counter() - t
+print(json.dumps({{'load_s': load_s, 'rss_mb': rss_load, 'access_s': access_s, 'n': len(files),
+                  'checksum': checksum}}))
+'''
+
+
+def image_files(source):
+    # Image paths from a file, directory or glob
+    p = Path(source)
+    files = sorted(glob.glob(source, recursive=True)) if '*' in source else \
+        sorted(str(x) for x in p.iterdir()) if p.is_dir() else [str(p)]
+    files = [f for f in files if f.split('.')[-1].lower() in ('bmp', 'jpg', 'jpeg', 'png', 'tif', 'tiff', 'webp')]
+    assert files, f'No images found in {source}'
+    return files
+
+
+def latency(dt):
+    # {mean, p50, p99} in ms of a list of durations in seconds
+    dt = sorted(dt)
+    return {'mean_ms': round(sum(dt) / len(dt) * 1E3, 2),
+            'p50_ms': round(dt[len(dt) // 2] * 1E3, 2),
+            'p99_ms': round(dt[min(len(dt) - 1, int(len(dt) * 0.99))] * 1E3, 2)}
+
+
+def parse_importtime(stderr):
+    # Parse `python -X importtime` output into {module: (self_us, cumulative_us, depth)}, top-level imports at depth 0
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        self_us, cum_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue  # header
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(self_us), int(cum_us), depth)
+    return modules
+
+
+def startup(opt):
+    # Cold-start import of detect_custom.py (sys.path setup + yolov5 models/utils) in fresh interpreters
+    code = f'import sys; sys.path.insert(0, {str(ML_DIR)!r}); import detect_custom'
+    env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+    runs = []
+    for _ in range(opt.runs):
+        t = time.time()
+        p = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=str(ML_DIR), env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        wall = time.time() - t
+        if p.returncode:
+            print(p.stderr[-2000:], file=sys.stderr)
+            sys.exit(f'ERROR: importing detect_custom failed with exit code {p.returncode}')
+        runs.append((wall, parse_importtime(p.stderr)))
+
+    wall, modules = min(runs, key=lambda x: x[0])  # best of n, the least noisy estimate of the cold start
+    import_ms = modules['detect_custom'][1] / 1E3  # cumulative, excludes interpreter startup (site, encodings)
+    forbidden = sorted({m.split('.')[0] for m in modules} & set(STARTUP_FORBIDDEN))
+    slowest = sorted(((cum, m) for m, (_, cum, depth) in modules.items() if depth == 1), reverse=True)[:opt.top]
+    summary = {'benchmark': 'startup',
+               'runs': opt.runs,
+               'wall_ms': round(wall * 1E3, 1),
+               'import_ms': round(import_ms, 1),
+               'max_ms': opt.max_ms,
+               'modules': len(modules),
+               'slowest': {m: round(cum / 1E3, 1) for cum, m in slowest},
+               'forbidden': forbidden}
+    print(json.dumps(summary))
+
+    failed = []
+    if forbidden:
+        failed.append(f"inference path imports {', '.join(forbidden)}")
+    if opt.max_ms and import_ms > opt.max_ms:
+        failed.append(f'import time {import_ms:.0f}ms exceeds --max-ms {opt.max_ms:.0f}ms')
+    if failed:
+        sys.exit('REGRESSION: ' + '; '.join(failed))
+
+
+def onnx(opt):
+    # ONNX Runtime vs PyTorch yolov5 on the same images: detection parity and per-image CPU latency
+    from detect_engine import DetectionEngine, read_image
+
+    ims = [read_image(f) for f in image_files(opt.source)]
+    kwargs = dict(conf=opt.conf, fallback=False, class_map=None, threads=opt.threads, batch_size=1)
+    engines = {'pytorch': DetectionEngine(opt.weights, backend='yolov5', **kwargs),
+               'onnx': DetectionEngine(opt.onnx or str(Path(opt.weights).with_suffix('.onnx')), **kwargs)}
+    ox, pt = engines['onnx'].load(), engines['pytorch'].load()
+    if not ox.auto:  # static export, compare both on its fixed letterbox shape
+        pt.auto, pt.imgsz = False, ox.imgsz
+
+    results, summary = {}, {'benchmark': 'onnx', 'images': len(ims), 'runs': opt.runs, 'threads': opt.threads}
+    for name, engine in engines.items():
+        engine.detect(ims[0])  # warmup
+        dt, results[name] = [], []
+        for im in ims:
+            for _ in range(opt.runs):
+                t = time.time()
+                r = engine.detect(im)
+                dt.append(time.time() - t)
+            results[name].append(r['detections'])
+        summary[name] = latency(dt)
+    summary['speedup'] = round(summary['pytorch']['mean_ms'] / summary['onnx']['mean_ms'], 2)
+
+    # Parity: same boxes in the same order, same classes, coordinates and confidences within tolerance
+    mismatched, box_diff, conf_diff = 0, 0.0, 0.0
+    for a, b in zip(results['pytorch'], results['onnx']):
+        if len(a) != len(b) or any(x['class_id'] != y['class_id'] for x, y in zip(a, b)):
+            mismatched += 1
+            continue
+        for x, y in zip(a, b):
+            box_diff = max(box_diff, *(abs(i - j) for i, j in zip(x['box_xyxy'], y['box_xyxy'])))
+            conf_diff = max(conf_diff, abs(x['confidence'] - y['confidence']))
+    summary['parity'] = {'mismatched_images': mismatched, 'max_box_diff_px': round(box_diff, 3),
+                         'max_conf_diff': round(conf_diff, 5)}
+    print(json.dumps(summary))
+    if mismatched or box_diff > opt.box_tol or conf_diff > opt.conf_tol:
+        sys.exit(f'PARITY FAILURE: ONNX detections differ from PyTorch {summary["parity"]}')
+
+
+def conf_tiers(opt):
+    # DetectionEngine's single pass at the fallback threshold + tier post-filter vs the former two passes (predict at
+    # conf, predict again at the fallback threshold when nothing clears conf): identical results and latency per image
+    from detect_engine import DetectionEngine, read_image
+
+    engine = DetectionEngine(opt.weights, backend=opt.backend, conf=opt.conf, imgsz=opt.imgsz, device='cpu',
+                             batch_size=1, threads=opt.threads, class_map=None)
+    backend = engine.load()
+    dt, mismatched, fallbacks = {'single_pass': [], 'two_pass': []}, [], 0
+    for f in image_files(opt.source):
+        im0 = read_image(f)
+        engine.detect_batch([im0])  # warmup, i.e. grids for this letterboxed shape
+        t = time.perf_counter()
+        a = engine.detect_batch([im0])[0]
+        dt['single_pass'].append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        used_conf = opt.conf
+        det = backend.predict([im0], used_conf)[0]
+        if not len(det):
+            used_conf = engine.fallback_conf
+            det = backend.predict([im0], used_conf)[0]
+        b = engine.postprocess(det, used_conf)
+        dt['two_pass'].append(time.perf_counter() - t)
+
+        a.pop('image')
+        fallbacks += used_conf != opt.conf
+        if a != b:  # same boxes, scores, classes, names and confidence_used
+            mismatched.append(f)
+    summary = {'benchmark': 'conf-tiers', 'backend': engine.backend_name, 'images': len(dt['two_pass']),
+               'conf': opt.conf, 'fallback_conf': engine.fallback_conf, 'fallback_images': fallbacks,
+               **{k: latency(v) for k, v in dt.items()}, 'mismatched': len(mismatched)}
+    print(json.dumps(summary))
+    if mismatched:
+        sys.exit(f'PARITY FAILURE: single-pass results differ from the two-pass fallback on {mismatched[:10]}')
+
+
+def box_iou(a, b):
+    # IoU of two xyxy boxes
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    inter = max(w, 0) * max(h, 0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def read_labels(file, shape):
+    # YOLO label file (class x y w h, normalized) -> [(class, [x1, y1, x2, y2] pixels)], empty when missing
+    h, w = shape[:2]
+    try:
+        lines = Path(file).read_text().splitlines()
+    except FileNotFoundError:
+        return []
+    labels = []
+    for c, x, y, bw, bh in (line.split()[:5] for line in lines if line.strip()):
+        x, y, bw, bh = float(x) * w, float(y) * h, float(bw) * w, float(bh) * h
+        labels.append((int(c), [x - bw / 2, y - bh / 2, x + bw / 2, y + bh / 2]))
+    return labels
+
+
+def tiles(opt):
+    # Tiled vs single-shot yolov5 on the same images: per-image latency, and recall against YOLO labels when present
+    from detect_engine import DetectionEngine, add_yolov5_path, read_image
+
+    add_yolov5_path()
+    from utils.datasets import img2label_paths
+
+    files = image_files(opt.source)
+    ims = [read_image(f) for f in files]
+    labels = [read_labels(f, im.shape) for f, im in zip(img2label_paths(files), ims)]
+    kwargs = dict(conf=opt.conf, fallback=False, class_map=None, threads=opt.threads, imgsz=opt.imgsz,
+                  batch_size=opt.max_tiles + 1)
+    engines = {'single': DetectionEngine(opt.weights, **kwargs),
+               'tiled': DetectionEngine(opt.weights, tile=opt.tile, tile_overlap=opt.overlap, max_tiles=opt.max_tiles,
+                                        **kwargs)}
+
+    summary = {'benchmark': 'tiles', 'images': len(ims), 'labels': sum(map(len, labels)), 'tile': opt.tile,
+               'overlap': opt.overlap, 'max_tiles': opt.max_tiles}
+    for name, engine in engines.items():
+        engine.detect(ims[0])  # warmup
+        dt, found, total = [], [0, 0], [0, 0]  # [all, small] labels
+        n = 0
+        for im, gt in zip(ims, labels):
+            for _ in range(opt.runs):
+                t = time.time()
+                r = engine.detect(im)
+                dt.append(time.time() - t)
+            n += len(r['detections'])
+            small_side = 32 * max(im.shape[:2]) / opt.imgsz  # under 32 pixels once letterboxed to imgsz
+            for c, box in gt:
+                small = max(box[2] - box[0], box[3] - box[1]) < small_side
+                hit = any(d['class_id'] == c and box_iou(d['box_xyxy'], box) >= opt.iou for d in r['detections'])
+                for k in (0, 1) if small else (0,):
+                    total[k] += 1
+                    found[k] += hit
+        summary[name] = {**latency(dt), 'detections': n,
+                         'recall': round(found[0] / total[0], 4) if total[0] else None,
+                         'recall_small': round(found[1] / total[1], 4) if total[1] else None}
+    summary['latency_ratio'] = round(summary['tiled']['mean_ms'] / summary['single']['mean_ms'], 2)
+    print(json.dumps(summary))
+
+    single, tiled = summary['single']['recall'], summary['tiled']['recall']
+    if single is not None and tiled < single - opt.recall_tol:
+        sys.exit(f'REGRESSION: tiled recall {tiled} is below single-shot recall {single}')
+
+
+def decode(opt):
+    # Full-resolution cv2.imread vs reduced-resolution JPEG decode, each followed by letterbox to imgsz, per upload size
+    import tempfile
+
+    import cv2
+    import numpy as np
+
+    from detect_numpy import imread_reduced, letterbox
+
+    if opt.source:
+        files = image_files(opt.source)
+    else:  # synthetic uploads at typical phone camera sizes, smooth gradients plus noise so JPEG does real work
+        tmp = Path(tempfile.mkdtemp())
+        files = []
+        for size in opt.sizes:
+            w, h = map(int, size.split('x'))
+            x, y = np.arange(w, dtype=np.uint32)[None], np.arange(h, dtype=np.uint32)[:, None]
+            im = np.dstack(np.broadcast_arrays(x * 255 // w, y * 255 // h, (x + y) * 255 // (w + h))).astype(np.uint8)
+            im = cv2.add(im, np.random.default_rng(0).integers(0, 32, im.shape, dtype=np.uint8))
+            files.append(str(tmp / f'{size}.jpg'))
+            cv2.imwrite(files[-1], im, [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+    summary, mismatched = {'benchmark': 'decode', 'imgsz': opt.imgsz, 'runs': opt.runs, 'images': {}}, []
+    for f in files:
+        dt = {'full': [], 'reduced': []}
+        for _ in range(opt.runs):
+            t = time.time()
+            im = cv2.imread(f)
+            letterbox(im, opt.imgsz)
+            dt['full'].append(time.time() - t)
+            t = time.time()
+            imr, shape0 = imread_reduced(f, opt.imgsz)
+            letterbox(imr, opt.imgsz)
+            dt['reduced'].append(time.time() - t)
+        if tuple(shape0) != im.shape[:2]:
+            mismatched.append(f)
+        full, reduced = latency(dt['full']), latency(dt['reduced'])
+        summary['images'][Path(f).name] = {'shape': list(im.shape[:2]), 'decoded': list(imr.shape[:2]),
+                                           'full_ms': full['p50_ms'], 'reduced_ms': reduced['p50_ms'],
+                                           'speedup': round(full['p50_ms'] / max(reduced['p50_ms'], 1E-3), 2)}
+    print(json.dumps(summary))
+    if mismatched:
+        sys.exit(f'FAILURE: reduced decode reports a wrong original shape for {mismatched}')
+
+
+def preprocess(opt):
+    # Legacy letterbox -> transpose -> contiguous -> stack -> float -> /255 chain vs Backend.fill() into reused buffers:
+    # latency, peak Python-heap allocations (tracemalloc sees NumPy buffers) and bitwise parity of the inputs
+    import tracemalloc
+
+    import numpy as np
+
+    from detect_engine import Backend, read_image
+    from detect_numpy import letterbox
+
+    ims = [read_image(f) for f in image_files(opt.source)]
+    backend = Backend(None, imgsz=opt.imgsz, batch_size=opt.batch_size)  # preprocessing only, no model
+    backend.auto, backend.stride = True, 32
+
+    def legacy():
+        imgs = [np.ascontiguousarray(letterbox(im, opt.imgsz)[0].transpose((2, 0, 1))[::-1]) for im in ims]
+        return [np.stack([imgs[i] for i in chunk]).astype(np.float32) / 255.0
+                for chunk in backend.batches([img.shape[1:] for img in imgs])]
+
+    def fused(copy=False):
+        shapes, out = backend.letterbox_shapes(ims), []
+        for chunk in backend.batches(shapes):
+            x = backend.fill(backend.buffers.get(len(chunk), shapes[chunk[0]]), chunk, ims)
+            out.append(x.copy() if copy else x)  # batches of one shape share a buffer
+        return out
+
+    diff = max(float(np.abs(a - b).max()) for a, b in zip(legacy(), fused(copy=True)))
+
+    summary = {'benchmark': 'preprocess', 'images': len(ims), 'imgsz': opt.imgsz, 'batch_size': opt.batch_size,
+               'max_abs_diff': diff}
+    for name, f in ('legacy', legacy), ('fused', fused):
+        f()  # warmup, fills the buffers
+        dt = []
+        for _ in range(opt.runs):
+            t = time.time()
+            f()
+            dt.append(time.time() - t)
+        tracemalloc.start()
+        f()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        summary[name] = {**latency(dt), 'peak_alloc_mb': round(peak / 2 ** 20, 2)}
+    summary['speedup'] = round(summary['legacy']['mean_ms'] / summary['fused']['mean_ms'], 2)
+    print(json.dumps(summary))
+    if diff:
+        sys.exit(f'PARITY FAILURE: fused inputs differ from the legacy chain by {diff}')
+
+
+def video(opt):
+    # Walk-around scan (sampled frames) vs detection on every frame: cost and the aggregated parts both find
+    from detect_engine import DetectionEngine
+    from detect_video import FrameSampler, scan_video
+
+    engine = DetectionEngine(opt.weights, backend='yolov5', conf=opt.conf, fallback=False, class_map=None,
+                             threads=opt.threads, batch_size=opt.batch_size)
+    engine.load()
+    every = FrameSampler(stride=1, threshold=0.0, min_gap=0.0)  # samples every frame
+    sampled = FrameSampler(stride=opt.stride, threshold=opt.threshold, max_gap=opt.max_gap)
+    full, scan = scan_video(engine, opt.source, every), scan_video(engine, opt.source, sampled)
+    missed = [p for p in full['parts'] if p not in scan['parts']]
+    summary = {'benchmark': 'video', 'video': opt.source,
+               'full': {**full['frames'], 'parts': full['parts']},
+               'scan': {**scan['frames'], 'parts': scan['parts']},
+               'cost_ratio': round(scan['frames']['seconds'] / max(full['frames']['seconds'], 1E-6), 3),
+               'missed_parts': missed}
+    print(json.dumps(summary))
+    if missed:
+        sys.exit(f'REGRESSION: sampled scan misses parts found on every frame: {missed}')
+
+
+def grids(opt):
+    # yolov5 Detect head on mixed portrait/landscape/square traffic: rebuilding grids on every shape change
+    # (grid_cache_size = 0) vs the shape-keyed grid cache warmed up with the traffic's shapes, and output parity
+    import random
+
+    import torch
+
+    from detect_engine import add_yolov5_path
+
+    add_yolov5_path()
+    from models.yolo import Detect
+
+    torch.manual_seed(0)
+    anchors = ([10, 13, 16, 30, 33, 23], [30, 61, 62, 45, 59, 119], [116, 90, 156, 198, 373, 326])  # yolov5s P3-P5
+    m = Detect(opt.nc, anchors, ch=(128, 256, 512)).eval()
+    m.stride = torch.tensor([8., 16., 32.])
+    shapes = [tuple(int(x) for x in s.split('x')) for s in opt.shapes]  # letterboxed (h, w)
+    ch = (128, 256, 512)
+    features = {s: [torch.rand(opt.batch_size, c, s[0] // st, s[1] // st) for c, st in zip(ch, (8, 16, 32))]
+                for s in shapes}
+    rng = random.Random(0)
+    traffic = [rng.choice(shapes) for _ in range(opt.requests)]
+
+    make_grid, built = m._make_grid, [0]
+
+    def counted(*args):
+        built[0] += 1
+        return make_grid(*args)
+
+    m._make_grid = counted  # instance attribute, counts grid builds
+    summary = {'benchmark': 'grids', 'shapes': opt.shapes, 'requests': opt.requests, 'batch_size': opt.batch_size}
+    outputs = {}
+    for name, size in ('rebuild', 0), ('cached', opt.cache_size):
+        m.grid_cache_size, m.grid_cache = size, OrderedDict()
+        m.grid = [torch.zeros(1)] * m.nl
+        if size:
+            m.warmup(shapes)
+        built[0], dt, outputs[name] = 0, [], {}
+        with torch.no_grad():
+            for s in traffic:
+                t = time.perf_counter()
+                y = m(list(features[s]))[0]
+                dt.append(time.perf_counter() - t)
+                outputs[name].setdefault(s, y)
+        summary[name] = {**latency(dt), 'grids_built': built[0]}
+    summary['speedup'] = round(summary['rebuild']['mean_ms'] / summary['cached']['mean_ms'], 2)
+    diff = max(float((outputs['rebuild'][s] - outputs['cached'][s]).abs().max()) for s in outputs['cached'])
+    summary['max_abs_diff'] = diff
+    print(json.dumps(summary))
+    if diff:
+        sys.exit(f'PARITY FAILURE: cached grids change Detect outputs by {diff}')
+
+
+def load(opt):
+    # Model load in fresh interpreters: pickled .pt checkpoint (unpickle, .float().fuse()) vs the fused FP32
+    # .safetensors export (memory-mapped), best of n runs, with output parity and process memory
+    files = {'pt': opt.weights, 'safetensors': opt.safetensors or str(Path(opt.weights).with_suffix('.safetensors'))}
+    assert Path(files['safetensors']).exists(), \
+        f"{files['safetensors']} not found, run yolov5/export.py --weights {opt.weights} --include safetensors"
+    summary = {'benchmark': 'load', 'runs': opt.runs}
+    for name, f in files.items():
+        code = LOAD_CODE.format(yolov5=str(ML_DIR / 'yolov5'), ml=str(ML_DIR), weights=str(Path(f).resolve()),
+                                imgsz=opt.imgsz)
+        runs = []
+        for _ in range(opt.runs):
+            t = time.time()
+            p = subprocess.run([sys.executable, '-c', code], cwd=str(ML_DIR), stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, universal_newlines=True)
+            if p.returncode:
+                print(p.stderr[-2000:], file=sys.stderr)
+                sys.exit(f'ERROR: loading {f} failed with exit code {p.returncode}')
+            runs.append({**json.loads(p.stdout.strip().splitlines()[-1]), 'wall_s': time.time() - t})
+        best = min(runs, key=lambda x: x['load_s'])
+        summary[name] = {'file': f, 'size_mb': round(Path(f).stat().st_size / 2 ** 20, 1),
+                         'load_ms': round(best['load_s'] * 1E3, 1), 'wall_ms': round(best['wall_s'] * 1E3, 1),
+                         **{k: v for k, v in best.items() if k.endswith('_mb')}}
+        summary[name]['output'] = (best['sum'], best['abs_sum'])
+    summary['speedup'] = round(summary['pt']['load_ms'] / summary['safetensors']['load_ms'], 2)
+    (s0, a0), (s1, a1) = summary['pt'].pop('output'), summary['safetensors'].pop('output')
+    diff = max(abs(s0 - s1), abs(a0 - a1)) / max(a0, 1E-9)
+    summary['output_rel_diff'] = diff
+    print(json.dumps(summary))
+    if diff > opt.tol:
+        sys.exit(f'PARITY FAILURE: safetensors model outputs differ from the .pt model by {diff:.3g} (relative)')
+
+
+def ensemble(opt):
+    # Ensemble latency against the first model alone: members run sequentially or in parallel, fused with NMS or WBF.
+    # Sequential and parallel raw outputs must be identical
+    import numpy as np
+    import torch
+
+    from detect_engine import add_yolov5_path, read_image
+    from detect_numpy import letterbox
+
+    add_yolov5_path()
+    from models.experimental import attempt_load
+    from utils.general import non_max_suppression, weighted_boxes_fusion
+
+    assert len(opt.weights) > 1, 'pass at least two --weights to ensemble'
+    if opt.threads:
+        torch.set_num_threads(opt.threads)
+    single, ens = attempt_load(opt.weights[0], map_location='cpu'), attempt_load(opt.weights, map_location='cpu')
+    ims = [torch.from_numpy(np.ascontiguousarray(letterbox(read_image(f), opt.imgsz)[0].transpose((2, 0, 1))[::-1]))
+           [None].float() / 255 for f in image_files(opt.source)]
+
+    def run(model, x, fusion):
+        pred, out = model(x)
+        if fusion == 'wbf':
+            return pred, weighted_boxes_fusion(out, opt.conf, opt.iou)
+        return pred, non_max_suppression(pred, opt.conf, opt.iou)
+
+    configs = (('single', single, False, 'nms'), ('sequential_nms', ens, False, 'nms'),
+               ('parallel_nms', ens, True, 'nms'), ('parallel_wbf', ens, True, 'wbf'))
+    summary = {'benchmark': 'ensemble', 'models': len(opt.weights), 'images': len(ims),
+               'threads': torch.get_num_threads()}
+    raw = {}
+    with torch.no_grad():
+        for name, model, parallel, fusion in configs:
+            if model is ens:
+                ens.parallel = parallel
+            for x in ims:  # warmup
+                run(model, x, fusion)
+            dt, n = [], 0
+            for _ in range(opt.runs):
+                for x in ims:
+                    t = time.perf_counter()
+                    pred, det = run(model, x, fusion)
+                    dt.append(time.perf_counter() - t)
+                    n += det[0].shape[0]
+            raw[name] = [run(model, x, fusion)[0] for x in ims]
+            summary[name] = {**latency(dt), 'detections': round(n / len(dt), 2)}
+    for name, _, _, _ in configs[1:]:
+        summary[name]['vs_single'] = round(summary[name]['mean_ms'] / summary['single']['mean_ms'], 2)
+    summary['parallel_speedup'] = round(summary['sequential_nms']['mean_ms'] / summary['parallel_nms']['mean_ms'], 2)
+    mismatched = sum(not torch.equal(a, b) for a, b in zip(raw['sequential_nms'], raw['parallel_nms']))
+    summary['parallel_mismatched'] = mismatched
+    print(json.dumps(summary))
+    if mismatched:
+        sys.exit(f'PARITY FAILURE: parallel ensemble outputs differ from sequential ones on {mismatched} images')
+
+
+def tta(opt):
+    # Test-time augmentation latency: plain inference, the sequential _forward_augment() (three forward passes) and
+    # the batched one (one padded batch), and how many sequential TTA detections the batched path reproduces
+    import numpy as np
+    import torch
+
+    from detect_engine import add_yolov5_path, read_image
+    from detect_numpy import letterbox
+
+    add_yolov5_path()
+    from models.experimental import attempt_load
+    from utils.general import box_iou, non_max_suppression
+
+    if opt.threads:
+        torch.set_num_threads(opt.threads)
+    model = attempt_load(opt.weights, map_location='cpu')
+    ims = [torch.from_numpy(np.ascontiguousarray(letterbox(read_image(f), opt.imgsz)[0].transpose((2, 0, 1))[::-1]))
+           [None].float() / 255 for f in image_files(opt.source)]
+
+    summary = {'benchmark': 'tta', 'images': len(ims), 'threads': torch.get_num_threads()}
+    dets = {}
+    with torch.no_grad():
+        for name, augment, batched in ('plain', False, False), ('sequential', True, False), ('batched', True, True):
+            model.batched_augment = batched
+            for x in ims:  # warmup
+                model(x, augment=augment)
+            dt = []
+            for _ in range(opt.runs):
+                for x in ims:
+                    t = time.perf_counter()
+                    model(x, augment=augment)
+                    dt.append(time.perf_counter() - t)
+            dets[name] = [non_max_suppression(model(x, augment=augment)[0], opt.conf, opt.iou)[0] for x in ims]
+            summary[name] = {**latency(dt), 'detections': sum(len(d) for d in dets[name])}
+    summary['speedup'] = round(summary['sequential']['mean_ms'] / summary['batched']['mean_ms'], 2)
+    summary['tta_cost'] = {k: round(summary[k]['mean_ms'] / summary['plain']['mean_ms'], 2)
+                           for k in ('sequential', 'batched')}
+
+    # Sequential TTA detections with a same-class batched detection at IoU >= --match-iou
+    matched = total = 0
+    for a, b in zip(dets['sequential'], dets['batched']):
+        total += len(a)
+        if len(a) and len(b):
+            iou = box_iou(a[:, :4], b[:, :4]) * (a[:, 5:6] == b[:, 5].view(1, -1))
+            matched += int((iou.max(1)[0] >= opt.match_iou).sum())
+    summary['matched'] = round(matched / total, 4) if total else 1.0
+    print(json.dumps(summary))
+    if summary['matched'] < opt.min_matched:
+        sys.exit(f"REGRESSION: batched TTA reproduces {summary['matched']:.1%} of the sequential TTA detections")
+
+
+def synthetic_predictions(bs, n=25200, nc=80, boxes=20, imgsz=640, seed=0):
+    # Raw yolov5 outputs (bs, n, 5 + nc) xywh in pixels: background anchors with low objectness and about `boxes`
+    # objects per image, each predicted by a few jittered anchors
+    import torch
+
+    g = torch.Generator().manual_seed(seed)
+    p = torch.rand((bs, n, 5 + nc), generator=g)
+    p[..., :2] *= imgsz
+    p[..., 2:4] = p[..., 2:4] * imgsz / 4 + 4
+    p[..., 4] *= 0.2  # background, below the usual thresholds
+    for _ in range(4):  # anchors per object
+        k = torch.randint(0, n, (bs, boxes), generator=g)
+        obj = p[torch.arange(bs)[:, None], k]
+        obj[..., 4] = 0.5 + torch.rand((bs, boxes), generator=g) / 2
+        obj[..., 5:] = torch.rand((bs, boxes, nc), generator=g) ** 4
+        p[torch.arange(bs)[:, None], k] = obj
+    for b in range(bs):  # objects in the same place across their anchors
+        m = p[b, :, 4] > 0.5
+        p[b, m, :4] = (p[b, m, :4] / 40).round() * 40 + torch.rand((int(m.sum()), 4), generator=g) * 4
+    return p
+
+
+def threshold_pairs(p, iou, pairs, seed=1):
+    # Copy of raw predictions p with `pairs` confident box pairs per image whose exact IoU is the NMS threshold, on
+    # sub-pixel coordinates (a quarter of them starting just right of x=0): float rounding decides each suppression
+    import torch
+
+    g = torch.Generator().manual_seed(seed)
+    p = p.clone()
+    for b in range(p.shape[0]):
+        k = torch.randperm(p.shape[1], generator=g)[:2 * pairs].view(2, pairs)  # anchors of the pairs
+        w, h = (8 + torch.rand((2, pairs), generator=g) * 100).double()
+        cx, cy = torch.rand((2, pairs), generator=g).double() * 500 + torch.stack((w, h)) / 2
+        cx[::4] = w[::4] / 2 + torch.rand(len(cx[::4]), generator=g).double() * 1E-3  # near the left edge
+        d = w * (1 - iou) / (1 + iou)  # same-size boxes shifted by d overlap with IoU (w - d) / (w + d) = iou
+        for j, dx in enumerate((0, d)):
+            p[b, k[j], :4] = torch.stack((cx + dx, cy, w, h), 1).float()
+            p[b, k[j], 4] = 0.95 - 0.1 * j - torch.rand(pairs, generator=g) * 0.05
+            p[b, k[j], 5:] = 0
+            p[b, k[j], 5] = 1  # class 0, no class offset
+    return p
+
+
+def nms(opt):
+    # utils.general.non_max_suppression per-image loop vs the cross-image batched path across batch sizes, with
+    # identical outputs required, also for box pairs at exactly the IoU threshold
+    import torch
+
+    from detect_engine import add_yolov5_path
+
+    add_yolov5_path()
+    from utils.general import non_max_suppression
+
+    if opt.threads:
+        torch.set_num_threads(opt.threads)
+    summary = {'benchmark': 'nms', 'boxes_per_image': opt.boxes, 'multi_label': opt.multi_label, 'batch_sizes': {}}
+    mismatched = 0
+    for bs in opt.batch_sizes:
+        pred = synthetic_predictions(bs, nc=opt.nc, boxes=opt.boxes)
+        if opt.threshold_pairs:
+            pred = threshold_pairs(pred, opt.iou, opt.threshold_pairs)
+        row, out = {}, {}
+        for name, batched in ('per_image', False), ('batched', True):
+            f = partial(non_max_suppression, pred, opt.conf, opt.iou, multi_label=opt.multi_label, batched=batched)
+            out[name] = f()
+            dt = []
+            for _ in range(opt.runs):
+                t = time.perf_counter()
+                f()
+                dt.append(time.perf_counter() - t)
+            row[name] = {**latency(dt), 'per_image_ms': round(sum(dt) / len(dt) / bs * 1E3, 3)}
+        row['speedup'] = round(row['per_image']['mean_ms'] / row['batched']['mean_ms'], 2)
+        row['detections'] = sum(len(d) for d in out['batched'])
+        row['mismatched'] = sum(not torch.equal(a, b) for a, b in zip(out['per_image'], out['batched']))
+        mismatched += row['mismatched']
+        summary['batch_sizes'][bs] = row
+    print(json.dumps(summary))
+    if mismatched:
+        sys.exit(f'PARITY FAILURE: batched NMS output differs from the per-image loop on {mismatched} images')
+
+
+def nms_kernels(opt):
+    # torchvision.ops.nms vs the torchvision-free tiled greedy NMS in torch (utils.general.tiled_nms) and NumPy
+    # (detect_numpy.nms): kept indices must be identical for every candidate count and IoU threshold, latency table
+    import torch
+    import torchvision
+
+    import detect_numpy
+    from detect_engine import add_yolov5_path
+
+    add_yolov5_path()
+    from utils.general import tiled_nms
+
+    if opt.threads:
+        torch.set_num_threads(opt.threads)
+    g = torch.Generator().manual_seed(0)
+    rows, mismatched = [], []
+    for n in opt.counts:
+        # Candidates clustered around n / 10 objects, like raw detector output, some of them exact duplicates
+        centers = torch.rand((max(n // 10, 1), 2), generator=g) * 4000
+        xy = centers[torch.randint(0, len(centers), (n,), generator=g)] + torch.randn((n, 2), generator=g) * 8
+        wh = torch.rand((n, 2), generator=g) * 200 + 10
+        boxes = torch.cat((xy - wh / 2, xy + wh / 2), 1)
+        scores = torch.rand(n, generator=g)
+        d = n // 20
+        if d:  # duplicates, score ties
+            boxes[-d:], scores[-d:] = boxes[:d].clone(), scores[:d].clone()
+        b, sc = boxes.numpy(), scores.numpy()
+        kernels = {'torchvision': lambda t: torchvision.ops.nms(boxes, scores, t),
+                   'torch': lambda t: tiled_nms(boxes, scores, t),
+                   'numpy': lambda t: torch.from_numpy(detect_numpy.nms(b, sc, t))}
+        row = {'candidates': n}
+        for t in opt.iou:
+            ref = kernels['torchvision'](t)
+            for name in ('torch', 'numpy'):
+                if not torch.equal(kernels[name](t), ref):
+                    mismatched.append((name, n, t))
+        for name, f in kernels.items():
+            f(opt.iou[0])  # warmup
+            dt = []
+            for _ in range(opt.runs):
+                t = time.perf_counter()
+                f(opt.iou[0])
+                dt.append(time.perf_counter() - t)
+            row[f'{name}_ms'] = latency(dt)['p50_ms']
+        row['kept'] = len(kernels['torchvision'](opt.iou[0]))
+        rows.append(row)
+
+    print(f"{'candidates':>10} {'kept':>6} {'torchvision ms':>15} {'torch ms':>10} {'numpy ms':>10}", file=sys.stderr)
+    for r in rows:
+        print(f"{r['candidates']:>10} {r['kept']:>6} {r['torchvision_ms']:>15} {r['torch_ms']:>10} {r['numpy_ms']:>10}",
+              file=sys.stderr)
+    print(json.dumps({'benchmark': 'nms-kernels', 'iou': opt.iou, 'rows': rows, 'mismatched': mismatched}))
+    if mismatched:
+        sys.exit(f'PARITY FAILURE: kept indices differ from torchvision.ops.nms for (kernel, n, iou) {mismatched}')
+
+
+def prefilter(opt):
+    # Dense Detect decode + NMS vs the objectness pre-filter (Detect.conf_thres): NMS outputs must be identical,
+    # latency of forward + NMS and size of the Detect output
+    import numpy as np
+    import torch
+
+    from detect_engine import add_yolov5_path, read_image
+    from detect_numpy import letterbox
+
+    add_yolov5_path()
+    from models.experimental import attempt_load
+    from models.yolo import Detect
+    from utils.general import non_max_suppression
+
+    if opt.threads:
+        torch.set_num_threads(opt.threads)
+    model = attempt_load(opt.weights, map_location='cpu')
+    detect = [m for m in model.modules() if isinstance(m, Detect)]
+    imgs = [np.ascontiguousarray(letterbox(read_image(f), opt.imgsz)[0].transpose((2, 0, 1))[::-1])
+            for f in image_files(opt.source)]
+    batches = [torch.from_numpy(np.stack(imgs[i:i + opt.batch_size])).float() / 255
+               for i in range(0, len(imgs), opt.batch_size) if len({x.shape for x in imgs[i:i + opt.batch_size]}) == 1]
+    assert batches, 'no batch of equal letterboxed shapes, use --batch-size 1'
+
+    summary = {'benchmark': 'prefilter', 'images': sum(len(x) for x in batches), 'conf': opt.conf}
+    dets = {}
+    with torch.no_grad():
+        for name, conf in ('dense', None), ('prefilter', opt.conf):
+            for m in detect:
+                m.conf_thres = conf
+            for x in batches:  # warmup
+                model(x)
+            dt, rows, out = [], 0, []
+            for run in range(opt.runs):
+                for x in batches:
+                    t = time.perf_counter()
+                    y = model(x)[0]
+                    det = non_max_suppression(y, opt.conf, opt.iou)
+                    dt.append(time.perf_counter() - t)
+                    rows += y.shape[1]
+                    if not run:
+                        out += det
+            dets[name] = out
+            summary[name] = {**latency(dt), 'output_rows': round(rows / len(dt), 1)}
+    summary['speedup'] = round(summary['dense']['mean_ms'] / summary['prefilter']['mean_ms'], 2)
+    mismatched = sum(not torch.equal(a, b) for a, b in zip(dets['dense'], dets['prefilter']))
+    summary['mismatched'] = mismatched
+    print(json.dumps(summary))
+    if mismatched:
+        sys.exit(f'PARITY FAILURE: pre-filtered detections differ from the dense decode on {mismatched} images')
+
+
+def topk(opt):
+    # val.py at the serving confidence tiers with and without the per-class candidate cap: mAP and NMS ms per image
+    from detect_common import FALLBACK_CONF
+    from detect_custom import CONF_THRES
+    from detect_engine import add_yolov5_path
+
+    add_yolov5_path()
+    import val
+
+    kwargs = dict(data=opt.data, weights=opt.weights, batch_size=opt.batch_size, imgsz=opt.imgsz, device='cpu',
+                  half=False, plots=False, project=ML_DIR / 'runs/benchmarks', name='topk', exist_ok=True)
+    summary, failed = {'benchmark': 'topk', 'topk': opt.topk, 'max_drop': opt.max_drop}, []
+    for conf in opt.conf or (CONF_THRES, FALLBACK_CONF):
+        row = {}
+        for name, k in ('all', None), ('topk', opt.topk):
+            (_, _, map50, map95, *_), _, t = val.run(conf_thres=conf, topk=k, **kwargs)
+            row[name] = {'map50': round(map50, 4), 'map50_95': round(map95, 4), 'nms_ms': round(t[2], 3)}
+        row['map50_drop'] = round(row['all']['map50'] - row['topk']['map50'], 4)
+        row['nms_speedup'] = round(row['all']['nms_ms'] / max(row['topk']['nms_ms'], 1E-6), 2)
+        summary[str(conf)] = row
+        if row['map50_drop'] > opt.max_drop:
+            failed.append(conf)
+    print(json.dumps(summary))
+    if failed:
+        sys.exit(f'ACCURACY FAILURE: mAP@0.5 drop with topk={opt.topk} exceeds {opt.max_drop} at conf {failed}')
+
+
+def label_cache(opt):
+    # Synthetic labels caches of growing size in the pickled cache_version 0.5 format and the columnar memory-mapped
+    # one, each read in fresh interpreters: load time and memory must stay flat, labels must be identical
+    import numpy as np
+
+    from detect_engine import add_yolov5_path
+
+    add_yolov5_path()
+    from utils.datasets import save_label_cache
+
+    summary, failed = {'benchmark': 'label-cache', 'labels': opt.labels, 'runs': opt.runs}, []
+    with tempfile.TemporaryDirectory() as d:
+        for n in opt.images:
+            rng = np.random.default_rng(n)
+            files = [f'{d}/images/{i:07d}.jpg' for i in range(n)]
+            labels = [np.concatenate((rng.integers(0, 80, (k, 1)), rng.random((k, 4))), 1).astype(np.float32)
+                      for k in rng.integers(0, 2 * opt.labels + 1, n)]
+            shapes = rng.integers(320, 4032, (n, 2))
+            meta = {'hash': '', 'results': (n, 0, 0, 0, n), 'msgs': []}
+            legacy = {f: [l, tuple(s), []] for f, l, s in zip(files, labels, shapes.tolist())}
+            np.save(f'{d}/legacy.npy', {**legacy, **meta, 'version': 0.5})
+            save_label_cache(Path(d) / f'columnar{n}.cache', {
+                **meta, 'version': 0.6, 'files': files, 'shapes': shapes.astype(np.float64),
+                'labels': np.concatenate(labels, 0), 'label_index': np.cumsum([0] + [len(l) for l in labels]),
+                'segments': np.zeros((0, 2), dtype=np.float32), 'segment_index': np.zeros(1, dtype=np.int64),
+                'image_segments': np.zeros(n + 1, dtype=np.int64)})
+            del legacy, labels
+
+            row = {}
+            for name, path in ('pickled', f'{d}/legacy.npy'), ('columnar', f'{d}/columnar{n}.cache'):
+                code = LABEL_CACHE_CODE.format(yolov5=str(ML_DIR / 'yolov5'), ml=str(ML_DIR), path=path,
+                                               columnar=name == 'columnar', stride=max(n // 1000, 1))
+                runs = []
+                for _ in range(opt.runs):
+                    p = subprocess.run([sys.executable, '-c', code], cwd=str(ML_DIR), stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, universal_newlines=True)
+                    if p.returncode:
+                        print(p.stderr[-2000:], file=sys.stderr)
+                        sys.exit(f'ERROR: reading the {name} cache of {n} images failed with exit code {p.returncode}')
+                    runs.append(json.loads(p.stdout.strip().splitlines()[-1]))
+                best = min(runs, key=lambda x: x['load_s'])
+                row[name] = {'load_ms': round(best['load_s'] * 1E3, 1), 'rss_mb': round(best['rss_mb'], 1),
+                             'access_ms': round(best['access_s'] * 1E3, 2), 'checksum': (best['n'], best['checksum'])}
+            if row['pickled'].pop('checksum') != row['columnar'].pop('checksum'):
+                failed.append(f'{n} images: labels differ')
+            elif row['columnar']['load_ms'] > row['pickled']['load_ms']:
+                failed.append(f'{n} images: columnar load slower')
+            row['speedup'] = round(row['pickled']['load_ms'] / max(row['columnar']['load_ms'], 1E-3), 2)
+            summary[str(n)] = row
+    print(json.dumps(summary))
+    if failed:
+        sys.exit(f'FAILURE: {failed}')
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='benchmark')
+    sub.required = True
+
+    p = sub.add_parser('startup', help='cold-start import time of detect_custom.py')
+    p.add_argument('--max-ms', type=float, default=3000, help='fail if the cumulative import time exceeds this (0 off)')
+    p.add_argument('--runs', type=int, default=3, help='fresh interpreters to run, the fastest one is reported')
+    p.add_argument('--top', type=int, default=10, help='number of slowest imports made by detect_custom to report')
+    p.set_defaults(func=startup)
+
+    p = sub.add_parser('onnx', help='ONNX Runtime vs PyTorch parity and CPU latency')
+    p.add_argument('--weights', type=str, required=True, help='yolov5 *.pt weights')
+    p.add_argument('--onnx', type=str, default=None, help='exported model, default weights with .onnx suffix')
+    p.add_argument('source', type=str, help='image file, directory or glob')
+    p.add_argument('--conf', type=float, default=0.25, help='confidence threshold')
+    p.add_argument('--threads', type=int, default=None, help='intra-op CPU threads for both runtimes')
+    p.add_argument('--runs', type=int, default=5, help='timed runs per image')
+    p.add_argument('--box-tol', type=float, default=1.0, help='max box coordinate difference (pixels)')
+    p.add_argument('--conf-tol', type=float, default=1E-3, help='max confidence difference')
+    p.set_defaults(func=onnx)
+
+    p = sub.add_parser('conf-tiers', help='single-pass confidence fallback vs predicting twice, parity and latency')
+    p.add_argument('--weights', type=str, required=True, help='model weights')
+    p.add_argument('source', type=str, help='image file, directory or glob')
+    p.add_argument('--backend', type=str, default='yolov5', help='DetectionEngine backend for *.pt weights')
+    p.add_argument('--conf', type=float, default=0.25, help='initial confidence threshold')
+    p.add_argument('--imgsz', type=int, default=640, help='inference size (pixels)')
+    p.add_argument('--threads', type=int, default=None, help='intra-op CPU threads')
+    p.set_defaults(func=conf_tiers)
+
+    p = sub.add_parser('tiles', help='tiled vs single-shot yolov5 latency and label recall')
+    p.add_argument('--weights', type=str, required=True, help='yolov5 weights')
+    p.add_argument('source', type=str, help='image file, directory or glob, YOLO labels in ../labels are used')
+    p.add_argument('--conf', type=float, default=0.25, help='confidence threshold')
+    p.add_argument('--imgsz', type=int, default=640, help='inference size (pixels)')
+    p.add_argument('--tile', type=int, default=640, help='tile size (original pixels)')
+    p.add_argument('--overlap', type=float, default=0.2, help='fraction shared by neighbouring tiles')
+    p.add_argument('--max-tiles', type=int, default=16, help='tiles per image budget')
+    p.add_argument('--threads', type=int, default=None, help='intra-op CPU threads')
+    p.add_argument('--runs', type=int, default=3, help='timed runs per image')
+    p.add_argument('--iou', type=float, default=0.5, help='IoU for a detection to recall a label')
+    p.add_argument('--recall-tol', type=float, default=0.0, help='allowed tiled recall deficit vs single-shot')
+    p.set_defaults(func=tiles)
+
+    p = sub.add_parser('decode', help='full vs reduced-resolution JPEG decode + letterbox latency')
+    p.add_argument('source', type=str, nargs='?', default=None, help='image file, directory or glob (default synthetic)')
+    p.add_argument('--sizes', nargs='+', default=['1280x960', '2048x1536', '3264x2448', '4032x3024', '6000x4000'],
+                   help='synthetic upload sizes WxH when no source is given')
+    p.add_argument('--imgsz', type=int, default=640, help='inference size (pixels)')
+    p.add_argument('--runs', type=int, default=10, help='timed runs per image')
+    p.set_defaults(func=decode)
+
+    p = sub.add_parser('preprocess', help='legacy vs fused preprocessing latency, allocations and parity')
+    p.add_argument('source', type=str, help='image file, directory or glob')
+    p.add_argument('--imgsz', type=int, default=640, help='inference size (pixels)')
+    p.add_argument('--batch-size', type=int, default=16, help='maximum images per batch')
+    p.add_argument('--runs', type=int, default=10, help='timed runs over all images')
+    p.set_defaults(func=preprocess)
+
+    p = sub.add_parser('video', help='sampled walk-around scan vs every frame, cost and parts')
+    p.add_argument('--weights', type=str, required=True, help='yolov5 weights')
+    p.add_argument('source', type=str, help='walk-around video')
+    p.add_argument('--conf', type=float, default=0.25, help='confidence threshold')
+    p.add_argument('--threads', type=int, default=None, help='intra-op CPU threads')
+    p.add_argument('--batch-size', type=int, default=16, help='frames per batch')
+    p.add_argument('--stride', type=int, default=3, help='scan: decode every n-th frame')
+    p.add_argument('--threshold', type=float, default=12.0, help='scan: frame change score to sample')
+    p.add_argument('--max-gap', type=float, default=2.0, help='scan: max seconds between samples')
+    p.set_defaults(func=video)
+
+    p = sub.add_parser('grids', help='Detect grid cache vs rebuilding on shape changes, mixed-aspect traffic')
+    p.add_argument('--shapes', nargs='+', default=['480x640', '640x480', '640x640', '384x640', '640x384'],
+                   help='letterboxed input shapes HxW in the traffic')
+    p.add_argument('--requests', type=int, default=500, help='forward passes, shapes drawn at random')
+    p.add_argument('--batch-size', type=int, default=1, help='images per forward pass')
+    p.add_argument('--nc', type=int, default=80, help='number of classes')
+    p.add_argument('--cache-size', type=int, default=32, help='Detect.grid_cache_size for the cached run')
+    p.set_defaults(func=grids)
+
+    p = sub.add_parser('load', help='.pt vs memory-mapped .safetensors model load time, memory and parity')
+    p.add_argument('--weights', type=str, required=True, help='yolov5 *.pt weights')
+    p.add_argument('--safetensors', type=str, default=None, help='export, default weights with .safetensors suffix')
+    p.add_argument('--imgsz', type=int, default=640, help='parity check input size (pixels)')
+    p.add_argument('--runs', type=int, default=3, help='fresh interpreters per file, the fastest one is reported')
+    p.add_argument('--tol', type=float, default=1E-5, help='max relative output difference')
+    p.set_defaults(func=load)
+
+    p = sub.add_parser('ensemble', help='single model vs sequential/parallel ensemble latency, NMS vs WBF fusion')
+    p.add_argument('--weights', nargs='+', type=str, required=True, help='yolov5 weights, the first is the baseline')
+    p.add_argument('source', type=str, help='image file, directory or glob')
+    p.add_argument('--imgsz', type=int, default=640, help='inference size (pixels)')
+    p.add_argument('--conf', type=float, default=0.25, help='confidence threshold')
+    p.add_argument('--iou', type=float, default=0.45, help='NMS / WBF IoU threshold')
+    p.add_argument('--threads', type=int, default=None, help='intra-op CPU threads, shared by all members')
+    p.add_argument('--runs', type=int, default=5, help='timed runs over all images')
+    p.set_defaults(func=ensemble)
+
+    p = sub.add_parser('tta', help='sequential vs batched test-time augmentation latency and agreement')
+    p.add_argument('--weights', type=str, required=True, help='yolov5 *.pt weights')
+    p.add_argument('source', type=str, help='image file, directory or glob')
+    p.add_argument('--imgsz', type=int, default=640, help='inference size (pixels)')
+    p.add_argument('--conf', type=float, default=0.25, help='confidence threshold')
+    p.add_argument('--iou', type=float, default=0.45, help='NMS IoU threshold')
+    p.add_argument('--threads', type=int, default=None, help='intra-op CPU threads')
+    p.add_argument('--runs', type=int, default=5, help='timed runs over all images')
+    p.add_argument('--match-iou', type=float, default=0.9, help='IoU for a batched detection to match a sequential one')
+    p.add_argument('--min-matched', type=float, default=0.95, help='fail below this share of matched detections')
+    p.set_defaults(func=tta)
+
+    p = sub.add_parser('nms', help='per-image vs cross-image batched NMS latency and parity across batch sizes')
+    p.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4, 16, 32], help='images per NMS call')
+    p.add_argument('--boxes', type=int, default=20, help='objects per synthetic image')
+    p.add_argument('--nc', type=int, default=80, help='number of classes')
+    p.add_argument('--conf', type=float, default=0.25, help='confidence threshold')
+    p.add_argument('--iou', type=float, default=0.45, help='NMS IoU threshold')
+    p.add_argument('--multi-label', action='store_true', help='multiple labels per box, as in val.py')
+    p.add_argument('--threshold-pairs', type=int, default=20, help='box pairs per image with IoU exactly --iou')
+    p.add_argument('--threads', type=int, default=None, help='intra-op CPU threads')
+    p.add_argument('--runs', type=int, default=50, help='timed runs per batch size')
+    p.set_defaults(func=nms)
+
+    p = sub.add_parser('nms-kernels', help='torchvision vs torch / NumPy tiled NMS parity and latency by candidates')
+    p.add_argument('--counts', nargs='+', type=int, default=[100, 300, 1000, 3000, 10000, 30000],
+                   help='candidate boxes per NMS call')
+    p.add_argument('--iou', nargs='+', type=float, default=[0.45, 0.3, 0.5, 0.6, 0.7],
+                   help='IoU thresholds checked for parity, the first one is timed')
+    p.add_argument('--threads', type=int, default=None, help='intra-op CPU threads')
+    p.add_argument('--runs', type=int, default=10, help='timed runs per kernel and count')
+    p.set_defaults(func=nms_kernels)
+
+    p = sub.add_parser('prefilter', help='Detect objectness pre-filter vs dense decode, NMS parity and latency')
+    p.add_argument('--weights', type=str, required=True, help='yolov5 *.pt weights')
+    p.add_argument('source', type=str, help='image file, directory or glob')
+    p.add_argument('--imgsz', type=int, default=640, help='inference size (pixels)')
+    p.add_argument('--batch-size', type=int, default=1, help='images per forward pass (equal letterboxed shapes)')
+    p.add_argument('--conf', type=float, default=0.25, help='confidence threshold, also the pre-filter threshold')
+    p.add_argument('--iou', type=float, default=0.45, help='NMS IoU threshold')
+    p.add_argument('--threads', type=int, default=None, help='intra-op CPU threads')
+    p.add_argument('--runs', type=int, default=5, help='timed runs over all images')
+    p.set_defaults(func=prefilter)
+
+    p = sub.add_parser('topk', help='NMS with vs without the per-class top-k candidate cap, mAP and NMS latency')
+    p.add_argument('--weights', type=str, required=True, help='yolov5 weights')
+    p.add_argument('--data', type=str, required=True, help='dataset.yaml, its val split is used')
+    p.add_argument('--topk', type=int, default=100, help='candidates kept per class and image')
+    p.add_argument('--conf', nargs='+', type=float, default=None, help='confidence thresholds (default 0.25 0.05)')
+    p.add_argument('--imgsz', type=int, default=640, help='inference size (pixels)')
+    p.add_argument('--batch-size', type=int, default=16, help='val.py batch size')
+    p.add_argument('--max-drop', type=float, default=0.005, help='max allowed mAP@0.5 drop at any threshold')
+    p.set_defaults(func=topk)
+
+    p = sub.add_parser('label-cache', help='pickled vs columnar memory-mapped labels cache load time and memory')
+    p.add_argument('--images', nargs='+', type=int, default=[10000, 100000, 500000], help='synthetic dataset sizes')
+    p.add_argument('--labels', type=int, default=3, help='mean labels per image')
+    p.add_argument('--runs', type=int, default=3, help='fresh interpreters per cache, the fastest one is reported')
+    p.set_defaults(func=label_cache)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
+    opt.func(opt)
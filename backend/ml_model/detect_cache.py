@@ -0,0 +1,161 @@
+"""
+Content-addressed on-disk cache for detection results, shared by the detect_* scripts.
+
+Results are keyed by a hash of the image bytes, the weights file and the detection settings, and stored in a single
+SQLite file with size-based LRU eviction and hit/miss counters. Entries are dropped whenever class_map.json changes.
+
+Enable it by pointing DETECT_CACHE_PATH at a writable file (DETECT_CACHE_MAX_MB sets the size budget, default 256):
+    $ DETECT_CACHE_PATH=/var/cache/snapquote/detections.sqlite python detect_ultra.py best.pt car.jpg
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+CLASS_MAP_FILE = Path(__file__).resolve().parent / 'class_map.json'
+
+
+def file_digest(path, chunk=1 << 20):
+    # sha256 of a file's contents
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for b in iter(lambda: f.read(chunk), b''):
+            h.update(b)
+    return h.hexdigest()
+
+
+class DetectionCache:
+    def __init__(self, path, max_bytes=256 * 2 ** 20, class_map=CLASS_MAP_FILE):
+        self.path = Path(path)
+        self.max_bytes = int(max_bytes)
+        self.lock = threading.Lock()  # one connection shared by worker threads
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')  # concurrent readers across detect processes
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS entries '
+                            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS weights '
+                            '(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            self.db.execute("INSERT OR IGNORE INTO meta VALUES ('hits', '0'), ('misses', '0')")
+        self.class_map_hash = self._check_class_map(class_map)
+
+    @classmethod
+    def from_env(cls):
+        # Cache configured through DETECT_CACHE_PATH / DETECT_CACHE_MAX_MB, or None when disabled or unusable
+        path = os.getenv('DETECT_CACHE_PATH')
+        if not path:
+            return None
+        try:
+            return cls(path, max_bytes=float(os.getenv('DETECT_CACHE_MAX_MB', 256)) * 2 ** 20)
+        except Exception as e:
+            print(f'[DEBUG] Detection cache disabled, failed to open {path}: {e}', file=sys.stderr)
+            return None
+
+    def _check_class_map(self, class_map):
+        # Invalidate all entries when class_map.json content differs from the one the entries were built with
+        digest = file_digest(class_map) if class_map and Path(class_map).is_file() else ''
+        with self.lock, self.db:
+            row = self.db.execute("SELECT value FROM meta WHERE name = 'class_map'").fetchone()
+            if row is None or row[0] != digest:
+                if row is not None:
+                    print('[DEBUG] class_map.json changed, clearing detection cache', file=sys.stderr)
+                self.db.execute('DELETE FROM entries')
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('class_map', ?)", (digest,))
+        return digest
+
+    def weights_digest(self, weights):
+        # Content hash of a weights file, memoized per (path, size, mtime) so large checkpoints are hashed once
+        p = Path(weights)
+        if not p.is_file():
+            return hashlib.sha256(str(weights).encode()).hexdigest()  # model name, i.e. 'yolo11n.pt' auto-download
+        st, key = p.stat(), str(p.resolve())
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime_ns, digest FROM weights WHERE path = ?', (key,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        digest = file_digest(p)
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO weights VALUES (?, ?, ?, ?)',
+                            (key, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def key(self, image, weights, **settings):
+        # Cache key from image bytes, weights and detection settings (conf, iou, imgsz, backend, ...)
+        h = hashlib.sha256()
+        h.update(file_digest(image).encode())
+        h.update(self.weights_digest(weights).encode())
+        h.update(self.class_map_hash.encode())
+        h.update(json.dumps(settings, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        with self.lock, self.db:
+            row = self.db.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.db.execute("UPDATE meta SET value = value + 1 WHERE name = 'misses'")
+                return None
+            self.db.execute('UPDATE entries SET atime = ? WHERE key = ?', (time.time(), key))
+            self.db.execute("UPDATE meta SET value = value + 1 WHERE name = 'hits'")
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        value = json.dumps(result)
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                            (key, value, len(value), time.time()))
+            self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes
+        excess = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        drop = []
+        for key, size in self.db.execute('SELECT key, size FROM entries ORDER BY atime'):
+            drop.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.db.executemany('DELETE FROM entries WHERE key = ?', drop)
+
+    def lookup(self, image, weights, **settings):
+        # (key, cached result or None) for callers; cache failures are logged and treated as a miss
+        try:
+            key = self.key(image, weights, **settings)
+            return key, self.get(key)
+        except Exception as e:
+            print(f'[DEBUG] Detection cache lookup failed: {e}', file=sys.stderr)
+            return None, None
+
+    def rekey(self, image, weights, **settings):
+        # key() for settings only known after lookup(), i.e. a CPU profile tuned by the first prediction. None (the
+        # result is not stored) when it fails
+        try:
+            return self.key(image, weights, **settings)
+        except Exception as e:
+            print(f'[DEBUG] Detection cache key failed: {e}', file=sys.stderr)
+            return None
+
+    def store(self, key, result):
+        if key is not None:
+            try:
+                self.put(key, result)
+            except Exception as e:
+                print(f'[DEBUG] Detection cache store failed: {e}', file=sys.stderr)
+
+    def stats(self):
+        with self.lock:
+            meta = dict(self.db.execute("SELECT name, value FROM meta WHERE name IN ('hits', 'misses')"))
+            n, size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {'hits': int(meta['hits']), 'misses': int(meta['misses']), 'entries': n, 'bytes': size}
+
+    def close(self):
+        self.db.close()
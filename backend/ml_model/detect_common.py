@@ -0,0 +1,34 @@
+"""
+Helpers shared by the detect_* scripts
+"""
+
+FALLBACK_CONF = 0.05  # low-confidence retry threshold when the first tier finds nothing
+
+
+def allows_fallback(user_conf, initial_conf):
+    # Auto fallback unless the user explicitly set a very low threshold already
+    return user_conf is None or initial_conf > 0.06
+
+
+def inference_conf(initial_conf, fallback=True, fallback_conf=FALLBACK_CONF):
+    # Threshold to run the single inference pass at: the lowest tier that may be reported
+    return min(initial_conf, fallback_conf) if fallback else initial_conf
+
+
+def select_conf_tier(confs, initial_conf, fallback=True, fallback_conf=FALLBACK_CONF):
+    """
+    Pick the reported confidence tier from one pass run at inference_conf().
+
+    Equivalent to the former two-pass behaviour (predict at initial_conf, re-predict at fallback_conf if empty):
+    greedy NMS only lets a box be suppressed by a higher-scoring one, so the boxes scoring above initial_conf after
+    a low-threshold pass are exactly the boxes a pass at initial_conf would return. The max_det/max_nms caps keep
+    the highest scores first, so they do not change that set either.
+
+    Arguments:
+        confs: iterable of per-result confidence tensors/arrays from the low-threshold pass
+    Returns:
+        threshold to filter retained boxes with (`conf > threshold`), reported as confidence_used
+    """
+    if not fallback or any((c > initial_conf).any() for c in confs if len(c)):
+        return initial_conf
+    return fallback_conf
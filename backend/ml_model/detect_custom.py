@@ -1,8 +1,10 @@
-import torch
 import argparse
+import glob
 import json
+import os
 from pathlib import Path
 import sys
+import time
 
 # ✅ Ensure yolov5 and its parent are first on sys.path so that `models`, `utils` resolve
 current_dir = Path(__file__).resolve().parent
@@ -17,91 +19,108 @@ if str(parent_dir) not in sys.path:
 
 print(f"[detect_custom] sys.path configured. yolov5 dir: {yolo_dir}")
 
-from models.experimental import attempt_load
-from utils.datasets import LoadImages
-from utils.general import non_max_suppression, scale_coords
-from utils.torch_utils import select_device
-
-# 🧠 Add safe globals for Ultralytics model
-# NOTE: Removed prior add_safe_globals usage. Passing strings to add_safe_globals caused
-# PyTorch's weights-only unpickler to iterate over a string object and raise
-# AttributeError ('str' object has no attribute __module__). If you truly need to
-# authorize custom classes, import the actual class object and pass that object, e.g.:
-#   from ultralytics.nn.tasks import DetectionModel
-#   add_safe_globals([DetectionModel])
-# For this checkpoint we attempt normal load without extending safe globals.
-
-# Parse args
-parser = argparse.ArgumentParser()
-parser.add_argument('--weights', type=str, required=True)
-parser.add_argument('source', type=str)
-opt = parser.parse_args()
-
-# Setup
-device = select_device('cpu')
-imgsz = 640
-
-# ✅ Load YOLOv5 model using attempt_load; fallback to manual extraction if needed
-load_err = None
-model = None
-names = {}
-try:
-    model = attempt_load(opt.weights, map_location=device)
-    names = model.names if hasattr(model, 'names') else {}
-except Exception as e:
-    load_err = e
-    print(f"[detect_custom] attempt_load failed: {e}; trying manual torch.load fallback", file=sys.stderr)
-    try:
-        ckpt = torch.load(opt.weights, map_location=device)
-        # ckpt may be dict with 'model' key
-        if isinstance(ckpt, dict) and 'model' in ckpt:
-            model = ckpt['model']
-            if hasattr(model, 'float'):
-                model.float().eval()
-            names = getattr(model, 'names', {}) or getattr(getattr(model, 'model', {}), 'names', {})
-        else:
-            # last resort assume loaded object is already the model
-            model = ckpt
-            if hasattr(model, 'eval'):
-                model.eval()
-            names = getattr(model, 'names', {})
-    except Exception as e2:
-        print(f"[detect_custom] FATAL: fallback load failed: {e2}", file=sys.stderr)
-        raise e2
-
-if model is None:
-    raise RuntimeError(f"Failed to load model. attempt_load error: {load_err}")
-
-if not names:
-    # If class names missing, create index-based mapping
-    try:
-        nc = getattr(model, 'nc', None) or getattr(getattr(model, 'model', {}), 'nc', None) or 0
-        names = {i: f'class_{i}' for i in range(int(nc))}
-    except Exception:
-        names = {}
-
-# Load image
-dataset = LoadImages(opt.source, img_size=imgsz)
-
-# Detection
-for path, img, im0s, vid_cap in dataset:
-    # img: numpy with shape (3, h, w) from LoadImages already letterboxed
-    img_tensor = torch.from_numpy(img).to(device)
-    img_tensor = img_tensor.float() / 255.0
-    if img_tensor.ndimension() == 3:
-        img_tensor = img_tensor.unsqueeze(0)
-
-    with torch.no_grad():
-        pred = model(img_tensor, augment=False)[0]
-    pred = non_max_suppression(pred, 0.25, 0.45)
-
-    result_parts = []
-    for det in pred:
-        if det is not None and len(det):
-            det[:, :4] = scale_coords(img_tensor.shape[2:], det[:, :4], im0s.shape).round()
-            for *xyxy, conf, cls in det:
-                idx = int(cls.item() if hasattr(cls, 'item') else int(cls))
-                part_name = names.get(idx, f'class_{idx}') if isinstance(names, dict) else names[idx] if isinstance(names, (list, tuple)) and idx < len(names) else str(idx)
-                result_parts.append(part_name)
-
-    print(json.dumps({"parts": result_parts}))
+from detect_cache import DetectionCache
+from detect_engine import DetectionEngine
+from detect_timing import TimingLog
+from detect_video import FrameSampler, scan_video
+
+from utils.datasets import IMG_FORMATS, LoadImages, LoadImagesPrefetch
+
+CONF_THRES, IOU_THRES = 0.25, 0.45
+BATCH_CHUNK = 4  # --batch: forward passes worth of images decoded and reported per detect_batch() call
+OUTPUT_KEYS = ("image", "parts", "detections", "confidence_used", "error", "timings")  # JSON line fields, in order
+
+
+def make_engine(weights, batch_size=16, threads=None, optimize=False, timings=False, tile=0, tile_overlap=0.2,
+                max_tiles=16, reduced_decode=False, topk=None):
+    # yolov5 engine (attempt_load, torch.load fallback; *.onnx weights run on ONNX Runtime) reporting the model's own
+    # class names and whole-pixel boxes, no confidence fallback. The model is loaded on the first cache miss. In tiled
+    # mode the batch size is raised so all tiles of an image go through one forward pass
+    return DetectionEngine(weights, backend='yolov5', conf=CONF_THRES, iou=IOU_THRES, imgsz=640, device='cpu',
+                           batch_size=max(batch_size, max_tiles + 1 if tile else 0), threads=threads,
+                           optimize=optimize, fallback=False, class_map=None, cache=DetectionCache.from_env(),
+                           timings=TimingLog.from_env(timings), tile=tile, tile_overlap=tile_overlap,
+                           max_tiles=max_tiles, reduced_decode=reduced_decode, topk=topk, round_coords=True)
+
+
+def collect_sources(source):
+    # Expand a directory, glob or *.txt manifest (one image path per line) into a list of image files
+    p = str(Path(source).resolve())
+    if '*' in source:
+        files = sorted(glob.glob(source, recursive=True))  # glob
+    elif os.path.isdir(p):
+        files = sorted(glob.glob(os.path.join(p, '*.*')))  # dir
+    elif p.endswith('.txt') and os.path.isfile(p):
+        with open(p, 'r') as f:  # manifest, relative entries resolve against the manifest's directory
+            parent = Path(p).parent
+            files = [str(parent / x.strip()) for x in f.read().strip().splitlines() if x.strip()]
+    elif os.path.isfile(p):
+        files = [p]  # files
+    else:
+        raise Exception(f'ERROR: {p} does not exist')
+    return [x for x in files if x.split('.')[-1].lower() in IMG_FORMATS]
+
+
+def main(opt):
+    engine = make_engine(opt.weights, opt.batch_size, opt.threads, opt.optimize, opt.timings, opt.tile,
+                         opt.tile_overlap, opt.max_tiles, opt.reduced_decode, opt.topk)
+
+    if opt.scan:
+        sampler = FrameSampler(stride=opt.scan_stride, threshold=opt.scan_threshold, max_gap=opt.scan_max_gap)
+        print(json.dumps(scan_video(engine, opt.source, sampler, min_hits=opt.min_hits, evidence_dir=opt.evidence_dir)))
+        return
+
+    if opt.batch:
+        files = collect_sources(opt.source)
+        assert files, f'No images found in {opt.source}'
+        n = BATCH_CHUNK * engine.kwargs['batch_size']  # images decoded at a time, bounds memory on large sources
+        for i in range(0, len(files), n):
+            for r in engine.detect_batch(files[i:i + n]):  # shape-bucketed batched inference, cached per image
+                print(json.dumps({k: r[k] for k in OUTPUT_KEYS if k in r}), flush=True)
+        return
+
+    # Load image, with --prefetch decoded and letterboxed ahead of the model on a thread pool
+    if opt.prefetch:
+        dataset = LoadImagesPrefetch(opt.source, img_size=engine.imgsz, reduce=engine.reduced_decode,
+                                     workers=opt.prefetch, prefetch=2 * opt.prefetch)
+    else:
+        dataset = LoadImages(opt.source, img_size=engine.imgsz, reduce=engine.reduced_decode)
+
+    # Detection, reusing the loader's letterboxed img; video frames are passed as arrays and never cached.
+    # The loader's decode + letterbox time is reported as the "load" stage
+    t = time.perf_counter()
+    for path, img, im0s, vid_cap in dataset:
+        load_s = time.perf_counter() - t
+        r = engine.detect_batch([path if dataset.mode == 'image' else im0s], loaded=[(img, im0s, dataset.shape0)],
+                                load_s=[load_s])[0]
+        print(json.dumps({k: r[k] for k in OUTPUT_KEYS[1:] if k in r}))  # boxes and confidences for severity
+        t = time.perf_counter()
+    if opt.prefetch:
+        print(f"[DEBUG] Prefetch loader {json.dumps(dataset.stats())}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    # Parse args
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, required=True,
+                        help='yolov5 *.pt, or *.safetensors / *.onnx / *.torchscript.pt export')
+    parser.add_argument('source', type=str, help='image, with --batch a directory, glob or *.txt manifest, '
+                                                 'with --scan a walk-around video')
+    parser.add_argument('--batch', action='store_true', help='batched inference, one JSON line per image')
+    parser.add_argument('--batch-size', type=int, default=16, help='maximum images per forward pass in --batch mode')
+    parser.add_argument('--threads', type=int, default=None, help='intra-op CPU threads (torch / ONNX Runtime)')
+    parser.add_argument('--optimize', action='store_true', help='auto-tuned CPU profile, saved next to the weights')
+    parser.add_argument('--timings', action='store_true', help='per-stage latencies (ms) in the JSON output')
+    parser.add_argument('--tile', type=int, default=0, help='tiled inference window (original pixels), 0 off')
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help='fraction shared by neighbouring tiles')
+    parser.add_argument('--max-tiles', type=int, default=16, help='tiles per image budget, tiles grow to fit it')
+    parser.add_argument('--reduced-decode', action='store_true', help='decode large JPEGs at 1/2, 1/4 or 1/8 scale')
+    parser.add_argument('--topk', type=int, default=None, help='NMS candidates kept per class and image, default all')
+    parser.add_argument('--prefetch', type=int, default=0, help='loader threads decoding images ahead, 0 off')
+    parser.add_argument('--scan', action='store_true', help='video damage scan, one aggregated JSON result')
+    parser.add_argument('--scan-stride', type=int, default=3, help='--scan: decode every n-th frame')
+    parser.add_argument('--scan-threshold', type=float, default=12.0, help='--scan: frame change score to sample')
+    parser.add_argument('--scan-max-gap', type=float, default=2.0, help='--scan: max seconds between samples')
+    parser.add_argument('--min-hits', type=int, default=1, help='--scan: frames a part must be detected in')
+    parser.add_argument('--evidence-dir', type=str, default=None, help='--scan: save best evidence frames here')
+    main(parser.parse_args())
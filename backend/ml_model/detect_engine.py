@@ -0,0 +1,583 @@
+"""
+Detection engine shared by the detect_* scripts, importable in-process from a server.
+
+A DetectionEngine owns one model backend and the post-processing shared by all of them: confidence fallback tiering,
+class_map.json mapping, ordered part de-duplication, result caching and batching. Backends only turn images into
+per-image (n, 6) float32 arrays [x1, y1, x2, y2, conf, cls] in original image pixels.
+
+Usage:
+    from detect_engine import DetectionEngine
+    engine = DetectionEngine('weights/best.pt', backend='ultralytics')    # model is loaded on first use
+    engine.detect('car.jpg', conf=0.25)          # {"parts", "detections", "confidence_used", "image"}
+    engine.detect_batch(['a.jpg', 'b.jpg'])      # one result per image, in input order
+
+Backends:
+    yolov5       yolov5 checkpoints through models.experimental.attempt_load
+    torchscript  yolov5 *.torchscript.pt exported by yolov5/export.py
+    onnx         yolov5 *.onnx exported by yolov5/export.py, run by ONNX Runtime on CPU without torch
+    ultralytics  ultralytics YOLO (YOLOv5u/v8/v11 checkpoints or model names)
+"""
+
+import json
+import sys
+import threading
+import time
+from functools import partial
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from detect_common import FALLBACK_CONF, allows_fallback, inference_conf, select_conf_tier
+from detect_tiles import merge, tile_grid
+from detect_timing import NullTimer, Profile, StageTimer, as_ms
+import detect_numpy
+
+ML_DIR = Path(__file__).resolve().parent
+YOLOV5_DIR = ML_DIR / 'yolov5'
+CLASS_MAP_FILE = ML_DIR / 'class_map.json'
+UPLOAD_SHAPES = ((3024, 4032), (4032, 3024), (1080, 1920), (1920, 1080), (1080, 1080))  # common phone photo (h, w)
+
+
+def load_class_map(file=CLASS_MAP_FILE):
+    # {'0': 'bumper', ...} from class_map.json, empty when missing or unreadable
+    try:
+        with open(file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"[DEBUG] Failed to load {file}: {e}", file=sys.stderr)
+        return {}
+
+
+def add_yolov5_path():
+    # Put yolov5 and its parent first on sys.path so that `models`, `utils` resolve over any installed packages
+    for p in YOLOV5_DIR, YOLOV5_DIR.parent:
+        if str(p) not in sys.path:
+            sys.path.insert(0, str(p))
+
+
+def read_image(path):
+    # BGR HWC uint8 image
+    im = cv2.imread(str(path))
+    if im is None:
+        raise FileNotFoundError(f'Image Not Found {path}')
+    return im
+
+
+def read_image_reduced(path, img_size=640):
+    # BGR HWC uint8 image, JPEGs decoded at the smallest 1/2, 1/4 or 1/8 scale still >= img_size, and its original
+    # (height, width). Detections on it are mapped back with detect_numpy.rescale_coords
+    im, shape0 = detect_numpy.imread_reduced(path, img_size)
+    if im is None:
+        raise FileNotFoundError(f'Image Not Found {path}')
+    return im, shape0
+
+
+class InputBuffers:
+    # Reusable float32 (n, 3, h, w) model inputs, one per letterboxed (h, w) shape grown to the largest n requested.
+    # The least recently used shape is dropped beyond max_shapes
+    def __init__(self, empty, max_shapes=8):
+        self.empty = empty  # shape -> uninitialized float32 np.ndarray or torch.Tensor
+        self.max_shapes = max_shapes
+        self.buffers = {}
+
+    def get(self, n, shape):
+        buf = self.buffers.pop(shape, None)
+        if buf is None or len(buf) < n:
+            buf = self.empty((n, 3, *shape))
+        self.buffers[shape] = buf  # most recently used last
+        if len(self.buffers) > self.max_shapes:
+            self.buffers.pop(next(iter(self.buffers)))
+        return buf[:n]
+
+
+class Backend:
+    # Model runtime: original BGR images in, per-image (n, 6) arrays [xyxy, conf, cls] in original pixels out
+    name = None
+    iou = 0.45  # default NMS IoU threshold
+    profile = Profile  # stage timer class, see detect_timing.py
+
+    def __init__(self, weights, imgsz=640, iou=None, device=None, batch_size=16, threads=None, optimize=False,
+                 topk=None):
+        self.weights = weights
+        self.imgsz = imgsz
+        self.iou = self.iou if iou is None else iou
+        self.device = device  # None: cpu for yolov5, the runtime's own default otherwise
+        self.batch_size = batch_size
+        self.threads = threads  # intra-op CPU threads, None for the runtime default
+        self.optimize = optimize  # auto-tuned CPU inference profile, see detect_tune.py
+        self.topk = topk  # NMS candidates kept per class and image, None for all
+        self.names = {}  # class id -> model class name, dict or list
+        self.buffers = InputBuffers(lambda shape: np.empty(shape, dtype=np.float32))
+
+    def predict(self, ims, conf, imgs=None, dt=NullTimer()):
+        # ims: list of BGR HWC originals, imgs: optional matching letterboxed CHW RGB arrays (i.e. from LoadImages),
+        # dt: detect_timing.StageTimer over ims, times the letterbox, forward, nms and scale_coords stages
+        raise NotImplementedError
+
+    def letterbox_shapes(self, ims, imgs=None):
+        # Letterboxed (h, w) of each image, the loader's when its imgs are usable, else computed without resizing
+        if imgs is not None and self.auto:
+            return [img.shape[1:] for img in imgs]
+        return [detect_numpy.letterbox_shape(im0.shape[:2], self.imgsz, self.auto, stride=self.stride)[2] for im0 in ims]
+
+    def fill(self, x, chunk, ims, imgs=None, dt=NullTimer()):
+        # Write the letterboxed, RGB, CHW, 0-1 float32 inputs of images chunk straight into x, a (len(chunk), 3, h, w)
+        # array from self.buffers: no intermediate letterboxed, transposed, stacked or float copies
+        for k, i in enumerate(chunk):
+            with dt('letterbox', [i]):
+                if imgs is not None and self.auto:  # letterboxed uint8 CHW RGB from the loader
+                    np.divide(imgs[i], np.float32(255), out=x[k], dtype=np.float32)
+                else:
+                    detect_numpy.letterbox_into(ims[i], x[k], self.imgsz, auto=self.auto, stride=self.stride)
+        return x
+
+    def batches(self, shapes):
+        # Index chunks of at most batch_size images sharing one letterboxed shape
+        buckets = {}
+        for i, shape in enumerate(shapes):
+            buckets.setdefault(tuple(shape), []).append(i)
+        for idx in buckets.values():
+            for j in range(0, len(idx), self.batch_size):
+                yield idx[j:j + self.batch_size]
+
+
+class YOLOv5Backend(Backend):
+    name = 'yolov5'
+    auto = True  # minimum rectangle letterbox, model accepts any stride multiple
+    prefilter = True  # eager models decode only anchors that may clear conf (Detect.conf_thres), same NMS output
+
+    def __init__(self, weights, **kwargs):
+        super().__init__(weights, **kwargs)
+        add_yolov5_path()
+        import torch
+        from utils.general import Profile
+        from utils.torch_utils import select_device
+
+        self.profile = partial(Profile, verbose=False)  # CUDA-synchronized stage timings
+        self.device = select_device(self.device or 'cpu')
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        self.buffers = InputBuffers(lambda shape: torch.empty(shape, dtype=torch.float32))  # CPU, shared with numpy
+        self.model, self.names = self.load()
+        self.stride = int(self.model.stride.max()) if hasattr(self.model, 'stride') else 32
+        self.warmup_grids(UPLOAD_SHAPES)
+        self.runner = None  # detect_tune.CpuRunner, created on the first forward pass when optimizing
+
+    def load(self):
+        # attempt_load, with a manual torch.load fallback for checkpoints it cannot handle.
+        # NOTE: no torch.serialization.add_safe_globals here. Passing strings to add_safe_globals makes PyTorch's
+        # weights-only unpickler iterate over a string object and raise AttributeError ('str' object has no
+        # attribute __module__). To authorize custom classes pass the class objects themselves, e.g.:
+        #   from ultralytics.nn.tasks import DetectionModel
+        #   add_safe_globals([DetectionModel])
+        import torch
+        from models.experimental import attempt_load
+
+        try:
+            model = attempt_load(self.weights, map_location=self.device)
+        except Exception as e:
+            print(f"[DEBUG] attempt_load failed: {e}; trying manual torch.load fallback", file=sys.stderr)
+            ckpt = torch.load(self.weights, map_location=self.device)
+            model = ckpt['model'] if isinstance(ckpt, dict) and 'model' in ckpt else ckpt  # else assume the model
+            if hasattr(model, 'float'):
+                model.float()
+            if hasattr(model, 'eval'):
+                model.eval()
+        names = getattr(model, 'names', None) or getattr(getattr(model, 'model', None), 'names', None)
+        if not names:  # index-based names
+            nc = getattr(model, 'nc', None) or getattr(getattr(model, 'model', None), 'nc', None) or 0
+            names = {i: f'class_{i}' for i in range(int(nc))}
+        return model, names
+
+    def warmup_grids(self, shapes):
+        # Build the Detect grids of the letterboxed shapes of common upload sizes, so the first portrait or landscape
+        # request does not pay for them
+        from models.yolo import Detect
+
+        shapes = {detect_numpy.letterbox_shape(s, self.imgsz, self.auto, stride=self.stride)[2] for s in shapes}
+        for m in self.model.modules():
+            if isinstance(m, Detect):
+                m.warmup(shapes)
+
+    def set_prefilter(self, conf):
+        # Objectness pre-filter of the eager model's Detect layers at this request's NMS threshold. Traced models
+        # (TorchScript exports, tuned CPU runners) need the dense output and have no Detect modules to set
+        from models.yolo import Detect
+
+        if self.prefilter and not (self.optimize and self.device.type == 'cpu'):
+            for m in self.model.modules():
+                if isinstance(m, Detect):
+                    m.conf_thres = conf
+
+    def forward(self, x):
+        if self.optimize and self.device.type == 'cpu':
+            if self.runner is None:  # tuned on the real model and input shape, or loaded from a saved profile
+                from detect_tune import CpuRunner
+                self.runner = CpuRunner.load_or_tune(self.model, self.weights, x)
+            return self.runner(x)
+        return self.model(x, augment=False)[0]
+
+    def predict(self, ims, conf, imgs=None, dt=NullTimer()):
+        # Group equal letterboxed shapes into buckets and run each bucket as batched forward passes + NMS
+        import torch
+        from utils.general import non_max_suppression, scale_coords
+
+        shapes = self.letterbox_shapes(ims, imgs)
+        out = [None] * len(ims)
+        self.set_prefilter(conf)
+        with torch.no_grad():
+            for chunk in self.batches(shapes):
+                x = self.buffers.get(len(chunk), shapes[chunk[0]])
+                self.fill(x.numpy(), chunk, ims, imgs, dt)
+                with dt('forward', chunk):
+                    y = self.forward(x.to(self.device))
+                with dt('nms', chunk):
+                    pred = non_max_suppression(y, conf, self.iou, topk=self.topk)
+                for i, det in zip(chunk, pred):
+                    with dt('scale_coords', [i]):
+                        det[:, :4] = scale_coords(x.shape[2:], det[:, :4], ims[i].shape)
+                        out[i] = det.cpu().numpy()
+        return out
+
+
+class TorchScriptBackend(YOLOv5Backend):
+    # yolov5 export.py --include torchscript, traced at a fixed square input shape
+    name = 'torchscript'
+    auto = False
+
+    def load(self):
+        import torch
+
+        model = torch.jit.load(str(self.weights), map_location=self.device)
+        model.eval()
+        return model, {}  # class names are not stored in the export, class_map.json provides them
+
+    def forward(self, x):
+        return self.model(x)[0]
+
+
+class OnnxBackend(Backend):
+    # yolov5 export.py --include onnx [--dynamic], NumPy pre/post-processing matching the PyTorch path (detect_numpy)
+    name = 'onnx'
+
+    def __init__(self, weights, **kwargs):
+        super().__init__(weights, **kwargs)
+        import onnxruntime
+
+        so = onnxruntime.SessionOptions()
+        so.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        so.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL  # single branch graph, inter-op pool is unused
+        so.intra_op_num_threads = self.threads or 0  # 0: one per physical core
+        so.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(str(weights), so, providers=['CPUExecutionProvider'])
+        i = self.session.get_inputs()[0]
+        self.input_name, self.output_name = i.name, self.session.get_outputs()[0].name
+        batch, _, h, w = i.shape  # ints for static exports, names ('batch', 'height', 'width') for --dynamic
+        self.auto = not isinstance(h, int)  # dynamic exports take minimum rectangles, static ones their fixed shape
+        self.imgsz = self.imgsz if self.auto else (h, w)
+        self.static_batch = batch if isinstance(batch, int) else None  # pad partial batches up to it
+        self.batch_size = self.static_batch or self.batch_size
+        self.stride = 32
+
+    def predict(self, ims, conf, imgs=None, dt=NullTimer()):
+        shapes = self.letterbox_shapes(ims, imgs)
+        out = [None] * len(ims)
+        for chunk in self.batches(shapes):
+            n = len(chunk)
+            x = self.buffers.get(self.static_batch or n, shapes[chunk[0]])
+            self.fill(x, chunk, ims, imgs, dt)
+            x[n:] = 0  # static batch padding
+            with dt('forward', chunk):
+                pred = self.session.run([self.output_name], {self.input_name: x})[0][:n]
+            with dt('nms', chunk):
+                pred = detect_numpy.non_max_suppression(pred, conf, self.iou, topk=self.topk)
+            for i, det in zip(chunk, pred):
+                with dt('scale_coords', [i]):
+                    det[:, :4] = detect_numpy.scale_coords(x.shape[2:], det[:, :4], ims[i].shape)
+                out[i] = det
+        return out
+
+
+class UltralyticsBackend(Backend):
+    name = 'ultralytics'
+    iou = 0.7  # ultralytics default
+
+    def __init__(self, weights, **kwargs):
+        super().__init__(weights, **kwargs)
+        from ultralytics import YOLO
+
+        self.model = YOLO(weights)  # accepts model names, i.e. 'yolo11n.pt', and downloads them
+        self.names = self.model.names
+
+    def predict(self, ims, conf, imgs=None, dt=NullTimer()):
+        # Stage timings come from ultralytics' own per-image speeds: preprocess (letterbox), inference (forward) and
+        # postprocess (NMS including box scaling)
+        out = []
+        for j in range(0, len(ims), self.batch_size):
+            results = self.model.predict(ims[j:j + self.batch_size], imgsz=self.imgsz, conf=conf, iou=self.iou,
+                                         device=self.device, verbose=False)
+            for r in results:
+                for stage, k in ('letterbox', 'preprocess'), ('forward', 'inference'), ('nms', 'postprocess'):
+                    if (getattr(r, 'speed', None) or {}).get(k) is not None:
+                        dt.add(len(out), stage, r.speed[k] / 1E3)
+                b = r.boxes
+                out.append(np.zeros((0, 6), dtype=np.float32) if b is None else
+                           np.concatenate([x.cpu().numpy() for x in (b.xyxy, b.conf[:, None], b.cls[:, None])], 1))
+        return out
+
+
+BACKENDS = {b.name: b for b in (YOLOv5Backend, TorchScriptBackend, OnnxBackend, UltralyticsBackend)}
+
+
+def backend_for(weights, default='yolov5'):
+    # Backend name implied by an exported weights file, else default
+    w = str(weights).lower()
+    if w.endswith(('.torchscript', '.torchscript.pt')):
+        return 'torchscript'
+    if w.endswith('.onnx'):
+        return 'onnx'
+    return default
+
+
+class DetectionEngine:
+    """
+    Load-once detector with pluggable backends and one shared post-processing stage. Thread-safe: predictions are
+    serialized on the engine lock, the backend model is loaded lazily on the first cache miss.
+
+    Arguments:
+        weights: model weights path (or ultralytics model name)
+        backend: key of BACKENDS, exported weights (*.torchscript.pt, *.onnx) select their runtime automatically
+        threads: intra-op CPU threads for the torch and ONNX Runtime backends
+        optimize: yolov5 on CPU, tune and persist the fastest inference profile (detect_tune.py) on first use
+        conf: initial confidence threshold, fallback: retry tier at fallback_conf when nothing clears conf
+        class_map: class_map.json path, or None to report the model's own class names
+        cache: optional detect_cache.DetectionCache
+        timings: optional detect_timing.TimingLog, per-stage latencies in the results and/or JSONL and Prometheus files
+        tile: tiled inference window size in original pixels (0 off), see detect_tiles.py. tile_overlap is the
+            fraction shared by neighbouring tiles, max_tiles the per-image budget, tile_full adds a whole-image pass
+        reduced_decode: decode JPEG paths at 1/2, 1/4 or 1/8 resolution when still >= imgsz (not in tiled mode),
+            boxes are still reported in original image pixels
+        topk: yolov5/torchscript/onnx, keep only the topk most confident NMS candidates per class and image
+        original_name: "original_name" reported per detection, 'model' for the model's class name or 'class_id' for
+            str(class_id) (detect_yolov11.py)
+        round_coords: round box_xyxy to whole pixels (detect_custom.py)
+    """
+
+    def __init__(self, weights, backend='yolov5', conf=0.25, iou=None, imgsz=640, device=None, batch_size=16,
+                 threads=None, optimize=False, fallback=True, fallback_conf=FALLBACK_CONF, class_map=CLASS_MAP_FILE,
+                 cache=None, timings=None, tile=0, tile_overlap=0.2, max_tiles=16, tile_full=True,
+                 reduced_decode=False, topk=None, original_name='model', round_coords=False):
+        self.weights = weights
+        self.backend_name = backend_for(weights, backend)
+        assert self.backend_name in BACKENDS, f'unknown backend {self.backend_name}, choose from {list(BACKENDS)}'
+        self.kwargs = dict(imgsz=imgsz, iou=iou, device=device, batch_size=batch_size, threads=threads,
+                           optimize=optimize, topk=topk)
+        self.iou = BACKENDS[self.backend_name].iou if iou is None else iou
+        self.imgsz = imgsz
+        self.conf = conf
+        self.fallback = fallback
+        self.fallback_conf = fallback_conf
+        self.class_map = load_class_map(class_map) if class_map else {}
+        self.cache = cache
+        self.timings = timings
+        self.tile, self.tile_overlap, self.max_tiles, self.tile_full = tile, tile_overlap, max_tiles, tile_full
+        self.reduced_decode = reduced_decode and not tile  # tiles need full resolution
+        assert original_name in ('model', 'class_id'), f'unknown original_name {original_name}'
+        self.original_name = original_name
+        self.round_coords = round_coords
+        self.backend = None
+        self.load_s = None  # model load time (s)
+        self.lock = threading.RLock()  # one prediction at a time, models are not re-entrant
+        self._original, self._mapped = np.array([], dtype=object), np.array([], dtype=object)  # class id -> name
+
+    def load(self):
+        with self.lock:
+            if self.backend is None:
+                t = time.time()
+                self.backend = BACKENDS[self.backend_name](self.weights, **self.kwargs)
+                self.load_s = time.time() - t
+                print(f"[DEBUG] Loaded {self.backend_name} model {self.weights} in {self.load_s:.3f}s", file=sys.stderr)
+        return self.backend
+
+    def settings(self, initial_conf, fallback):
+        # Everything besides the image and weights that changes a result, the detection cache key
+        s = dict(backend=self.backend_name, conf=initial_conf, fallback_conf=self.fallback_conf if fallback else None,
+                 iou=self.iou, imgsz=self.imgsz, class_map=bool(self.class_map))
+        if self.tile:
+            s['tiles'] = [self.tile, self.tile_overlap, self.max_tiles, self.tile_full]
+        if self.reduced_decode:
+            s['reduced_decode'] = True
+        if self.kwargs['topk']:
+            s['topk'] = self.kwargs['topk']
+        if self.original_name != 'model':
+            s['original_name'] = self.original_name
+        if self.round_coords:
+            s['round_coords'] = True
+        if self.kwargs['device']:
+            s['device'] = str(self.kwargs['device'])
+        if self.kwargs['optimize'] and self.backend_name == 'yolov5':
+            s['cpu_profile'] = self.cpu_profile()
+        return s
+
+    def cpu_profile(self):
+        # Tuned CPU profile (threads, bf16 autocast, TorchScript, ...) yolov5 results are computed under, the active
+        # runner's or the one saved next to the weights, None until the first prediction tunes it
+        runner = getattr(self.backend, 'runner', None)
+        if runner is not None:
+            return runner.profile
+        from detect_tune import saved_profile
+        return saved_profile(self.weights)
+
+    def labels(self, cls):
+        # (model name, mapped part name) object arrays indexed by class id, grown once for ids not seen before
+        n = int(cls.max()) + 1 if len(cls) else 0
+        if n > len(self._original):
+            names = self.backend.names
+            get = names.get if isinstance(names, dict) else lambda i, d: names[i] if i < len(names) else d
+            model_names = [get(i, f'class_{i}') for i in range(max(n, len(names)))]
+            original = model_names if self.original_name == 'model' else [str(i) for i in range(len(model_names))]
+            self._original = np.array(original, dtype=object)
+            self._mapped = np.array([self.class_map.get(str(i), x) for i, x in enumerate(model_names)], dtype=object)
+        return self._original, self._mapped
+
+    def predict(self, backend, ims, conf, imgs=None, dt=NullTimer()):
+        # backend.predict(), or in tiled mode the tiles of all images in one call, merged back per image
+        if not self.tile:
+            return backend.predict(ims, conf, imgs, dt)
+        crops, offsets, owners = [], [], []  # owners: crop index range per image
+        for j, im0 in enumerate(ims):
+            with dt('tile', [j]):
+                h, w = im0.shape[:2]
+                windows = tile_grid(h, w, self.tile, self.tile_overlap, self.max_tiles)
+                if self.tile_full and len(windows) > 1:
+                    windows.append((0, 0, w, h))
+                owners.append(range(len(crops), len(crops) + len(windows)))
+                crops += [im0 if (x2 - x1, y2 - y1) == (w, h) else np.ascontiguousarray(im0[y1:y2, x1:x2])
+                          for x1, y1, x2, y2 in windows]
+                offsets += [(x1, y1) for x1, y1, _, _ in windows]
+        ct = StageTimer(len(crops), backend.profile) if dt.enabled else NullTimer()
+        preds = backend.predict(crops, conf, None, ct)
+        out = []
+        for j, k in enumerate(owners):
+            with dt('merge', [j]):
+                out.append(merge([preds[i] for i in k], [offsets[i] for i in k], self.iou))
+            for i in k if dt.enabled else ():
+                for stage, seconds in ct.dt[i].items():
+                    dt.add(j, stage, seconds)
+        return out
+
+    def postprocess(self, det, used_conf):
+        # (n, 6) [xyxy, conf, cls] -> result dict, whole-array filtering and name lookup with one tolist() per column
+        det = det[det[:, 4] > used_conf]
+        cls = det[:, 5].astype(int)
+        original, mapped = self.labels(cls)
+        names = mapped[cls].tolist()
+        boxes = det[:, :4].round() if self.round_coords else det[:, :4]
+        detections = [{"class_id": c, "original_name": o, "name": n, "confidence": p, "box_xyxy": b}
+                      for c, o, n, p, b in zip(cls.tolist(), original[cls].tolist(), names, det[:, 4].tolist(),
+                                               boxes.tolist())]
+        return {"parts": list(dict.fromkeys(names)),  # de-duplicated, highest confidence first
+                "detections": detections,
+                "confidence_used": used_conf}
+
+    def detect(self, image, conf=None):
+        # Single image (path or BGR array), see detect_batch()
+        return self.detect_batch([image], conf)[0]
+
+    def detect_batch(self, images, conf=None, loaded=None, load_s=None):
+        """
+        Detect parts in several images with batched inference.
+
+        Arguments:
+            images: image paths (cached when a cache is configured) or BGR HWC arrays
+            conf: confidence threshold overriding the engine default, disables fallback when set at or below 0.06
+            loaded: optional (img, im0) pairs already decoded and letterboxed by a loader such as LoadImages, or
+                (img, im0, shape0) when im0 is a reduced-resolution decode of an original of shape0 (height, width)
+            load_s: optional seconds the loader spent on each loaded pair, reported as the "load" stage
+        Returns:
+            one {"parts", "detections", "confidence_used", "image"} dict per image in input order, or
+            {"image", "error"} for images that could not be read. "image" is None for array inputs. With timings
+            enabled each result also has "timings", per-stage ms (see detect_timing.py)
+        """
+        initial_conf = self.conf if conf is None else conf
+        fallback = self.fallback and allows_fallback(conf, initial_conf)
+        settings = self.settings(initial_conf, fallback)
+        results, keys, misses = [None] * len(images), [None] * len(images), []
+        timed = self.timings is not None
+        dt = StageTimer(len(images)) if timed else NullTimer()  # torch-free clock until the backend is known
+        for i, image in enumerate(images):
+            name = image if isinstance(image, (str, Path)) else None
+            if self.cache is not None and name is not None:
+                with dt('cache', [i]):
+                    keys[i], hit = self.cache.lookup(name, self.weights, **settings)
+                if hit is not None:
+                    results[i] = {**hit, "image": name}
+                    continue
+            misses.append(i)
+
+        batch = 0
+        if misses:
+            ims, imgs, shapes, idx = [], [], [], []
+            for i in misses:
+                try:
+                    with dt('decode', [i]):
+                        if loaded:
+                            im0, shape0 = loaded[i][1], loaded[i][2] if len(loaded[i]) > 2 else None
+                        elif isinstance(images[i], np.ndarray):
+                            im0, shape0 = images[i], None
+                        elif self.reduced_decode:
+                            im0, shape0 = read_image_reduced(images[i], self.imgsz)
+                        else:
+                            im0, shape0 = read_image(images[i]), None
+                except FileNotFoundError as e:
+                    results[i] = {"image": images[i], "error": str(e)}
+                    continue
+                if load_s:
+                    dt.add(i, 'load', load_s[i])
+                ims.append(im0)
+                shapes.append(shape0)
+                imgs.append(loaded[i][0] if loaded else None)
+                idx.append(i)
+
+            with self.lock:
+                backend = self.load()
+                pass_conf = inference_conf(initial_conf, fallback, self.fallback_conf)
+                t = time.time()
+                bt = StageTimer(len(ims), backend.profile) if timed else NullTimer()  # indexed like ims
+                preds = self.predict(backend, ims, pass_conf, imgs if loaded else None, bt) if ims else []
+                if self.cache is not None and preds:
+                    tuned = self.settings(initial_conf, fallback)
+                    if tuned != settings:  # CPU profile tuned by this prediction, store under the one used
+                        for i in idx:
+                            if keys[i] is not None:
+                                keys[i] = self.cache.rekey(images[i], self.weights, **tuned)
+                for j, (i, det) in enumerate(zip(idx, preds)):
+                    if shapes[j] is not None and tuple(shapes[j]) != ims[j].shape[:2]:  # reduced decode
+                        with bt('scale_coords', [j]):
+                            det[:, :4] = detect_numpy.rescale_coords(det[:, :4], ims[j].shape, shapes[j])
+                    with bt('class_map', [j]):
+                        used_conf = select_conf_tier([det[:, 4]], initial_conf, fallback, self.fallback_conf)
+                        out = self.postprocess(det, used_conf)
+                    if self.cache is not None:
+                        self.cache.store(keys[i], out)
+                    results[i] = {**out, "image": images[i] if isinstance(images[i], (str, Path)) else None}
+                    if timed:
+                        dt.dt[i].update(bt.dt[j])
+            batch = len(ims)
+            print(f"[DEBUG] {len(ims)} image(s) at conf={pass_conf} took {time.time() - t:.3f}s", file=sys.stderr)
+
+        if timed:
+            records, missed = [], set(misses)
+            for i, r in enumerate(results):
+                if "error" in r:
+                    continue
+                extra = {"image": str(images[i]) if isinstance(images[i], (str, Path)) else None,
+                         "batch": batch if i in missed else 0, "cached": i not in missed}
+                records.append((dt.dt[i], extra))
+                if self.timings.include:
+                    r["timings"] = as_ms(dt.dt[i], batch=extra["batch"], cached=extra["cached"])
+            self.timings.record(self.backend_name, records)
+        return results
@@ -0,0 +1,214 @@
+"""
+NumPy/OpenCV versions of the yolov5 pre- and post-processing, for runtimes that do not need torch (ONNX Runtime).
+
+Each function reproduces its yolov5 counterpart (utils.augmentations.letterbox, utils.general.non_max_suppression,
+scale_coords) so exported models return the same detections as the PyTorch path. JPEG reduced decoding is yolov5
+utils.jpeg itself.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+YOLOV5_DIR = Path(__file__).resolve().parent / 'yolov5'
+if str(YOLOV5_DIR) not in sys.path:
+    sys.path.insert(0, str(YOLOV5_DIR))  # `utils` is yolov5/utils, as after detect_engine.add_yolov5_path()
+
+from utils.jpeg import imread_reduced  # noqa: E402, F401, torch-free, shared with yolov5 LoadImages
+
+
+def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleup=True, stride=32):
+    # Resize and pad image while meeting stride-multiple constraints, see yolov5 utils.augmentations.letterbox
+    shape = im.shape[:2]  # current shape [height, width]
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+
+    # Scale ratio (new / old)
+    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+    if not scaleup:  # only scale down, do not scale up (for better val mAP)
+        r = min(r, 1.0)
+
+    # Compute padding
+    new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]  # wh padding
+    if auto:  # minimum rectangle
+        dw, dh = np.mod(dw, stride), np.mod(dh, stride)  # wh padding
+    dw /= 2  # divide padding into 2 sides
+    dh /= 2
+
+    if shape[::-1] != new_unpad:  # resize
+        im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)  # add border
+    return im, (r, r), (dw, dh)
+
+
+def letterbox_shape(shape, new_shape=(640, 640), auto=True, scaleup=True, stride=32):
+    # letterbox() geometry for an image of shape (h, w): resized (w, h), (top, bottom, left, right) border, output (h, w)
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+    if not scaleup:
+        r = min(r, 1.0)
+    new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]
+    if auto:
+        dw, dh = np.mod(dw, stride), np.mod(dh, stride)
+    dw /= 2
+    dh /= 2
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    return new_unpad, (top, bottom, left, right), (new_unpad[1] + top + bottom, new_unpad[0] + left + right)
+
+
+def letterbox_into(im, out, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleup=True, stride=32):
+    # letterbox() + HWC to CHW + BGR to RGB + /255 written straight into out, a float32 (3, h, w) array of the output
+    # shape (i.e. a slot of a reusable batch buffer). One resize and one converting copy, values identical to
+    # np.ascontiguousarray(letterbox(im)[0].transpose((2, 0, 1))[::-1]).astype(np.float32) / 255
+    (w, h), (top, _, left, _), _ = letterbox_shape(im.shape[:2], new_shape, auto, scaleup, stride)
+    if im.shape[:2] != (h, w):
+        im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+    fill = (np.array(color[::-1], dtype=np.float32) / np.float32(255))[:, None, None]  # RGB
+    out[:, :top], out[:, top + h:] = fill, fill
+    out[:, top:top + h, :left], out[:, top:top + h, left + w:] = fill, fill
+    np.divide(im.transpose((2, 0, 1))[::-1], np.float32(255), out=out[:, top:top + h, left:left + w], dtype=np.float32)
+    return out
+
+
+def xywh2xyxy(x):
+    # Convert nx4 boxes from [x, y, w, h] to [x1, y1, x2, y2] where xy1=top-left, xy2=bottom-right
+    y = np.copy(x)
+    y[:, 0] = x[:, 0] - x[:, 2] / 2  # top left x
+    y[:, 1] = x[:, 1] - x[:, 3] / 2  # top left y
+    y[:, 2] = x[:, 0] + x[:, 2] / 2  # bottom right x
+    y[:, 3] = x[:, 1] + x[:, 3] / 2  # bottom right y
+    return y
+
+
+def box_overlaps(a, b, iou_thres):
+    # (n, m) bool, IoU of xyxy boxes a (n, 4) and b (m, 4) > iou_thres, computed like torchvision.ops.nms in their dtype
+    area_a, area_b = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]), (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    w = (np.minimum(a[:, None, 2], b[:, 2]) - np.maximum(a[:, None, 0], b[:, 0])).clip(0)
+    h = (np.minimum(a[:, None, 3], b[:, 3]) - np.maximum(a[:, None, 1], b[:, 1])).clip(0)
+    inter = w * h
+    iou = inter / (area_a[:, None] + area_b - inter)
+    t = iou.dtype.type(iou_thres)
+    return iou >= t if t > iou_thres else iou > t  # same as comparing with the float64 threshold
+
+
+def nms(boxes, scores, iou_thres, tile=512):
+    """Greedy NMS with torchvision.ops.nms semantics and results: indices of kept boxes by decreasing score, a box is
+    dropped when its IoU with a kept box is > iou_thres
+
+    Vectorized over tiles of score-sorted boxes: a tile first drops boxes overlapping boxes kept in earlier tiles, then
+    resolves the greedy order within itself by iterating keep = alive & ~(kept earlier overlap) to its fixed point,
+    which is the greedy result and is reached in as many steps as the longest suppression chain
+    """
+    order = np.argsort(-scores, kind='stable')
+    b = boxes[order]
+    keep = np.zeros(len(b), dtype=bool)
+    for s in range(0, len(b), tile):
+        t = b[s:s + tile]
+        alive = ~box_overlaps(b[:s][keep[:s]], t, iou_thres).any(0)
+        m = np.triu(box_overlaps(t, t, iou_thres), 1)  # m[i, j]: earlier box i overlaps box j
+        k = alive
+        while True:
+            new = alive & ~(m & k[:, None]).any(0)
+            if (new == k).all():
+                break
+            k = new
+        keep[s:s + tile] = k
+    return order[keep].astype(np.int64)
+
+
+def topk_mask(scores, groups, k):
+    # bool mask keeping the k highest scores of every group (non-negative int ids), ties in input order
+    order = np.argsort(-scores, kind='stable')
+    order = order[np.argsort(groups[order], kind='stable')]  # by group, then by decreasing score
+    g = groups[order]
+    n = np.bincount(g)
+    mask = np.zeros(len(scores), dtype=bool)
+    mask[order] = np.arange(len(g)) - (n.cumsum() - n)[g] < k  # rank within group < k
+    return mask
+
+
+def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, max_det=300,
+                        topk=None):
+    """Runs Non-Maximum Suppression (NMS) on (bs, n, 5 + nc) inference results, best class per box, optionally capped
+    to the topk most confident candidates per class and image
+
+    Returns:
+         list of detections, on (n,6) float32 array per image [xyxy, conf, cls]
+    """
+
+    assert 0 <= conf_thres <= 1, f'Invalid Confidence threshold {conf_thres}, valid values are between 0.0 and 1.0'
+    assert 0 <= iou_thres <= 1, f'Invalid IoU {iou_thres}, valid values are between 0.0 and 1.0'
+
+    # Settings
+    max_wh = 4096  # (pixels) maximum box width and height
+    max_nms = 30000  # maximum number of boxes into nms()
+    time_limit = 10.0  # seconds to quit after
+
+    t = time.time()
+    xc = prediction[..., 4] > conf_thres  # candidates
+    output = [np.zeros((0, 6), dtype=np.float32)] * prediction.shape[0]
+    for xi, x in enumerate(prediction):  # image index, image inference
+        x = x[xc[xi]]  # confidence
+        if not x.shape[0]:
+            continue
+
+        # Compute conf, box and best class
+        x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+        box = xywh2xyxy(x[:, :4])
+        j = x[:, 5:].argmax(1)
+        conf = x[np.arange(len(x)), j + 5]
+        x = np.concatenate((box, conf[:, None], j[:, None].astype(np.float32)), 1)[conf > conf_thres]
+
+        # Filter by class
+        if classes is not None:
+            x = x[(x[:, 5:6] == np.array(classes)).any(1)]
+
+        # Cap candidates per class
+        if topk:
+            x = x[topk_mask(x[:, 4], x[:, 5].astype(np.int64), topk)]
+
+        # Check shape
+        n = x.shape[0]  # number of boxes
+        if not n:  # no boxes
+            continue
+        elif n > max_nms:  # excess boxes
+            x = x[np.argsort(-x[:, 4], kind='stable')[:max_nms]]  # sort by confidence
+
+        # Batched NMS
+        c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
+        i = nms(x[:, :4] + c, x[:, 4], iou_thres)[:max_det]  # boxes offset by class
+        output[xi] = x[i].astype(np.float32)
+        if (time.time() - t) > time_limit:
+            print(f'WARNING: NMS time limit {time_limit}s exceeded')
+            break  # time limit exceeded
+
+    return output
+
+
+def rescale_coords(coords, shape, shape0):
+    # Map coords (xyxy) on a reduced-resolution decode of shape (h, w) to the original image shape0, clipped
+    gy, gx = shape0[0] / shape[0], shape0[1] / shape[1]
+    coords[:, [0, 2]] = (coords[:, [0, 2]] * gx).clip(0, shape0[1])
+    coords[:, [1, 3]] = (coords[:, [1, 3]] * gy).clip(0, shape0[0])
+    return coords
+
+
+def scale_coords(img1_shape, coords, img0_shape):
+    # Rescale coords (xyxy) from img1_shape to img0_shape, clipped to img0_shape
+    gain = min(img1_shape[0] / img0_shape[0], img1_shape[1] / img0_shape[1])  # gain  = old / new
+    pad = (img1_shape[1] - img0_shape[1] * gain) / 2, (img1_shape[0] - img0_shape[0] * gain) / 2  # wh padding
+    coords[:, [0, 2]] -= pad[0]  # x padding
+    coords[:, [1, 3]] -= pad[1]  # y padding
+    coords[:, :4] /= gain
+    coords[:, [0, 2]] = coords[:, [0, 2]].clip(0, img0_shape[1])  # x1, x2
+    coords[:, [1, 3]] = coords[:, [1, 3]].clip(0, img0_shape[0])  # y1, y2
+    return coords
@@ -0,0 +1,70 @@
+"""
+Sliced (tiled) inference for high-resolution photos.
+
+A 4000px phone photo letterboxed to 640 shrinks small dents and scratches below what the model can see. Tiled mode cuts
+the original into overlapping tiles of one size, runs all tiles (plus optionally the whole image, for damage larger
+than a tile) through the backend as one batch, shifts each tile's boxes back to original pixels and merges duplicates
+along tile seams with class-aware NMS.
+
+Usage:
+    engine = DetectionEngine('best.pt', tile=640, tile_overlap=0.2, max_tiles=16)
+    $ python detect_custom.py --weights best.pt car.jpg --tile 640
+"""
+
+import math
+
+import numpy as np
+
+from detect_numpy import nms
+
+
+def tile_grid(h, w, tile=640, overlap=0.2, max_tiles=16):
+    """
+    Overlapping windows covering an h x w image, all of one shape so they letterbox to one batch.
+
+    Windows are evenly spaced with at least `overlap` (fraction of the tile) shared between neighbours, the last one
+    ending on the image border. When more than max_tiles would be needed the tile grows until the grid fits the
+    budget, trading resolution for latency.
+
+    Returns:
+        list of (x1, y1, x2, y2) integer windows, a single full-image window when the image fits in one tile
+    """
+    assert 0 <= overlap < 1, f'tile overlap {overlap} must be in [0, 1)'
+    assert max_tiles >= 1, f'max_tiles {max_tiles} must be at least 1'
+
+    def steps(size, t):
+        t = min(t, size)
+        n = 1 if t >= size else math.ceil((size - t) / (t * (1 - overlap))) + 1
+        return t, [round(i * (size - t) / (n - 1)) if n > 1 else 0 for i in range(n)]
+
+    while True:
+        th, ys = steps(h, tile)
+        tw, xs = steps(w, tile)
+        if len(ys) * len(xs) <= max_tiles or tile >= max(h, w):
+            break
+        tile = math.ceil(tile * 1.25)
+    return [(x, y, x + tw, y + th) for y in ys for x in xs]
+
+
+def merge(dets, offsets, iou_thres=0.5, max_det=300):
+    """
+    Shift per-tile (n, 6) [xyxy, conf, cls] detections by their window origin and merge duplicates with class-aware NMS.
+
+    Arguments:
+        dets: list of (n, 6) arrays, one per tile, in tile pixels
+        offsets: matching (x, y) window origins in original pixels, (0, 0) for a full-image pass
+    Returns:
+        (n, 6) float32 array in original pixels, by decreasing confidence
+    """
+    shifted = []
+    for det, (x, y) in zip(dets, offsets):
+        if len(det):
+            det = det.copy()
+            det[:, [0, 2]] += x
+            det[:, [1, 3]] += y
+            shifted.append(det)
+    if not shifted:
+        return np.zeros((0, 6), dtype=np.float32)
+    det = np.concatenate(shifted)
+    c = det[:, 5:6] * (det[:, :4].max() + 1)  # class offsets, boxes of different classes never overlap
+    return det[nms(det[:, :4] + c, det[:, 4], iou_thres)[:max_det]].astype(np.float32)
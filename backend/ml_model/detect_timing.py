@@ -0,0 +1,205 @@
+"""
+Per-stage latency instrumentation for the detect_* scripts.
+
+The detection engine times each stage of a request per image: cache lookup, image decode, letterbox, forward pass,
+NMS, scale_coords and class mapping (for ultralytics, its own preprocess/inference/postprocess speeds), plus tile
+cutting and seam merging in tiled mode. Batched stages are split evenly across the images of the batch. Torch backends
+time with yolov5 utils.general.Profile, which synchronizes CUDA like time_sync(); the ONNX backend uses the torch-free
+Profile below.
+
+Enable with DETECT_TIMINGS=1 (or --timings on the scripts) to add a "timings" object in ms to every JSON result, and
+optionally record every image to
+    DETECT_TIMINGS_JSONL=/var/log/snapquote/detect_timings.jsonl   one JSON line per image, appended
+    DETECT_TIMINGS_PROM=/var/lib/node_exporter/detect.prom         Prometheus textfile collector histogram per stage
+The Prometheus file is merged and rewritten atomically, so short-lived detect processes add to the same histograms.
+"""
+
+import contextlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+STAGES = ('cache', 'load', 'decode', 'tile', 'letterbox', 'forward', 'nms', 'scale_coords', 'merge', 'class_map')
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds, plus +Inf
+METRIC = 'detect_stage_seconds'
+PROM_LINE = re.compile(METRIC + r'_(bucket|sum|count)\{backend="([^"]*)",stage="([^"]*)"(?:,le="([^"]+)")?\} (\S+)')
+
+
+class Profile(contextlib.ContextDecorator):
+    # Torch-free counterpart of yolov5 utils.general.Profile(verbose=False): dt last, t accumulated seconds
+    def __init__(self, t=0.0):
+        self.t = t
+        self.dt = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.dt = time.perf_counter() - self.start
+        self.t += self.dt
+
+
+class StageTimer:
+    # Stage durations (s) of n images, timer(stage, idx) times a block and shares it across the images in idx
+    enabled = True
+
+    def __init__(self, n, profile=Profile):
+        self.profile = profile
+        self.dt = [{} for _ in range(n)]
+
+    @contextlib.contextmanager
+    def __call__(self, stage, idx):
+        p = self.profile()
+        with p:
+            yield
+        for i in idx:
+            self.add(i, stage, p.dt / len(idx))
+
+    def add(self, i, stage, seconds):
+        self.dt[i][stage] = self.dt[i].get(stage, 0.0) + seconds
+
+
+class NullTimer:
+    # StageTimer stand-in when timings are off, no clock reads
+    enabled = False
+
+    def __call__(self, stage, idx):
+        return contextlib.nullcontext()
+
+    def add(self, i, stage, seconds):
+        pass
+
+
+def as_ms(dt, **extra):
+    # {stage: seconds} -> the "timings" result object, {stage_ms: .., total_ms: .., **extra} in pipeline order
+    out = {f'{k}_ms': round(dt[k] * 1E3, 3) for k in STAGES if k in dt}
+    out['total_ms'] = round(sum(dt.values()) * 1E3, 3)
+    return {**out, **extra}
+
+
+class TimingLog:
+    """
+    Where per-stage timings go: into the JSON results (include), a JSONL file, a Prometheus textfile and an in-memory
+    window of recent requests for p50/p99 summaries (worker stats).
+    """
+
+    def __init__(self, include=True, jsonl=None, prom=None, window=10000):
+        self.include = include
+        self.jsonl = Path(jsonl) if jsonl else None
+        self.prom = Path(prom) if prom else None
+        self.recent = {}  # stage -> deque of recent seconds
+        self.window = window
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, include=False):
+        # Configured through DETECT_TIMINGS / DETECT_TIMINGS_JSONL / DETECT_TIMINGS_PROM, None when all are off
+        include = include or os.getenv('DETECT_TIMINGS', '').lower() in ('1', 'true', 'yes')
+        jsonl, prom = os.getenv('DETECT_TIMINGS_JSONL'), os.getenv('DETECT_TIMINGS_PROM')
+        return cls(include, jsonl, prom) if include or jsonl or prom else None
+
+    def record(self, backend, timings):
+        # timings: list of ({stage: seconds}, {image, batch, cached}) per image of one detect_batch() call
+        if not timings:
+            return
+        with self.lock:
+            for dt, _ in timings:
+                for k, v in dt.items():
+                    self.recent.setdefault(k, deque(maxlen=self.window)).append(v)
+            try:
+                if self.jsonl:
+                    self.write_jsonl(backend, timings)
+                if self.prom:
+                    self.write_prom(backend, timings)
+            except OSError as e:  # metrics must never fail a detection
+                print(f'[DEBUG] Failed to write detection timings: {e}', file=sys.stderr)
+
+    def write_jsonl(self, backend, timings):
+        self.jsonl.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.jsonl, 'a', encoding='utf-8') as f:
+            for dt, extra in timings:
+                f.write(json.dumps({'ts': round(time.time(), 3), 'backend': backend, **as_ms(dt, **extra)}) + '\n')
+
+    def write_prom(self, backend, timings):
+        # Merge into the histograms already in the file under an exclusive lock, then replace it atomically
+        self.prom.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.prom.with_suffix(self.prom.suffix + '.lock'), 'a') as lock:
+            with file_lock(lock):
+                hist = read_prom(self.prom)
+                for dt, _ in timings:
+                    for k, v in dt.items():
+                        h = hist.setdefault((backend, k), {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+                        for j, le in enumerate(BUCKETS):
+                            h['buckets'][j] += v <= le
+                        h['buckets'][-1] += 1  # +Inf
+                        h['sum'] += v
+                        h['count'] += 1
+                tmp = self.prom.with_suffix(self.prom.suffix + f'.{os.getpid()}.tmp')
+                tmp.write_text(format_prom(hist))
+                os.replace(tmp, self.prom)
+
+    def summary(self):
+        # {stage: {count, p50_ms, p99_ms}} over the recent window
+        with self.lock:
+            out = {}
+            for k in [s for s in STAGES if s in self.recent]:
+                dt = sorted(self.recent[k])
+                out[k] = {'count': len(dt), 'p50_ms': round(dt[len(dt) // 2] * 1E3, 3),
+                          'p99_ms': round(dt[min(len(dt) - 1, int(len(dt) * 0.99))] * 1E3, 3)}
+            return out
+
+
+@contextlib.contextmanager
+def file_lock(f):
+    # Exclusive advisory lock across processes where fcntl exists (POSIX), no-op elsewhere
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    fcntl.flock(f, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_prom(f):
+    # {(backend, stage): {buckets, sum, count}} from a textfile written by format_prom(), empty when missing
+    hist = {}
+    try:
+        lines = Path(f).read_text().splitlines()
+    except FileNotFoundError:
+        return hist
+    les = [repr(float(x)) for x in BUCKETS] + ['+Inf']
+    for line in lines:
+        m = PROM_LINE.fullmatch(line.strip())
+        if not m:
+            continue
+        kind, backend, stage, le, value = m.groups()
+        h = hist.setdefault((backend, stage), {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0})
+        if kind == 'bucket' and le in les:
+            h['buckets'][les.index(le)] = int(float(value))
+        elif kind == 'sum':
+            h['sum'] = float(value)
+        elif kind == 'count':
+            h['count'] = int(float(value))
+    return hist
+
+
+def format_prom(hist):
+    # Prometheus text exposition format, one histogram series per (backend, stage)
+    lines = [f'# HELP {METRIC} Detection latency per pipeline stage and image.', f'# TYPE {METRIC} histogram']
+    for (backend, stage), h in sorted(hist.items()):
+        labels = f'backend="{backend}",stage="{stage}"'
+        for le, n in zip([repr(float(x)) for x in BUCKETS] + ['+Inf'], h['buckets']):
+            lines.append(f'{METRIC}_bucket{{{labels},le="{le}"}} {n}')
+        lines.append(f'{METRIC}_sum{{{labels}}} {h["sum"]:.6f}')
+        lines.append(f'{METRIC}_count{{{labels}}} {h["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,184 @@
+"""
+Auto-tuned CPU inference profile for yolov5 models loaded with attempt_load.
+
+On first use the real model is benchmarked on the real input shape across thread counts, torch.inference_mode,
+channels_last, TorchScript trace + freeze and bf16 autocast. The fastest configuration whose outputs still match eager
+FP32 is saved next to the weights (best.pt -> best.cpu_profile.json) and reused by later processes as long as the
+weights, torch version and CPU are unchanged.
+
+Usage:
+    from detect_tune import CpuRunner
+    runner = CpuRunner.load_or_tune(model, 'weights/best.pt', x)   # x: (b, 3, h, w) float input
+    pred = runner(x)                                               # same as model(x, augment=False)[0]
+"""
+
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+from copy import deepcopy
+from pathlib import Path
+
+import torch
+
+from detect_common import FALLBACK_CONF
+from detect_engine import add_yolov5_path
+
+add_yolov5_path()
+from utils.general import non_max_suppression
+from utils.torch_utils import time_sync
+
+DEFAULT_PROFILE = {'threads': None, 'inference_mode': False, 'channels_last': False, 'jit': False, 'bf16': False}
+MAX_TRACED = 8  # traced modules kept per runner, one per input shape
+TOLERANCE = {False: (0.1, 1E-3), True: (2.0, 5E-2)}  # max (box pixels, score) difference vs eager FP32, by bf16
+MIN_OBJ = 0.001  # raw boxes are compared on anchors at least this confident in eager FP32, the rest is background
+
+
+def profile_path(weights):
+    return Path(weights).with_suffix('.cpu_profile.json')
+
+
+def environment(weights):
+    # Everything a saved profile depends on. The tuning input shape is recorded but not checked, a profile tuned on a
+    # landscape upload applies to portrait ones too
+    st = Path(weights).stat()
+    return {'torch': torch.__version__, 'cpu': platform.processor() or platform.machine(), 'cpu_count': os.cpu_count(),
+            'weights_size': st.st_size, 'weights_mtime_ns': st.st_mtime_ns}
+
+
+def mismatch(y, reference, tolerance, iou_thres=0.45):
+    # Describes how inference output y differs from eager FP32 reference beyond tolerance, None when it matches. Checks
+    # every score (objectness and classes) and the boxes of non-background anchors, then the detections after NMS at the
+    # lowest confidence the engine uses
+    box_tol, score_tol = tolerance
+    d = float((y[..., 4:] - reference[..., 4:]).abs().max())
+    if d > score_tol:
+        return f'scores differ by {d:.4f}'
+    m = reference[..., 4] >= MIN_OBJ
+    d = float((y[..., :4] - reference[..., :4])[m].abs().max()) if m.any() else 0.0
+    if d > box_tol:
+        return f'boxes differ by {d:.2f} px'
+    for a, b in zip(non_max_suppression(y, FALLBACK_CONF, iou_thres),
+                    non_max_suppression(reference, FALLBACK_CONF, iou_thres)):
+        if a.shape[0] != b.shape[0]:
+            return f'{a.shape[0]} detections after NMS, eager FP32 has {b.shape[0]}'
+        if a.shape[0]:  # each reference detection needs a same-class candidate box and score within tolerance
+            close = ((a[:, None, :4] - b[None, :, :4]).abs().amax(2) <= box_tol) & \
+                    ((a[:, None, 4] - b[None, :, 4]).abs() <= score_tol) & (a[:, None, 5] == b[None, :, 5])
+            if not close.any(0).all():
+                return f'{int((~close.any(0)).sum())} detections after NMS differ from eager FP32'
+    return None
+
+
+def saved_profile(weights):
+    # Full profile saved next to weights for this environment, None when missing, unreadable or stale
+    f = profile_path(weights)
+    try:
+        saved = json.loads(f.read_text())
+        if saved.get('environment') == environment(weights):
+            return {**DEFAULT_PROFILE, **saved['profile']}
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f'[DEBUG] Ignoring unreadable CPU profile {f}: {e}', file=sys.stderr)
+    return None
+
+
+class CpuRunner:
+    # model(x, augment=False)[0] under one CPU profile, see DEFAULT_PROFILE for the knobs
+    def __init__(self, model, profile=None):
+        self.profile = {**DEFAULT_PROFILE, **(profile or {})}
+        self.model = model
+        self.traced = {}  # input shape -> frozen TorchScript module
+        if self.profile['threads']:
+            torch.set_num_threads(self.profile['threads'])
+        if self.profile['channels_last']:
+            self.model = self.model.to(memory_format=torch.channels_last)
+
+    def __call__(self, x):
+        p = self.profile
+        if p['channels_last']:
+            x = x.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode() if p['inference_mode'] else torch.no_grad(), \
+                torch.autocast('cpu', dtype=torch.bfloat16) if p['bf16'] else contextlib.nullcontext():
+            y = self.trace(x)(x)[0] if p['jit'] else self.model(x, augment=False)[0]
+        return y.float()
+
+    def trace(self, x):
+        # Traced graphs bake in the Detect grid of their input shape, so keep one per shape
+        shape = tuple(x.shape)
+        if shape not in self.traced:
+            if len(self.traced) >= MAX_TRACED:
+                self.traced.pop(next(iter(self.traced)))  # oldest
+            with torch.no_grad():
+                ts = torch.jit.trace(self.model, x, strict=False, check_trace=False)
+                self.traced[shape] = torch.jit.freeze(ts.eval())
+        return self.traced[shape]
+
+    @staticmethod
+    def timeit(runner, x, runs):
+        # Median forward time (s) after two warmup calls (tracing, allocator warmup)
+        runner(x), runner(x)
+        dt = []
+        for _ in range(runs):
+            t = time_sync()
+            runner(x)
+            dt.append(time_sync() - t)
+        return statistics.median(dt)
+
+    @classmethod
+    def tune(cls, model, x, runs=10):
+        """
+        Greedy search over the profile knobs, one at a time, starting from eager FP32 with torch's default threads
+        (DEFAULT_PROFILE, timed first as the baseline). A change is kept when it is at least 3% faster than the best
+        profile so far and its outputs, raw and after NMS, match eager FP32 within TOLERANCE (see mismatch()).
+
+        Returns:
+            (best profile dict, {candidate description: median seconds or error})
+        """
+        threads0 = torch.get_num_threads()
+        n = os.cpu_count() or 1
+        baseline = cls(deepcopy(model))
+        reference = baseline(x)
+        best, best_t = dict(DEFAULT_PROFILE), cls.timeit(baseline, x, runs)
+        results = {'default': round(best_t, 5)}
+        steps = [('threads', t) for t in sorted({threads0, n, max(n // 2, 1)})] + \
+                [('inference_mode', True), ('channels_last', True), ('jit', True), ('bf16', True)]
+        for k, v in steps:
+            cfg = {**best, k: v}
+            name = f'{k}={v}'
+            try:
+                runner = cls(deepcopy(model), cfg)
+                reason = mismatch(runner(x), reference, TOLERANCE[cfg['bf16']])
+                if reason:
+                    results[name] = f'rejected, {reason}'
+                    continue
+                t = cls.timeit(runner, x, runs)
+                results[name] = round(t, 5)
+                if t < best_t * 0.97:
+                    best, best_t = cfg, t
+            except Exception as e:  # i.e. bf16 autocast or freeze unsupported by this torch/CPU
+                results[name] = f'failed: {e}'
+            finally:
+                torch.set_num_threads(threads0)
+        return best, results
+
+    @classmethod
+    def load_or_tune(cls, model, weights, x, runs=10):
+        # Runner with the profile saved next to weights, tuning and saving one first when missing or stale
+        profile = saved_profile(weights)
+        if profile is not None:
+            return cls(model, profile)
+        f, env = profile_path(weights), environment(weights)
+
+        print(f'[DEBUG] Tuning CPU inference profile for {weights} at input {tuple(x.shape)}...', file=sys.stderr)
+        profile, results = cls.tune(model, x, runs)
+        print(f'[DEBUG] CPU profile {profile}, candidates {results}', file=sys.stderr)
+        try:
+            f.write_text(json.dumps({'environment': env, 'shape': list(x.shape), 'profile': profile,
+                                     'candidates': results}, indent=2))
+        except OSError as e:
+            print(f'[DEBUG] Could not save CPU profile {f}: {e}', file=sys.stderr)
+        return cls(model, profile)
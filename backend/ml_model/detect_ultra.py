@@ -1,108 +1,194 @@
-import sys, json, time
-from pathlib import Path
+"""
+Ultralytics YOLO damage detection, a command line and worker front-end to detect_engine.DetectionEngine.
 
-# Attempt to load class mapping JSON if present next to this script
-CLASS_MAP = None
-try:
-    cm_path = Path(__file__).parent / 'class_map.json'
-    if cm_path.exists():
-        with open(cm_path, 'r', encoding='utf-8') as f:
-            CLASS_MAP = json.load(f)
-except Exception as e:
-    print(f"[DEBUG] Failed to load class_map.json: {e}", file=sys.stderr)
+Usage:
+    $ python detect_ultra.py <weights> <image_path> [confidence]          # one-shot, one JSON line
+    $ python detect_ultra.py --serve <weights>                             # persistent worker on stdin/stdout
+    $ python detect_ultra.py --serve <weights> --socket /tmp/detect.sock   # persistent worker on a Unix socket
+
+--timings (or DETECT_TIMINGS=1) adds per-stage latencies in ms to each result, see detect_timing.py.
+
+Worker protocol (one JSON object per line):
+    startup:  {"event": "ready", "startup": {"import_s": .., "model_load_s": .., "total_s": ..}}
+    request:  {"id": "abc", "image": "/path/to/img.jpg", "conf": 0.25}      # "id" and "conf" are optional
+    response: {"id": "abc", "parts": [...], "detections": [...], "confidence_used": 0.25, "image": ..,
+               "latency_s": ..}
+    stats:    {"cmd": "stats"} -> {"event": "stats", "startup": {...}, "requests": {...}, "stages": {...}}
+"""
+
+import time
+
+T_START = time.time()  # process start reference for the startup breakdown
+
+import sys, json
+from collections import deque
+from pathlib import Path
 
 try:
-    from ultralytics import YOLO
+    import ultralytics  # imported up front so a missing install fails fast and import_s covers it
 except ImportError:
     print("Ultralytics not installed. Run: pip install ultralytics", file=sys.stderr)
     sys.exit(1)
 
-if len(sys.argv) < 3:
-    print("Usage: python detect_ultra.py <weights> <image_path> [confidence]", file=sys.stderr)
-    sys.exit(1)
+from detect_cache import DetectionCache
+from detect_engine import DetectionEngine
+from detect_timing import TimingLog
+
+T_IMPORTED = time.time()
 
-weights = sys.argv[1]
-image = sys.argv[2]
-user_conf = None
-if len(sys.argv) >= 4:
+CACHE = DetectionCache.from_env()  # optional result cache, see detect_cache.py
+IOU_THRES = 0.7  # NMS IoU, the ultralytics default
+LATENCY_WINDOW = 10000  # recent steady-state requests kept for worker stats, as TimingLog's stage window
+
+
+def make_engine(weights, timings=False):
+    # Ultralytics engine at conf 0.25 with the low-confidence fallback tier, model loaded on first cache miss
+    return DetectionEngine(weights, backend='ultralytics', conf=0.25, iou=IOU_THRES, imgsz=640, cache=CACHE,
+                           timings=TimingLog.from_env(timings))
+
+
+class Worker:
+    # Long-lived detector: loads the model once and answers JSON-line requests until EOF
+    def __init__(self, weights, timings=False):
+        self.engine = make_engine(weights, timings)
+        self.engine.load()
+        self.startup = {'import_s': round(T_IMPORTED - T_START, 4),
+                        'model_load_s': round(self.engine.load_s, 4),
+                        'total_s': round(time.time() - T_START, 4)}
+        self.count = 0  # requests answered
+        self.first = None  # wall time (s) of the cold first request
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # wall time (s) of recent later requests
+
+    def stats(self):
+        # Startup vs steady-state latency breakdown, steady-state over the last LATENCY_WINDOW requests
+        steady = sorted(self.latencies)
+        requests = {'count': self.count, 'first_s': round(self.first, 4) if self.first is not None else None}
+        if CACHE is not None:
+            requests['cache'] = CACHE.stats()
+        if steady:
+            requests.update({'steady_mean_s': round(sum(steady) / len(steady), 4),
+                             'steady_p50_s': round(steady[len(steady) // 2], 4),
+                             'steady_p99_s': round(steady[min(len(steady) - 1, int(len(steady) * 0.99))], 4)})
+        out = {'event': 'stats', 'startup': self.startup, 'requests': requests}
+        if self.engine.timings is not None:
+            out['stages'] = self.engine.timings.summary()  # per-stage p50/p99 over recent images
+        return out
+
+    def handle(self, line):
+        # Answer one request line, never raise: errors are reported back to the caller
+        try:
+            req = json.loads(line)
+        except ValueError as e:
+            return {'error': f'invalid JSON request: {e}'}
+        if not isinstance(req, dict):
+            return {'error': 'request must be a JSON object'}
+        if req.get('cmd') == 'stats':
+            return self.stats()
+
+        rid, image = req.get('id'), req.get('image')
+        try:
+            conf = float(req['conf']) if req.get('conf') is not None else None
+        except (TypeError, ValueError):
+            return {'id': rid, 'error': f"Invalid confidence value provided: {req.get('conf')}"}
+        if not image or not Path(image).exists():
+            return {'id': rid, 'error': f'Image file not found: {image}'}
+
+        t = time.time()
+        try:
+            out = self.engine.detect(image, conf)  # serialized on the engine lock
+        except Exception as e:
+            return {'id': rid, 'error': f'Detection failed: {e}'}
+        dt = time.time() - t
+        self.count += 1
+        if self.first is None:
+            self.first = dt
+        else:
+            self.latencies.append(dt)
+        return {'id': rid, **out, 'latency_s': round(dt, 4)}
+
+    def serve_stdio(self, fin=sys.stdin, fout=sys.stdout):
+        for line in fin:
+            if line.strip():
+                fout.write(json.dumps(self.handle(line)) + '\n')
+                fout.flush()
+
+    def serve_socket(self, path):
+        import os
+        import socketserver
+
+        worker = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if line.strip():
+                        self.wfile.write((json.dumps(worker.handle(line.decode('utf-8'))) + '\n').encode('utf-8'))
+                        self.wfile.flush()
+
+        if os.path.exists(path):
+            os.unlink(path)  # stale socket from a previous worker
+        with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+            print(f"[DEBUG] Worker listening on {path}", file=sys.stderr)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.unlink(path)
+
+
+def serve(argv):
+    if not argv or argv[0].startswith('--'):
+        print("Usage: python detect_ultra.py --serve <weights> [--socket PATH] [--timings]", file=sys.stderr)
+        sys.exit(1)
+    weights = argv[0]
+    socket_path = argv[argv.index('--socket') + 1] if '--socket' in argv[:-1] else None
+
+    if not Path(weights).exists():
+        print(f"Weights file not found: {weights}", file=sys.stderr)
+        sys.exit(2)
+
+    worker = Worker(weights, '--timings' in argv)
+    print(json.dumps({'event': 'ready', 'startup': worker.startup}), flush=True)
+    print(f"[DEBUG] Worker ready: {worker.startup}", file=sys.stderr)
     try:
-        user_conf = float(sys.argv[3])
-    except ValueError:
-        print(f"Invalid confidence value provided: {sys.argv[3]}", file=sys.stderr)
-
-if not Path(weights).exists():
-    print(f"Weights file not found: {weights}", file=sys.stderr)
-    sys.exit(2)
-
-if not Path(image).exists():
-    print(f"Image file not found: {image}", file=sys.stderr)
-    sys.exit(3)
-
-model = YOLO(weights)
-
-initial_conf = user_conf if user_conf is not None else 0.25
-attempts = []
-
-def run_prediction(conf):
-    start = time.time()
-    results = model.predict(
-        image,
-        imgsz=640,
-        conf=conf,
-        verbose=False
-    )
-    duration = time.time() - start
-    return results, duration
-
-results, dur = run_prediction(initial_conf)
-print(f"[DEBUG] First pass conf={initial_conf} took {dur:.3f}s", file=sys.stderr)
-
-# If no detections, attempt a lower confidence (auto fallback) unless user explicitly set a very low one already
-total_boxes = sum(len(r.boxes) for r in results)
-if total_boxes == 0 and (user_conf is None or initial_conf > 0.06):
-    fallback_conf = 0.05
-    results, dur2 = run_prediction(fallback_conf)
-    print(f"[DEBUG] Fallback pass conf={fallback_conf} took {dur2:.3f}s", file=sys.stderr)
-    used_conf = fallback_conf
-else:
-    used_conf = initial_conf
-
-detections = []
-parts = []
-for r_i, r in enumerate(results):
-    names_map = r.names
-    for b_i, box in enumerate(r.boxes):
-        cls_id = int(box.cls.item())
-        name = names_map.get(cls_id, f"class_{cls_id}")
-        conf = float(box.conf.item()) if hasattr(box, 'conf') else None
-        # xyxy coordinates
-        if hasattr(box, 'xyxy'):
-            xyxy = box.xyxy[0].tolist()
+        if socket_path:
+            worker.serve_socket(socket_path)
         else:
-            xyxy = None
-        mapped_name = CLASS_MAP.get(str(cls_id), name) if CLASS_MAP else name
-        det_obj = {
-            "class_id": cls_id,
-            "original_name": name,
-            "name": mapped_name,
-            "confidence": conf,
-            "box_xyxy": xyxy
-        }
-        detections.append(det_obj)
-        parts.append(mapped_name)
-
-# Deduplicate parts preserving order
-parts = list(dict.fromkeys(parts))
-
-if not parts:
-    print("[DEBUG] No parts detected after all passes", file=sys.stderr)
-else:
-    print(f"[DEBUG] Detected parts: {parts}", file=sys.stderr)
-
-output = {
-    "parts": parts,
-    "detections": detections,
-    "confidence_used": used_conf,
-    "image": image
-}
-print(json.dumps(output))
+            worker.serve_stdio()
+    finally:
+        print(f"[DEBUG] Worker stats: {json.dumps(worker.stats())}", file=sys.stderr)
+
+
+def main(argv):
+    if argv and argv[0] == '--serve':
+        return serve(argv[1:])
+
+    timings = '--timings' in argv
+    argv = [a for a in argv if a != '--timings']
+    if len(argv) < 2:
+        print("Usage: python detect_ultra.py <weights> <image_path> [confidence] [--timings]", file=sys.stderr)
+        sys.exit(1)
+
+    weights = argv[0]
+    image = argv[1]
+    user_conf = None
+    if len(argv) >= 3:
+        try:
+            user_conf = float(argv[2])
+        except ValueError:
+            print(f"Invalid confidence value provided: {argv[2]}", file=sys.stderr)
+
+    if not Path(weights).exists():
+        print(f"Weights file not found: {weights}", file=sys.stderr)
+        sys.exit(2)
+
+    if not Path(image).exists():
+        print(f"Image file not found: {image}", file=sys.stderr)
+        sys.exit(3)
+
+    print(json.dumps(make_engine(weights, timings).detect(image, user_conf)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,161 @@
+"""
+Walk-around video damage scan: adaptive frame sampling, batched detection and temporal part aggregation.
+
+Consecutive frames of a walk-around are nearly identical, so running the model on all of them repeats the same
+detections. Frames are decoded at a fixed stride and scored by the mean absolute difference of a small grayscale
+thumbnail against the last sampled frame; a frame is sampled when the view changed enough, or when max_gap seconds
+passed without a sample. Sampled frames go through DetectionEngine.detect_batch in batches and the detections are
+aggregated into one de-duplicated part list with, for every part, the frame holding its best-confidence evidence.
+
+Usage:
+    from detect_video import scan_video
+    result = scan_video(engine, 'walkaround.mp4')   # {"parts", "detections", "confidence_used", "frames", ...}
+    $ python detect_custom.py --weights best.pt walkaround.mp4 --scan
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+class FrameSampler:
+    """
+    Yields (frame index, time s, BGR frame, change score) for the frames of a video worth running the model on.
+
+    Arguments:
+        stride: decode every stride-th frame, the others are only grabbed (demuxed, not decoded)
+        threshold: mean absolute thumbnail difference (0-255) to the last sample that makes a frame new
+        min_gap, max_gap: seconds between samples, at least min_gap and at most max_gap regardless of motion
+        thumb: thumbnail width (pixels) for change scoring
+    """
+
+    def __init__(self, stride=3, threshold=12.0, min_gap=0.25, max_gap=2.0, thumb=64):
+        self.stride = max(int(stride), 1)
+        self.threshold = threshold
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.thumb = thumb
+        self.frames = self.decoded = self.sampled = 0  # stats of the last run
+        self.fps = None
+
+    def thumbnail(self, im):
+        h, w = im.shape[:2]
+        small = cv2.resize(im, (self.thumb, max(round(self.thumb * h / w), 1)), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (3, 3), 0).astype(np.float32)
+
+    def __call__(self, path):
+        cap = cv2.VideoCapture(str(path))
+        if not cap.isOpened():
+            raise FileNotFoundError(f'Video Not Found {path}')
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.frames = self.decoded = self.sampled = 0
+        last, last_t = None, -float('inf')
+        try:
+            while cap.grab():
+                i = self.frames
+                self.frames += 1
+                if i % self.stride:
+                    continue
+                t = i / self.fps
+                if t - last_t < self.min_gap:
+                    continue
+                ok, im = cap.retrieve()
+                if not ok:
+                    continue
+                self.decoded += 1
+                thumb = self.thumbnail(im)
+                score = float(np.abs(thumb - last).mean()) if last is not None and last.shape == thumb.shape else 255.0
+                if score >= self.threshold or t - last_t >= self.max_gap:
+                    last, last_t = thumb, t
+                    self.sampled += 1
+                    yield i, t, im, score
+        finally:
+            cap.release()
+
+
+def aggregate(samples, results, min_hits=1):
+    """
+    Merge per-frame engine results into one walk-around result.
+
+    A part is reported when it was detected in at least min_hits sampled frames. Its evidence is the detection with the
+    highest confidence across frames, parts are ordered by that confidence.
+
+    Returns:
+        {"parts", "detections", "confidence_used"}, detections carrying "frame", "time_s" and "hits"
+    """
+    best, hits = {}, {}
+    for (i, t, _, _), r in zip(samples, results):
+        seen = set()
+        for d in r.get("detections", []):
+            name = d["name"]
+            if name not in seen:
+                seen.add(name)
+                hits[name] = hits.get(name, 0) + 1
+            if name not in best or d["confidence"] > best[name]["confidence"]:
+                best[name] = {**d, "frame": i, "time_s": round(t, 3)}
+    detections = sorted((dict(d, hits=hits[n]) for n, d in best.items() if hits[n] >= min_hits),
+                        key=lambda d: -d["confidence"])
+    used = [r["confidence_used"] for r in results if r.get("confidence_used") is not None]
+    return {"parts": [d["name"] for d in detections],
+            "detections": detections,
+            "confidence_used": min(used) if used else None}
+
+
+def scan_video(engine, path, sampler=None, batch_size=None, min_hits=1, conf=None, evidence_dir=None):
+    """
+    Damage scan of one walk-around video: sampled frames through engine.detect_batch in batches, aggregated.
+
+    Arguments:
+        engine: detect_engine.DetectionEngine
+        sampler: FrameSampler, defaults to FrameSampler()
+        batch_size: frames per detect_batch call, defaults to the engine's batch size
+        evidence_dir: optional directory to save the evidence frame of every reported part as <part>_<frame>.jpg
+    Returns:
+        aggregate() result plus "video" and "frames": {"total", "decoded", "sampled", "fps", "seconds"} stats
+    """
+    sampler = sampler or FrameSampler()
+    batch_size = batch_size or engine.kwargs['batch_size']
+    t0 = time.time()
+    samples, results, batch = [], [], []
+    for s in sampler(path):
+        batch.append(s)
+        if len(batch) == batch_size:
+            results += engine.detect_batch([im for _, _, im, _ in batch], conf)
+            samples += [(i, t, None, score) for i, t, _, score in batch]  # frames are not kept past their batch
+            batch = []
+    if batch:
+        results += engine.detect_batch([im for _, _, im, _ in batch], conf)
+        samples += [(i, t, None, score) for i, t, _, score in batch]
+
+    out = aggregate(samples, results, min_hits)
+    out["video"] = str(path)
+    out["frames"] = {"total": sampler.frames, "decoded": sampler.decoded, "sampled": sampler.sampled,
+                     "fps": round(sampler.fps, 2), "seconds": round(time.time() - t0, 3)}
+    print(f"[DEBUG] Scanned {path}: {sampler.sampled}/{sampler.frames} frames sampled, parts {out['parts']}",
+          file=sys.stderr)
+    if evidence_dir:
+        save_evidence(path, out["detections"], evidence_dir)
+    return out
+
+
+def save_evidence(path, detections, evidence_dir):
+    # Re-read the evidence frames (one seek each) and save them with their box drawn
+    evidence_dir = Path(evidence_dir)
+    evidence_dir.mkdir(parents=True, exist_ok=True)
+    cap = cv2.VideoCapture(str(path))
+    try:
+        for d in detections:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, d["frame"])
+            ok, im = cap.read()
+            if not ok:
+                continue
+            x1, y1, x2, y2 = map(int, d["box_xyxy"])
+            cv2.rectangle(im, (x1, y1), (x2, y2), (0, 0, 255), max(round(sum(im.shape[:2]) / 600), 2))
+            f = evidence_dir / f"{d['name']}_{d['frame']}.jpg"
+            cv2.imwrite(str(f), im)
+            d["evidence"] = str(f)
+    finally:
+        cap.release()
@@ -1,13 +1,15 @@
 # YOLOv5 🚀 by Ultralytics, GPL-3.0 license
 """
 Export a YOLOv5 PyTorch model to TorchScript, ONNX, CoreML, TensorFlow (saved_model, pb, TFLite, TF.js,) formats
-TensorFlow exports authored by https://github.com/zldrobit
+and fused FP32 safetensors. TensorFlow exports authored by https://github.com/zldrobit
 
 Usage:
     $ python path/to/export.py --weights yolov5s.pt --include torchscript onnx coreml saved_model pb tflite tfjs
+    $ python path/to/export.py --weights yolov5s.pt --include safetensors  # yolov5s.safetensors + .safetensors.json
 
 Inference:
     $ python path/to/detect.py --weights yolov5s.pt
+                                         yolov5s.safetensors
                                          yolov5s.onnx  (must export with --dynamic)
                                          yolov5s_saved_model
                                          yolov5s.pb
@@ -38,7 +40,7 @@ if str(ROOT) not in sys.path:
 ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 from models.common import Conv
-from models.experimental import attempt_load
+from models.experimental import attempt_load, load_safetensors
 from models.yolo import Detect
 from utils.activations import SiLU
 from utils.datasets import LoadImages
@@ -61,6 +63,40 @@ def export_torchscript(model, im, file, optimize, prefix=colorstr('TorchScript:'
         print(f'{prefix} export failure: {e}')
 
 
+def export_safetensors(model, file, prefix=colorstr('safetensors:')):
+    # YOLOv5 fused inference-only FP32 weights (no optimizer state or training metadata) + JSON model config, loaded
+    # memory-mapped by attempt_load()
+    try:
+        check_requirements(('safetensors',))
+        import json
+
+        from safetensors.torch import save_file
+
+        print(f'\n{prefix} starting export with torch {torch.__version__}...')
+        f = file.with_suffix('.safetensors')
+        assert not any(hasattr(m, 'bn') for m in model.modules() if isinstance(m, Conv)), 'model must be fused'
+        state_dict = {k: (v.float() if v.is_floating_point() else v).detach().cpu().contiguous()
+                      for k, v in model.state_dict().items()}
+        save_file(state_dict, str(f), metadata={'format': 'yolov5-fused-fp32'})
+        cfg = {'yaml': model.yaml, 'nc': int(model.nc), 'stride': [float(s) for s in model.stride],
+               'inplace': bool(model.yaml.get('inplace', True)),
+               'names': model.names if isinstance(model.names, list) else [model.names[i] for i in sorted(model.names)],
+               'source': file.name, 'torch': torch.__version__}
+        f.with_suffix('.safetensors.json').write_text(json.dumps(cfg, indent=2))
+
+        # Round trip, the memory-mapped model loaded onto the export device must reproduce the source model
+        device = next(model.parameters()).device
+        im = torch.rand(1, 3, 320, 320, generator=torch.Generator().manual_seed(0)).to(device)
+        with torch.no_grad():
+            y = model(im)[0]
+            y2 = load_safetensors(f, map_location=device).eval()(im)[0]
+        assert torch.allclose(y, y2, rtol=1E-4, atol=1E-3), f'reloaded model output differs ({(y - y2).abs().max()})'
+
+        print(f'{prefix} export success, saved as {f} ({file_size(f):.1f} MB)')
+    except Exception as e:
+        print(f'{prefix} export failure: {e}')
+
+
 def export_onnx(model, im, file, opset, train, dynamic, simplify, prefix=colorstr('ONNX:')):
     # YOLOv5 ONNX export
     try:
@@ -276,6 +312,8 @@ def run(data=ROOT / 'data/coco128.yaml',  # 'dataset.yaml path'
     assert not (device.type == 'cpu' and half), '--half only compatible with GPU export, i.e. use --device 0'
     model = attempt_load(weights, map_location=device, inplace=True, fuse=True)  # load FP32 model
     nc, names = model.nc, model.names  # number of classes, class names
+    if 'safetensors' in include:
+        export_safetensors(model, file)  # before half() and export-friendly activations
 
     # Input
     gs = int(max(model.stride))  # grid size (max stride)
@@ -348,7 +386,8 @@ def parse_opt():
     parser.add_argument('--conf-thres', type=float, default=0.25, help='TF.js NMS: confidence threshold')
     parser.add_argument('--include', nargs='+',
                         default=['torchscript', 'onnx'],
-                        help='available formats are (torchscript, onnx, coreml, saved_model, pb, tflite, tfjs)')
+                        help='available formats are (torchscript, onnx, coreml, saved_model, pb, tflite, tfjs, '
+                             'safetensors)')
     opt = parser.parse_args()
     print_args(FILE.stem, opt)
     return opt
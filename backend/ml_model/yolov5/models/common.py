@@ -10,17 +10,13 @@ from copy import copy
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
-import requests
 import torch
 import torch.nn as nn
-from PIL import Image
 from torch.cuda import amp
 
 from utils.datasets import exif_transpose, letterbox
 from utils.general import colorstr, increment_path, make_divisible, non_max_suppression, save_one_box, \
     scale_coords, xyxy2xywh
-from utils.plots import Annotator, colors
 from utils.torch_utils import time_sync
 
 LOGGER = logging.getLogger(__name__)
@@ -317,6 +313,8 @@ class AutoShape(nn.Module):
                 return self.model(imgs.to(p.device).type_as(p), augment, profile)  # inference
 
         # Pre-process
+        import requests
+        from PIL import Image
         n, imgs = (len(imgs), imgs) if isinstance(imgs, list) else (1, [imgs])  # number of images, list of images
         shape0, shape1, files = [], [], []  # image and inference shapes, filenames
         for i, im in enumerate(imgs):
@@ -376,6 +374,8 @@ class Detections:
         self.s = shape  # inference BCHW shape
 
     def display(self, pprint=False, show=False, save=False, crop=False, render=False, save_dir=Path('')):
+        from PIL import Image
+        from utils.plots import Annotator, colors  # matplotlib/seaborn, only imported when drawing results
         crops = []
         for i, (im, pred) in enumerate(zip(self.imgs, self.pred)):
             s = f'image {i + 1}/{len(self.pred)}: {im.shape[0]}x{im.shape[1]} '  # string
@@ -436,6 +436,8 @@ class Detections:
 
     def pandas(self):
         # return detections as pandas DataFrames, i.e. print(results.pandas().xyxy[0])
+        import pandas as pd
+        pd.options.display.max_columns = 10
         new = copy(self)  # return copy
         ca = 'xmin', 'ymin', 'xmax', 'ymax', 'confidence', 'class', 'name'  # xyxy columns
         cb = 'xcenter', 'ycenter', 'width', 'height', 'confidence', 'class', 'name'  # xywh columns
@@ -3,6 +3,8 @@
 Experimental modules
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import torch
 import torch.nn as nn
@@ -72,17 +74,102 @@ class MixConv2d(nn.Module):
 
 class Ensemble(nn.ModuleList):
     # Ensemble of models
+    parallel = False  # run members concurrently on a thread pool (torch releases the GIL inside its ops)
+
     def __init__(self):
         super().__init__()
 
     def forward(self, x, augment=False, profile=False, visualize=False):
-        y = []
-        for module in self:
-            y.append(module(x, augment, profile, visualize)[0])
+        if self.parallel and len(self) > 1:
+            y = self.map(lambda module: module(x, augment, profile, visualize)[0])
+        else:
+            y = [module(x, augment, profile, visualize)[0] for module in self]
         # y = torch.stack(y).max(0)[0]  # max ensemble
         # y = torch.stack(y).mean(0)  # mean ensemble
-        y = torch.cat(y, 1)  # nms ensemble
-        return y, None  # inference, train output
+        return torch.cat(y, 1), y  # nms ensemble, per-model outputs for utils.general.weighted_boxes_fusion()
+
+    def map(self, f):
+        # [f(module) for module in self] on one thread per member. Grad mode is thread-local, so the caller's is
+        # applied. The executor lives for this call only: no threads left behind, nothing unpicklable on the module
+        grad = torch.is_grad_enabled()
+
+        def run(module):
+            with torch.set_grad_enabled(grad):
+                return f(module)
+
+        with ThreadPoolExecutor(len(self)) as pool:
+            return list(pool.map(run, self))
+
+
+class Int8Model(nn.Module):
+    # Static INT8 model from quantize.py: an FX-quantized graph with the Model call signature and attributes
+    def __init__(self, graph, model, engine='x86'):
+        super().__init__()
+        self.graph = graph  # GraphModule, quantized backbone/neck feeding a float Detect() layer
+        self.names, self.stride, self.nc = model.names, model.stride, getattr(model, 'nc', len(model.names))
+        self.engine = engine  # torch.backends.quantized engine the weights were packed for
+
+    def forward(self, x, augment=False, profile=False, visualize=False):
+        assert not augment, 'augmented inference is not supported by INT8 models'
+        if torch.backends.quantized.engine != self.engine:
+            torch.backends.quantized.engine = self.engine
+        return self.graph(x)
+
+    def float(self):
+        return self  # weights stay INT8, attempt_load() and val.py call .float()
+
+    def fuse(self):
+        return self  # Conv2d() + BatchNorm2d() were fused before quantization
+
+
+def load_safetensors(weights, map_location=None):
+    # Fused inference-only FP32 model written by export.py --include safetensors: architecture and attributes from the
+    # *.safetensors.json config, tensors memory-mapped from the *.safetensors file so worker processes share its pages.
+    # With torch>=2.1 the model is built on the meta device (no weight init) and adopts the mapped tensors as they are.
+    # Detect() grids are plain list attributes outside the state_dict, they are reset to real tensors
+    import json
+    from copy import deepcopy
+    from pathlib import Path
+
+    from safetensors.torch import load_file
+
+    from models.yolo import Detect, Model, parse_model
+
+    weights = Path(weights)
+    cfg = json.loads(weights.with_suffix('.safetensors.json').read_text())
+    state_dict = load_file(str(weights))
+
+    def build():
+        model = Model.__new__(Model)  # skips Model.__init__() stride probe and weight initialization
+        nn.Module.__init__(model)
+        model.yaml = cfg['yaml']
+        model.model, model.save = parse_model(deepcopy(model.yaml), ch=[model.yaml.get('ch', 3)])
+        for m in model.model.modules():  # Model.fuse() layout without the BatchNorm2d() math
+            if isinstance(m, Conv) and hasattr(m, 'bn'):
+                m.conv.bias = nn.Parameter(torch.empty(m.conv.out_channels), requires_grad=False)
+                delattr(m, 'bn')
+                m.forward = m.forward_fuse
+        return model
+
+    try:
+        with torch.device('meta'):
+            model = build()
+        model.load_state_dict(state_dict, assign=True)
+    except (AttributeError, TypeError):  # torch<2.1, initialized model and tensors copied into it
+        model = build()
+        model.load_state_dict(state_dict)
+
+    model.names, model.nc, model.inplace = cfg['names'], cfg['nc'], cfg.get('inplace', True)
+    model.stride = torch.tensor(cfg['stride'])
+    for m in model.modules():
+        if isinstance(m, Detect):
+            m.grid = [torch.zeros(1)] * m.nl  # meta tensors when built on the meta device
+            m.anchor_grid = [torch.zeros(1)] * m.nl
+            m.__dict__.pop('grid_cache', None)
+    m = model.model[-1]
+    if isinstance(m, Detect):
+        m.stride, m.inplace = model.stride, model.inplace
+    return model.to(map_location) if map_location else model
 
 
 def attempt_load(weights, map_location=None, inplace=True, fuse=True):
@@ -91,6 +178,9 @@ def attempt_load(weights, map_location=None, inplace=True, fuse=True):
     # Loads an ensemble of models weights=[a,b,c] or a single model weights=[a] or weights=a
     model = Ensemble()
     for w in weights if isinstance(weights, list) else [weights]:
+        if str(w).endswith('.safetensors'):  # export.py --include safetensors, already fused FP32
+            model.append(load_safetensors(attempt_download(w), map_location).eval())
+            continue
         ckpt = torch.load(attempt_download(w), map_location=map_location)  # load
         if fuse:
             model.append(ckpt['ema' if ckpt.get('ema') else 'model'].float().fuse().eval())  # FP32 model
@@ -8,6 +8,7 @@ Usage:
 
 import argparse
 import sys
+from collections import OrderedDict
 from copy import deepcopy
 from pathlib import Path
 
@@ -21,21 +22,17 @@ from models.common import *
 from models.experimental import *
 from utils.autoanchor import check_anchor_order
 from utils.general import check_yaml, make_divisible, print_args, set_logging
-from utils.plots import feature_visualization
 from utils.torch_utils import copy_attr, fuse_conv_and_bn, initialize_weights, model_info, scale_img, \
     select_device, time_sync
 
-try:
-    import thop  # for FLOPs computation
-except ImportError:
-    thop = None
-
 LOGGER = logging.getLogger(__name__)
 
 
 class Detect(nn.Module):
     stride = None  # strides computed during build
     onnx_dynamic = False  # ONNX export parameter
+    grid_cache_size = 32  # (layer, ny, nx) grids kept across input shapes by grid_for(), 0 to rebuild on every change
+    conf_thres = None  # inference (not augment): decode only anchors with objectness > conf_thres, see candidates()
 
     def __init__(self, nc=80, anchors=(), ch=(), inplace=True):  # detection layer
         super().__init__()
@@ -57,9 +54,14 @@ class Detect(nn.Module):
             x[i] = x[i].view(bs, self.na, self.no, ny, nx).permute(0, 1, 3, 4, 2).contiguous()
 
             if not self.training:  # inference
-                if self.grid[i].shape[2:4] != x[i].shape[2:4] or self.onnx_dynamic:
-                    self.grid[i], self.anchor_grid[i] = self._make_grid(nx, ny, i)
-
+                if self.onnx_dynamic:
+                    self.grid[i], self.anchor_grid[i] = self._make_grid(nx, ny, i)  # traced into the graph
+                elif self.grid[i].shape[2:4] != x[i].shape[2:4]:
+                    self.grid[i], self.anchor_grid[i] = self.grid_for(nx, ny, i)
+
+                if self.conf_thres is not None:
+                    z.append(self.candidates(x[i], i))
+                    continue
                 y = x[i].sigmoid()
                 if self.inplace:
                     y[..., 0:2] = (y[..., 0:2] * 2. - 0.5 + self.grid[i]) * self.stride[i]  # xy
@@ -70,7 +72,56 @@ class Detect(nn.Module):
                     y = torch.cat((xy, wh, y[..., 4:]), -1)
                 z.append(y.view(bs, -1, self.no))
 
-        return x if self.training else (torch.cat(z, 1), x)
+        if self.training:
+            return x
+        return (self.pack(z, x[0].shape[0]) if self.conf_thres is not None else torch.cat(z, 1)), x
+
+    def candidates(self, x, i):
+        # (image index, decoded (n, no) rows) of the layer i anchors that may clear conf_thres, decoded exactly as in
+        # forward(). Selected on the objectness logit with a small margin, so non_max_suppression(conf_thres) still
+        # sees every anchor it would keep from the full output and none of the (bs, anchors, no) tensor is decoded
+        c = self.conf_thres
+        t = math.log(c / (1 - c)) - 1E-3 if 0 < c < 1 else -math.inf if c <= 0 else math.inf  # logit threshold
+        b, a, gy, gx = (x[..., 4] > t).nonzero(as_tuple=True)
+        y = x[b, a, gy, gx].sigmoid()
+        xy = (y[:, 0:2] * 2. - 0.5 + self.grid[i][0, a, gy, gx]) * self.stride[i]  # xy
+        wh = (y[:, 2:4] * 2) ** 2 * self.anchor_grid[i][0, a, gy, gx]  # wh
+        return b, torch.cat((xy, wh, y[:, 4:]), 1)
+
+    @staticmethod
+    def pack(z, bs):
+        # candidates() of all layers as a zero-padded (bs, n, no) output, each image's rows in full output order
+        b, y = torch.cat([bi for bi, _ in z]), torch.cat([yi for _, yi in z])
+        order = torch.argsort(b * b.shape[0] + torch.arange(b.shape[0], device=b.device))  # by image, stable
+        b, y = b[order], y[order]
+        n = torch.bincount(b, minlength=bs)
+        out = y.new_zeros((bs, int(n.max()), y.shape[1]))  # objectness 0 rows never clear conf_thres
+        out[b, torch.arange(b.shape[0], device=b.device) - (n.cumsum(0) - n)[b]] = y
+        return out
+
+    def grid_for(self, nx=20, ny=20, i=0):
+        # _make_grid() through a least recently used cache of grid_cache_size (layer, ny, nx) entries, so alternating
+        # letterbox shapes (portrait/landscape traffic) reuse their grids instead of rebuilding them on every switch
+        if not self.grid_cache_size:
+            return self._make_grid(nx, ny, i)
+        cache = self.__dict__.get('grid_cache')
+        if cache is None:  # new instance, or Detect pickled before the cache existed
+            cache = self.grid_cache = OrderedDict()
+        key = (i, ny, nx)
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            cache[key] = self._make_grid(nx, ny, i)
+            while len(cache) > self.grid_cache_size:
+                cache.popitem(last=False)
+        return cache[key]
+
+    def warmup(self, shapes):
+        # Build the grids of input image shapes [(h, w), ...] ahead of the first request, i.e. common letterbox shapes
+        for h, w in shapes:
+            for i in range(self.nl):
+                s = int(self.stride[i])
+                self.grid_for(math.ceil(w / s), math.ceil(h / s), i)
 
     def _make_grid(self, nx=20, ny=20, i=0):
         d = self.anchors[i].device
@@ -82,6 +133,8 @@ class Detect(nn.Module):
 
 
 class Model(nn.Module):
+    batched_augment = False  # augmented inference in one padded batch, _forward_augment_batched()
+
     def __init__(self, cfg='yolov5s.yaml', ch=3, nc=None, anchors=None):  # model, input channels, number of classes
         super().__init__()
         if isinstance(cfg, dict):
@@ -122,7 +175,14 @@ class Model(nn.Module):
 
     def forward(self, x, augment=False, profile=False, visualize=False):
         if augment:
-            return self._forward_augment(x)  # augmented inference, None
+            m = self.model[-1]  # Detect()
+            conf_thres, m.conf_thres = m.conf_thres, None  # _clip_augmented() needs the dense anchor layout
+            try:
+                if self.batched_augment:
+                    return self._forward_augment_batched(x)  # augmented inference, None
+                return self._forward_augment(x)  # augmented inference, None
+            finally:
+                m.conf_thres = conf_thres
         return self._forward_once(x, profile, visualize)  # single-scale inference, train
 
     def _forward_augment(self, x):
@@ -139,6 +199,39 @@ class Model(nn.Module):
         y = self._clip_augmented(y)  # clip augmented tails
         return torch.cat(y, 1), None  # augmented inference, train
 
+    def _forward_augment_batched(self, x):
+        # _forward_augment() in one forward pass: the scaled and flipped images are padded to one shape and stacked,
+        # the predictions de-scaled together, and those of grid cells outside each scaled image dropped
+        img_size = x.shape[-2:]  # height, width
+        s = [1, 0.83, 0.67]  # scales
+        f = [None, 3, None]  # flips (2-ud, 3-lr)
+        gs = int(self.stride.max())
+        xs = [scale_img(x.flip(fi) if fi else x, si, gs=gs) for si, fi in zip(s, f)]
+        h, w = max(xi.shape[2] for xi in xs), max(xi.shape[3] for xi in xs)  # batch shape
+        xb = torch.cat([nn.functional.pad(xi, [0, w - xi.shape[3], 0, h - xi.shape[2]], value=0.447) for xi in xs])
+        y = self._forward_once(xb)[0]  # forward
+        y = y.view(len(s), x.shape[0], *y.shape[1:])  # (augmentations, bs, n, no)
+        y = self._descale_pred(y, None, torch.tensor(s, device=y.device, dtype=y.dtype).view(-1, 1, 1, 1), img_size)
+        for i, fi in enumerate(f):
+            if fi == 2:
+                y[i, ..., 1] = img_size[0] - y[i, ..., 1]  # de-flip ud
+            elif fi == 3:
+                y[i, ..., 0] = img_size[1] - y[i, ..., 0]  # de-flip lr
+
+        # Grid cells each augmentation has without padding, in Detect() output order (layer, anchor, y, x)
+        m = self.model[-1]  # Detect()
+        keep = []
+        for xi in xs:
+            k = []
+            for st in m.stride.tolist():
+                ny, nx = math.ceil(h / st), math.ceil(w / st)
+                cell = torch.zeros((ny, nx), dtype=torch.bool, device=y.device)
+                cell[:math.ceil(xi.shape[2] / st), :math.ceil(xi.shape[3] / st)] = True
+                k.append(cell.view(1, -1).expand(m.na, -1).reshape(-1))
+            keep.append(torch.cat(k))
+        y = self._clip_augmented([y[i][:, k] for i, k in enumerate(keep)])  # clip augmented tails
+        return torch.cat(y, 1), None  # augmented inference, train
+
     def _forward_once(self, x, profile=False, visualize=False):
         y, dt = [], []  # outputs
         for m in self.model:
@@ -149,6 +242,7 @@ class Model(nn.Module):
             x = m(x)  # run
             y.append(x if m.i in self.save else None)  # save output
             if visualize:
+                from utils.plots import feature_visualization  # matplotlib, only imported when visualizing
                 feature_visualization(x, m.type, m.i, save_dir=visualize)
         return x
 
@@ -181,6 +275,10 @@ class Model(nn.Module):
         return y
 
     def _profile_one_layer(self, m, x, dt):
+        try:
+            import thop  # for FLOPs computation
+        except ImportError:
+            thop = None
         c = isinstance(m, Detect)  # is final layer, copy input as inplace fix
         o = thop.profile(m, inputs=(x.copy() if c else x,), verbose=False)[0] / 1E9 * 2 if thop else 0  # FLOPs
         t = time_sync()
@@ -243,6 +341,8 @@ class Model(nn.Module):
             m.grid = list(map(fn, m.grid))
             if isinstance(m.anchor_grid, list):
                 m.anchor_grid = list(map(fn, m.anchor_grid))
+            if m.__dict__.get('grid_cache'):
+                m.grid_cache = OrderedDict((k, tuple(map(fn, v))) for k, v in m.grid_cache.items())
         return self
 
 
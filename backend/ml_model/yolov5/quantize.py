@@ -0,0 +1,146 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Static post-training INT8 quantization (FX graph mode) of a YOLOv5 model for CPU inference, with an mAP gate
+
+Usage:
+    $ python path/to/quantize.py --weights best.pt --data damage.yaml --calib 256 --max-drop 0.01
+
+The backbone and neck are quantized, the Detect() layer stays FP32. Calibration images come from a
+LoadImagesAndLabels dataset, val.py runs before and after, and the INT8 model (best.int8.pt) is only written when
+mAP@0.5 drops by at most --max-drop. It loads with attempt_load() like any checkpoint, i.e. detect_custom.py --weights
+best.int8.pt. Requires torch>=1.13.
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+import val
+from models.experimental import Int8Model, attempt_load
+from models.yolo import Detect
+from utils.datasets import LoadImagesAndLabels
+from utils.general import check_dataset, check_img_size, colorstr, file_size, print_args, set_logging
+
+
+class TraceableModel(nn.Module):
+    # model(x) with default arguments, a single-input forward for FX symbolic tracing
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x)
+
+
+def calibration_batches(path, imgsz, stride, n=256, batch_size=8, prefix=''):
+    # Up to n letterboxed (b, 3, imgsz, imgsz) float 0-1 batches from a LoadImagesAndLabels dataset
+    dataset = LoadImagesAndLabels(path, imgsz, batch_size, augment=False, rect=False, stride=stride, prefix=prefix)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=0,
+                                         collate_fn=LoadImagesAndLabels.collate_fn)
+    seen = 0
+    for img, _, _, _ in loader:
+        if seen >= n:
+            break
+        img = img[:n - seen]
+        seen += len(img)
+        yield img.float() / 255.0
+
+
+def quantize_fx(model, batches, prefix=colorstr('INT8:')):
+    # Static PTQ: FX prepare (observers) -> calibration forward passes -> convert to quantized kernels
+    from torch.ao.quantization import QConfigMapping, get_default_qconfig
+    from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    engine = 'x86' if 'x86' in torch.backends.quantized.supported_engines else 'fbgemm'
+    torch.backends.quantized.engine = engine
+    qconfig_mapping = QConfigMapping().set_global(get_default_qconfig(engine)).set_object_type(Detect, None)
+    custom = PrepareCustomConfig().set_non_traceable_module_classes([Detect])  # grid caching is data dependent
+
+    batches = iter(batches)
+    example = next(batches)
+    prepared = prepare_fx(TraceableModel(model).eval(), qconfig_mapping, (example,), prepare_custom_config=custom)
+    t, n = time.time(), 0
+    with torch.no_grad():
+        for img in [example, *batches]:
+            prepared(img)
+            n += len(img)
+    print(f'{prefix} calibrated on {n} images in {time.time() - t:.1f}s ({engine} engine)')
+    return Int8Model(convert_fx(prepared), model, engine)
+
+
+def run(weights=ROOT / 'yolov5s.pt',  # weights path
+        data=ROOT / 'data/coco128.yaml',  # dataset.yaml path
+        imgsz=640,  # inference size (pixels)
+        calib=256,  # number of calibration images
+        calib_task='train',  # dataset split to calibrate on
+        batch_size=8,  # calibration and validation batch size
+        max_drop=0.01,  # maximum allowed mAP@0.5 drop
+        ):
+    prefix = colorstr('INT8:')
+    weights = Path(weights)
+    f = weights.with_suffix('.int8.pt')
+    tmp = weights.with_suffix('.int8.tmp.pt')  # validated before taking f's place
+
+    # Load FP32 model, Conv2d() + BatchNorm2d() fused
+    model = attempt_load(weights, map_location='cpu', inplace=True, fuse=True)
+    gs = max(int(model.stride.max()), 32)  # grid size (max stride)
+    imgsz = check_img_size(imgsz, s=gs)
+    data = check_dataset(data)
+
+    # Quantize
+    batches = calibration_batches(data[calib_task], imgsz, gs, calib, batch_size, prefix=colorstr(f'{calib_task}: '))
+    qmodel = quantize_fx(model, batches, prefix)
+    torch.save({'model': qmodel, 'int8': True, 'source': str(weights)}, tmp)
+
+    # Accuracy gate, both models through val.py on the same split and settings
+    kwargs = dict(data=data, batch_size=batch_size, imgsz=imgsz, device='cpu', half=False, plots=False,
+                  project=ROOT / 'runs/quantize', exist_ok=True)
+    (_, _, map50, _, *_), _, t = val.run(weights=weights, name='fp32', **kwargs)
+    (_, _, qmap50, _, *_), _, qt = val.run(weights=tmp, name='int8', **kwargs)
+    drop = map50 - qmap50
+    print(f'{prefix} mAP@0.5 {map50:.4f} FP32 -> {qmap50:.4f} INT8 (drop {drop:.4f}, max {max_drop}), '
+          f'inference {t[1]:.1f}ms -> {qt[1]:.1f}ms per image ({t[1] / max(qt[1], 1E-6):.2f}x)')
+    if drop > max_drop:
+        tmp.unlink()
+        print(f'{prefix} REJECTED, mAP@0.5 drop {drop:.4f} exceeds --max-drop {max_drop}. No model written.')
+        return None
+    tmp.replace(f)
+    print(f'{prefix} saved {f} ({file_size(f):.1f} MB)')
+    return f
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default=ROOT / 'yolov5s.pt', help='weights path')
+    parser.add_argument('--data', type=str, default=ROOT / 'data/coco128.yaml', help='dataset.yaml path')
+    parser.add_argument('--imgsz', '--img', '--img-size', type=int, default=640, help='inference size (pixels)')
+    parser.add_argument('--calib', type=int, default=256, help='number of calibration images')
+    parser.add_argument('--calib-task', default='train', help='dataset split to calibrate on, train or val')
+    parser.add_argument('--batch-size', type=int, default=8, help='calibration and validation batch size')
+    parser.add_argument('--max-drop', type=float, default=0.01, help='maximum allowed mAP@0.5 drop')
+    opt = parser.parse_args()
+    print_args(FILE.stem, opt)
+    return opt
+
+
+def main(opt):
+    set_logging()
+    if run(**vars(opt)) is None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -7,8 +7,6 @@ import random
 
 import numpy as np
 import torch
-import yaml
-from tqdm import tqdm
 
 from utils.general import colorstr
 
@@ -78,7 +76,9 @@ def kmean_anchors(dataset='./data/coco128.yaml', n=9, img_size=640, thr=4.0, gen
         Usage:
             from utils.autoanchor import *; _ = kmean_anchors()
     """
+    import yaml
     from scipy.cluster.vq import kmeans
+    from tqdm import tqdm
 
     thr = 1. / thr
     prefix = colorstr('autoanchor: ')
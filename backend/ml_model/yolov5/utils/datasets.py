@@ -11,6 +11,7 @@ import os
 import random
 import shutil
 import time
+from collections import deque
 from itertools import repeat
 from multiprocessing.pool import ThreadPool, Pool
 from pathlib import Path
@@ -21,14 +22,12 @@ import cv2
 import numpy as np
 import torch
 import torch.nn.functional as F
-import yaml
-from PIL import Image, ExifTags
 from torch.utils.data import Dataset
-from tqdm import tqdm
 
 from utils.augmentations import Albumentations, augment_hsv, copy_paste, letterbox, mixup, random_perspective
 from utils.general import check_dataset, check_requirements, check_yaml, clean_str, segments2boxes, \
     xywh2xyxy, xywhn2xyxy, xyxy2xywhn, xyn2xy
+from utils.jpeg import imread_reduced
 from utils.torch_utils import torch_distributed_zero_first
 
 # Parameters
@@ -36,11 +35,11 @@ HELP_URL = 'https://github.com/ultralytics/yolov5/wiki/Train-Custom-Data'
 IMG_FORMATS = ['bmp', 'jpg', 'jpeg', 'png', 'tif', 'tiff', 'dng', 'webp', 'mpo']  # acceptable image suffixes
 VID_FORMATS = ['mov', 'avi', 'mp4', 'mpg', 'mpeg', 'm4v', 'wmv', 'mkv']  # acceptable video suffixes
 NUM_THREADS = min(8, os.cpu_count())  # number of multiprocessing threads
+LABEL_CACHE_COLUMNS = 'shapes', 'labels', 'label_index', 'segments', 'segment_index', 'image_segments'  # *.npy
 
-# Get orientation exif tag
-for orientation in ExifTags.TAGS.keys():
-    if ExifTags.TAGS[orientation] == 'Orientation':
-        break
+# Orientation exif tag, PIL.ExifTags.TAGS key for 'Orientation' (PIL, yaml and tqdm are imported where used so
+# inference-only processes do not pay for them)
+orientation = 0x0112
 
 
 def get_hash(paths):
@@ -74,6 +73,7 @@ def exif_transpose(image):
     :param image: The image to transpose.
     :return: An image.
     """
+    from PIL import Image
     exif = image.getexif()
     orientation = exif.get(0x0112, 1)  # default 1
     if orientation > 1:
@@ -157,7 +157,7 @@ class _RepeatSampler(object):
 
 class LoadImages:
     # YOLOv5 image/video dataloader, i.e. `python detect.py --source image.jpg/vid.mp4`
-    def __init__(self, path, img_size=640, stride=32, auto=True):
+    def __init__(self, path, img_size=640, stride=32, auto=True, reduce=False):
         p = str(Path(path).resolve())  # os-agnostic absolute path
         if '*' in p:
             files = sorted(glob.glob(p, recursive=True))  # glob
@@ -179,6 +179,8 @@ class LoadImages:
         self.video_flag = [False] * ni + [True] * nv
         self.mode = 'image'
         self.auto = auto
+        self.reduce = reduce  # decode JPEGs at reduced resolution, see imread_reduced()
+        self.shape0 = None  # original (height, width) of the last image, img0 may be smaller when reducing
         if any(videos):
             self.new_video(videos[0])  # new video
         else:
@@ -210,23 +212,35 @@ class LoadImages:
                     ret_val, img0 = self.cap.read()
 
             self.frame += 1
+            self.shape0 = img0.shape[:2]
+            img = self.convert(img0)
             print(f'video {self.count + 1}/{self.nf} ({self.frame}/{self.frames}) {path}: ', end='')
 
         else:
             # Read image
             self.count += 1
-            img0 = cv2.imread(path)  # BGR
-            assert img0 is not None, 'Image Not Found ' + path
+            img, img0, self.shape0 = self.read(path)
             print(f'image {self.count}/{self.nf} {path}: ', end='')
 
+        return path, img, img0, self.cap
+
+    def read(self, path):
+        # Returns letterboxed img, BGR img0 and original (height, width) of one image file, thread-safe
+        if self.reduce:
+            img0, shape0 = imread_reduced(path, self.img_size)  # BGR
+        else:
+            img0 = cv2.imread(path)  # BGR
+            shape0 = None if img0 is None else img0.shape[:2]
+        assert img0 is not None, 'Image Not Found ' + path
+        return self.convert(img0), img0, shape0
+
+    def convert(self, img0):
         # Padded resize
         img = letterbox(img0, self.img_size, stride=self.stride, auto=self.auto)[0]
 
         # Convert
         img = img.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
-        img = np.ascontiguousarray(img)
-
-        return path, img, img0, self.cap
+        return np.ascontiguousarray(img)
 
     def new_video(self, path):
         self.frame = 0
@@ -237,6 +251,68 @@ class LoadImages:
         return self.nf  # number of files
 
 
+class LoadImagesPrefetch(LoadImages):
+    # LoadImages that decodes and letterboxes up to `prefetch` images ahead of the consumer on a thread pool (cv2
+    # releases the GIL). Yields the same (path, img, img0, cap) items in the same order, videos are read in order on
+    # the calling thread. Usage: `for path, img, im0s, vid_cap in LoadImagesPrefetch(source, workers=4): ...`
+    def __init__(self, path, img_size=640, stride=32, auto=True, reduce=False, workers=4, prefetch=8):
+        super().__init__(path, img_size, stride, auto, reduce)
+        self.workers = max(workers, 1)
+        self.prefetch = max(prefetch, 1)
+        self.pool = None
+        self.queue = deque()  # AsyncResult per submitted image, in file order
+        self.depths, self.stalls, self.waits = [], 0, []  # per image: decoded images queued, seconds waited
+
+    def __iter__(self):
+        super().__iter__()
+        self.close()
+        self.pool = ThreadPool(self.workers)
+        self.submitted = 0
+        self.depths, self.stalls, self.waits = [], 0, []
+        return self
+
+    def fill(self):
+        # Keep `prefetch` images in flight, images come before videos in self.files
+        while len(self.queue) < self.prefetch and self.submitted < self.nf and not self.video_flag[self.submitted]:
+            self.queue.append(self.pool.apply_async(self.read, (self.files[self.submitted],)))
+            self.submitted += 1
+
+    def __next__(self):
+        if self.count == self.nf or self.video_flag[self.count]:
+            self.close()
+            return super().__next__()  # videos, sequential
+
+        self.fill()
+        path = self.files[self.count]
+        self.count += 1
+        self.depths.append(sum(r.ready() for r in self.queue))
+        result = self.queue.popleft()
+        self.stalls += not result.ready()  # the consumer outran the workers
+        t = time.time()
+        try:
+            img, img0, self.shape0 = result.get()  # re-raises decode errors in order
+        finally:
+            self.waits.append(time.time() - t)
+            self.fill()
+        print(f'image {self.count}/{self.nf} {path}: ', end='')
+        return path, img, img0, self.cap
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+        self.queue.clear()
+
+    def stats(self):
+        # Queue depth (decoded images waiting when one was requested) and consumer wait time, over the last iteration
+        n = len(self.depths)
+        return {'images': n, 'workers': self.workers, 'prefetch': self.prefetch,
+                'mean_depth': round(sum(self.depths) / n, 2) if n else None,
+                'min_depth': min(self.depths) if n else None,
+                'stalls': self.stalls,  # requests whose image was not decoded yet
+                'wait_ms': round(sum(self.waits) * 1E3, 1)}
+
+
 class LoadWebcam:  # for inference
     # YOLOv5 local webcam dataloader, i.e. `python detect.py --source 0`
     def __init__(self, pipe='0', img_size=640, stride=32):
@@ -373,12 +449,63 @@ def img2label_paths(img_paths):
     return [sb.join(x.rsplit(sa, 1)).rsplit('.', 1)[0] + '.txt' for x in img_paths]
 
 
+class RaggedArray:
+    # Read-only sequence of variable-length arrays stored as one flat array plus (n + 1) row offsets, i.e. the labels
+    # of a memory-mapped labels cache. Integer indexing returns a view (a list of views when values is itself a
+    # RaggedArray), slice/array indexing returns a reordered RaggedArray sharing the same flat storage
+    def __init__(self, values, offsets, index=None):
+        self.values = values  # flat array or RaggedArray
+        self.offsets = offsets  # row i is values[offsets[i]:offsets[i + 1]]
+        self.index = index  # row ids in sequence order, None for all rows in order
+
+    def __len__(self):
+        return len(self.offsets) - 1 if self.index is None else len(self.index)
+
+    def __getitem__(self, i):
+        if not isinstance(i, (int, np.integer)):
+            index = np.arange(len(self.offsets) - 1) if self.index is None else self.index
+            return RaggedArray(self.values, self.offsets, index[i])
+        if i < 0:
+            i += len(self)
+        j = i if self.index is None else self.index[i]
+        a, b = int(self.offsets[j]), int(self.offsets[j + 1])
+        return [self.values[k] for k in range(a, b)] if isinstance(self.values, RaggedArray) else self.values[a:b]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def save_label_cache(path, x):
+    # Saves a columnar labels cache directory: LABEL_CACHE_COLUMNS as flat *.npy arrays plus pickled metadata (hash,
+    # version, results, msgs, files) in meta.npy. Replaces an existing cache, including older single-file ones
+    tmp = path.with_suffix('.cache_tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for k in LABEL_CACHE_COLUMNS:
+        np.save(tmp / f'{k}.npy', x[k])
+    np.save(tmp / 'meta.npy', {k: v for k, v in x.items() if k not in LABEL_CACHE_COLUMNS})
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+    tmp.rename(path)
+
+
+def load_label_cache(path):
+    # Loads a columnar labels cache directory, metadata unpickled and columns memory-mapped read-only
+    x = np.load(path / 'meta.npy', allow_pickle=True).item()
+    for k in LABEL_CACHE_COLUMNS:
+        x[k] = np.load(path / f'{k}.npy', mmap_mode='r')
+    return x
+
+
 class LoadImagesAndLabels(Dataset):
     # YOLOv5 train_loader/val_loader, loads images and labels for training and validation
-    cache_version = 0.5  # dataset labels *.cache version
+    cache_version = 0.6  # dataset labels *.cache version
 
     def __init__(self, path, img_size=640, batch_size=16, augment=False, hyp=None, rect=False, image_weights=False,
                  cache_images=False, single_cls=False, stride=32, pad=0.0, prefix=''):
+        from tqdm import tqdm
         self.img_size = img_size
         self.augment = augment
         self.hyp = hyp
@@ -415,7 +542,7 @@ class LoadImagesAndLabels(Dataset):
         self.label_files = img2label_paths(self.img_files)  # labels
         cache_path = (p if p.is_file() else Path(self.label_files[0]).parent).with_suffix('.cache')
         try:
-            cache, exists = np.load(cache_path, allow_pickle=True).item(), True  # load dict
+            cache, exists = load_label_cache(cache_path), True  # load metadata, memory-map columns
             assert cache['version'] == self.cache_version  # same version
             assert cache['hash'] == get_hash(self.label_files + self.img_files)  # same hash
         except:
@@ -431,17 +558,16 @@ class LoadImagesAndLabels(Dataset):
         assert nf > 0 or not augment, f'{prefix}No labels in {cache_path}. Can not train without labels. See {HELP_URL}'
 
         # Read cache
-        [cache.pop(k) for k in ('hash', 'version', 'msgs')]  # remove items
-        labels, shapes, self.segments = zip(*cache.values())
-        self.labels = list(labels)
-        self.shapes = np.array(shapes, dtype=np.float64)
-        self.img_files = list(cache.keys())  # update
-        self.label_files = img2label_paths(cache.keys())  # update
+        self.labels = RaggedArray(cache['labels'], cache['label_index'])  # views of the memory-mapped columns
+        self.segments = RaggedArray(RaggedArray(cache['segments'], cache['segment_index']), cache['image_segments'])
+        self.shapes = np.array(cache['shapes'], dtype=np.float64)
+        self.img_files = cache['files']  # update
+        self.label_files = img2label_paths(self.img_files)  # update
         if single_cls:
-            for x in self.labels:
-                x[:, 0] = 0
+            self.labels.values = np.array(self.labels.values)  # writable copy
+            self.labels.values[:, 0] = 0
 
-        n = len(shapes)  # number of images
+        n = len(self.shapes)  # number of images
         bi = np.floor(np.arange(n) / batch_size).astype(np.int)  # batch index
         nb = bi[-1] + 1  # number of batches
         self.batch = bi  # batch index of image
@@ -456,7 +582,7 @@ class LoadImagesAndLabels(Dataset):
             irect = ar.argsort()
             self.img_files = [self.img_files[i] for i in irect]
             self.label_files = [self.label_files[i] for i in irect]
-            self.labels = [self.labels[i] for i in irect]
+            self.labels = self.labels[irect]
             self.shapes = s[irect]  # wh
             ar = ar[irect]
 
@@ -496,19 +622,23 @@ class LoadImagesAndLabels(Dataset):
 
     def cache_labels(self, path=Path('./labels.cache'), prefix=''):
         # Cache dataset labels, check images and read shapes
-        x = {}  # dict
+        from tqdm import tqdm
+        files, labels, shapes, segments = [], [], [], []  # per valid image
         nm, nf, ne, nc, msgs = 0, 0, 0, 0, []  # number missing, found, empty, corrupt, messages
         desc = f"{prefix}Scanning '{path.parent / path.stem}' images and labels..."
         with Pool(NUM_THREADS) as pool:
             pbar = tqdm(pool.imap(verify_image_label, zip(self.img_files, self.label_files, repeat(prefix))),
                         desc=desc, total=len(self.img_files))
-            for im_file, l, shape, segments, nm_f, nf_f, ne_f, nc_f, msg in pbar:
+            for im_file, l, shape, s, nm_f, nf_f, ne_f, nc_f, msg in pbar:
                 nm += nm_f
                 nf += nf_f
                 ne += ne_f
                 nc += nc_f
                 if im_file:
-                    x[im_file] = [l, shape, segments]
+                    files.append(im_file)
+                    labels.append(l)
+                    shapes.append(shape)
+                    segments.append(s)
                 if msg:
                     msgs.append(msg)
                 pbar.desc = f"{desc}{nf} found, {nm} missing, {ne} empty, {nc} corrupted"
@@ -518,13 +648,20 @@ class LoadImagesAndLabels(Dataset):
             logging.info('\n'.join(msgs))
         if nf == 0:
             logging.info(f'{prefix}WARNING: No labels found in {path}. See {HELP_URL}')
+        polygons = [p for s in segments for p in s]
+        x = {'files': files}  # columns, rows of image i are [index[i]:index[i + 1]]
+        x['shapes'] = np.array(shapes, dtype=np.float64).reshape(-1, 2)  # wh
+        x['labels'] = np.concatenate(labels, 0) if labels else np.zeros((0, 5), dtype=np.float32)
+        x['label_index'] = np.cumsum([0] + [len(l) for l in labels], dtype=np.int64)
+        x['segments'] = np.concatenate(polygons, 0) if polygons else np.zeros((0, 2), dtype=np.float32)  # xy points
+        x['segment_index'] = np.cumsum([0] + [len(p) for p in polygons], dtype=np.int64)  # points per polygon
+        x['image_segments'] = np.cumsum([0] + [len(s) for s in segments], dtype=np.int64)  # polygons per image
         x['hash'] = get_hash(self.label_files + self.img_files)
         x['results'] = nf, nm, ne, nc, len(self.img_files)
         x['msgs'] = msgs  # warnings
         x['version'] = self.cache_version  # cache version
         try:
-            np.save(path, x)  # save cache for next time
-            path.with_suffix('.cache.npy').rename(path)  # remove .npy suffix
+            save_label_cache(path, x)  # save cache for next time
             logging.info(f'{prefix}New cache created: {path}')
         except Exception as e:
             logging.info(f'{prefix}WARNING: Cache directory {path.parent} is not writeable: {e}')  # path not writeable
@@ -807,6 +944,7 @@ def create_folder(path='./new'):
 
 def flatten_recursive(path='../datasets/coco128'):
     # Flatten a recursive directory by bringing all files to top level
+    from tqdm import tqdm
     new_path = Path(path + '_flat')
     create_folder(new_path)
     for file in tqdm(glob.glob(str(Path(path)) + '/**/*.*', recursive=True)):
@@ -815,6 +953,7 @@ def flatten_recursive(path='../datasets/coco128'):
 
 def extract_boxes(path='../datasets/coco128'):  # from utils.datasets import *; extract_boxes()
     # Convert detection dataset into classification dataset, with one directory per class
+    from tqdm import tqdm
     path = Path(path)  # images dir
     shutil.rmtree(path / 'classifier') if (path / 'classifier').is_dir() else None  # remove existing
     files = list(path.rglob('*.*'))
@@ -855,6 +994,7 @@ def autosplit(path='../datasets/coco128/images', weights=(0.9, 0.1, 0.0), annota
         weights:         Train, val, test weights (list, tuple)
         annotated_only:  Only use images with an annotated txt file
     """
+    from tqdm import tqdm
     path = Path(path)  # images dir
     files = sum([list(path.rglob(f"*.{img_ext}")) for img_ext in IMG_FORMATS], [])  # image files only
     n = len(files)  # number of files
@@ -873,6 +1013,7 @@ def autosplit(path='../datasets/coco128/images', weights=(0.9, 0.1, 0.0), annota
 
 def verify_image_label(args):
     # Verify one image-label pair
+    from PIL import Image
     im_file, lb_file, prefix = args
     nm, nf, ne, nc, msg, segments = 0, 0, 0, 0, '', []  # number (missing, found, empty, corrupt), message, segments
     try:
@@ -927,6 +1068,9 @@ def dataset_stats(path='coco128.yaml', autodownload=False, verbose=False, profil
         autodownload:   Attempt to download dataset if not found locally
         verbose:        Print stats dictionary
     """
+    import yaml
+    from PIL import Image
+    from tqdm import tqdm
 
     def round_labels(labels):
         # Update labels to integer class and 6 decimal place floats
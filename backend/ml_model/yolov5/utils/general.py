@@ -22,19 +22,20 @@ from zipfile import ZipFile
 
 import cv2
 import numpy as np
-import pandas as pd
-import pkg_resources as pkg
 import torch
-import torchvision
-import yaml
 
-from utils.downloads import gsutil_getsize
+try:
+    import torchvision
+except ImportError:  # slim deployments, tiled_nms() replaces torchvision.ops.nms()
+    torchvision = None
+
 from utils.metrics import box_iou, fitness
 
+# pandas, pkg_resources, yaml and gsutil helpers are imported where used, keeping them off the inference import path
+
 # Settings
 torch.set_printoptions(linewidth=320, precision=5, profile='long')
 np.set_printoptions(linewidth=320, formatter={'float_kind': '{:11.5g}'.format})  # format short g, %precision=5
-pd.options.display.max_columns = 10
 cv2.setNumThreads(0)  # prevent OpenCV from multithreading (incompatible with PyTorch DataLoader)
 os.environ['NUMEXPR_MAX_THREADS'] = str(min(os.cpu_count(), 8))  # NumExpr max threads
 
@@ -43,12 +44,28 @@ ROOT = FILE.parents[1]  # YOLOv5 root directory
 
 
 class Profile(contextlib.ContextDecorator):
-    # Usage: @Profile() decorator or 'with Profile():' context manager
+    # Usage: @Profile() decorator or 'with Profile():' context manager, or dt = Profile(verbose=False) and read
+    # dt.dt (last) / dt.t (accumulated) seconds. CUDA is synchronized like time_sync() so GPU work is attributed
+    def __init__(self, t=0.0, verbose=True):
+        self.t = t  # accumulated seconds
+        self.dt = 0.0  # last interval seconds
+        self.verbose = verbose
+        self.cuda = torch.cuda.is_available()
+
     def __enter__(self):
-        self.start = time.time()
+        self.start = self.time()
+        return self
 
     def __exit__(self, type, value, traceback):
-        print(f'Profile results: {time.time() - self.start:.5f}s')
+        self.dt = self.time() - self.start
+        self.t += self.dt
+        if self.verbose:
+            print(f'Profile results: {self.dt:.5f}s')
+
+    def time(self):
+        if self.cuda:
+            torch.cuda.synchronize()
+        return time.time()
 
 
 class Timeout(contextlib.ContextDecorator):
@@ -225,6 +242,7 @@ def check_python(minimum='3.6.2'):
 
 def check_version(current='0.0.0', minimum='0.0.0', name='version ', pinned=False):
     # Check version vs. required version
+    import pkg_resources as pkg
     current, minimum = (pkg.parse_version(x) for x in (current, minimum))
     result = (current == minimum) if pinned else (current >= minimum)
     assert result, f'{name}{minimum} required by YOLOv5, but {name}{current} is currently installed'
@@ -233,6 +251,7 @@ def check_version(current='0.0.0', minimum='0.0.0', name='version ', pinned=Fals
 @try_except
 def check_requirements(requirements=ROOT / 'requirements.txt', exclude=(), install=True):
     # Check installed dependencies meet requirements (pass *.txt file or list of packages)
+    import pkg_resources as pkg
     prefix = colorstr('red', 'bold', 'requirements:')
     check_python()  # check python version
     if isinstance(requirements, (str, Path)):  # requirements.txt file
@@ -341,6 +360,7 @@ def check_dataset(data, autodownload=True):
 
     # Read yaml (optional)
     if isinstance(data, (str, Path)):
+        import yaml
         with open(data, errors='ignore') as f:
             data = yaml.safe_load(f)  # dictionary
 
@@ -604,10 +624,71 @@ def clip_coords(boxes, shape):
         boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, shape[0])  # y1, y2
 
 
+def box_overlaps(a, b, iou_thres):
+    # (n, m) bool, IoU of xyxy boxes a (n, 4) and b (m, 4) > iou_thres, computed like torchvision.ops.nms in their dtype
+    area_a, area_b = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]), (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    w = (torch.min(a[:, None, 2], b[:, 2]) - torch.max(a[:, None, 0], b[:, 0])).clamp(0)
+    h = (torch.min(a[:, None, 3], b[:, 3]) - torch.max(a[:, None, 1], b[:, 1])).clamp(0)
+    inter = w * h
+    iou = inter / (area_a[:, None] + area_b - inter)
+    t = torch.tensor(iou_thres, dtype=iou.dtype).item()  # threshold rounded to the IoU dtype
+    return iou >= t if t > iou_thres else iou > t  # same as comparing with the float64 threshold
+
+
+def tiled_nms(boxes, scores, iou_thres, tile=512, groups=None):
+    """Greedy NMS in plain torch with torchvision.ops.nms semantics and results: indices of kept boxes by decreasing
+    score, a box is dropped when its IoU with a kept box is > iou_thres. See detect_numpy.nms() for the algorithm
+
+    groups: optional (n,) ids, boxes only suppress boxes of their own group (i.e. image), same as one call per group
+    """
+    order = torch.sort(scores, descending=True, stable=True)[1]
+    b = boxes[order]
+    g = groups[order] if groups is not None else torch.zeros(b.shape[0], dtype=torch.long, device=b.device)
+    keep = torch.zeros(b.shape[0], dtype=torch.bool, device=b.device)
+    for s in range(0, b.shape[0], tile):
+        t, gt = b[s:s + tile], g[s:s + tile]
+        kb, kg = b[:s][keep[:s]], g[:s][keep[:s]]  # kept boxes of earlier tiles
+        alive = ~(box_overlaps(kb, t, iou_thres) & (kg[:, None] == gt)).any(0)  # not suppressed by earlier tiles
+        m = (box_overlaps(t, t, iou_thres) & (gt[:, None] == gt)).triu(1)  # m[i, j]: earlier box i overlaps box j
+        k = alive
+        while True:  # greedy order within the tile, fixed point of keep = alive & ~(kept earlier overlap)
+            new = alive & ~(m & k[:, None]).any(0)
+            if torch.equal(new, k):
+                break
+            k = new
+        keep[s:s + tile] = k
+    return order[keep]
+
+
+def nms(boxes, scores, iou_thres, impl=None):
+    # torchvision.ops.nms() ('torchvision', default when installed) or tiled_nms() ('torch')
+    if (impl or ('torchvision' if torchvision else 'torch')) == 'torchvision':
+        return torchvision.ops.nms(boxes, scores, iou_thres)
+    return tiled_nms(boxes, scores, iou_thres)
+
+
+def topk_mask(scores, groups, k):
+    # bool mask keeping the k highest scores of every group (non-negative int ids), ties in input order
+    order = torch.sort(scores, descending=True, stable=True)[1]
+    order = order[torch.sort(groups[order], stable=True)[1]]  # by group, then by decreasing score
+    g = groups[order]
+    n = torch.bincount(g)
+    mask = torch.zeros_like(scores, dtype=torch.bool)
+    mask[order] = torch.arange(g.shape[0], device=g.device) - (n.cumsum(0) - n)[g] < k  # rank within group < k
+    return mask
+
+
 def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, multi_label=False,
-                        labels=(), max_det=300):
+                        labels=(), max_det=300, batched=True, nms_impl=None, topk=None):
     """Runs Non-Maximum Suppression (NMS) on inference results
 
+    batched: one NMS call for the whole batch, boxes offset by class and grouped by image (same output as the per-image
+             loop, which is used for autolabelling and when an image has more than max_nms boxes)
+    nms_impl: 'torchvision' (default when installed) or 'torch' for the torchvision-free tiled_nms() in the per-image
+              loop, same results. The batched path always uses tiled_nms(), grouped by image
+    topk: keep only the topk most confident candidates per class and image before NMS, caps the NMS cost at low
+          conf_thres
+
     Returns:
          list of detections, on (n,6) tensor per image [xyxy, conf, cls]
     """
@@ -621,12 +702,18 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
 
     # Settings
     min_wh, max_wh = 2, 4096  # (pixels) minimum and maximum box width and height
-    max_nms = 30000  # maximum number of boxes into torchvision.ops.nms()
+    max_nms = 30000  # maximum number of boxes into nms()
     time_limit = 10.0  # seconds to quit after
     redundant = True  # require redundant detections
     multi_label &= nc > 1  # multiple labels per box (adds 0.5ms/img)
     merge = False  # use merge-NMS
 
+    if batched and not labels and not merge:
+        output = _non_max_suppression_batched(prediction, xc, conf_thres, iou_thres, classes, agnostic, multi_label,
+                                              max_det, max_wh, max_nms, topk)
+        if output is not None:
+            return output
+
     t = time.time()
     output = [torch.zeros((0, 6), device=prediction.device)] * prediction.shape[0]
     for xi, x in enumerate(prediction):  # image index, image inference
@@ -669,17 +756,21 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
         # if not torch.isfinite(x).all():
         #     x = x[torch.isfinite(x).all(1)]
 
+        # Cap candidates per class
+        if topk:
+            x = x[topk_mask(x[:, 4], x[:, 5].long(), topk)]
+
         # Check shape
         n = x.shape[0]  # number of boxes
         if not n:  # no boxes
             continue
         elif n > max_nms:  # excess boxes
-            x = x[x[:, 4].argsort(descending=True)[:max_nms]]  # sort by confidence
+            x = x[x[:, 4].topk(max_nms)[1]]  # most confident
 
         # Batched NMS
         c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
         boxes, scores = x[:, :4] + c, x[:, 4]  # boxes (offset by class), scores
-        i = torchvision.ops.nms(boxes, scores, iou_thres)  # NMS
+        i = nms(boxes, scores, iou_thres, nms_impl)  # NMS
         if i.shape[0] > max_det:  # limit detections
             i = i[:max_det]
         if merge and (1 < n < 3E3):  # Merge NMS (boxes merged using weighted mean)
@@ -698,6 +789,90 @@ def non_max_suppression(prediction, conf_thres=0.25, iou_thres=0.45, classes=Non
     return output
 
 
+def _non_max_suppression_batched(prediction, xc, conf_thres, iou_thres, classes, agnostic, multi_label, max_det,
+                                 max_wh, max_nms, topk=None):
+    # non_max_suppression() of all images in one tiled_nms() call, None when an image exceeds max_nms boxes
+    bs = prediction.shape[0]
+    output = [torch.zeros((0, 6), device=prediction.device)] * bs
+    b, k = xc.nonzero(as_tuple=True)  # image index, anchor index of candidates
+    x = prediction[b, k]  # candidates of all images, image by image in anchor order
+    if not x.shape[0]:
+        return output
+
+    # Compute conf, boxes and detections matrix nx6 (xyxy, conf, cls) as in the per-image loop
+    x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+    box = xywh2xyxy(x[:, :4])
+    if multi_label:
+        i, j = (x[:, 5:] > conf_thres).nonzero(as_tuple=False).T
+        x, b = torch.cat((box[i], x[i, j + 5, None], j[:, None].float()), 1), b[i]
+    else:  # best class only
+        conf, j = x[:, 5:].max(1, keepdim=True)
+        i = conf.view(-1) > conf_thres
+        x, b = torch.cat((box, conf, j.float()), 1)[i], b[i]
+    if classes is not None:  # filter by class
+        i = (x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)
+        x, b = x[i], b[i]
+    if topk:  # cap candidates per class and image
+        i = topk_mask(x[:, 4], b * (prediction.shape[2] - 5) + x[:, 5].long(), topk)
+        x, b = x[i], b[i]
+    if not x.shape[0]:
+        return output
+    if torch.bincount(b, minlength=bs).max() > max_nms:  # excess boxes, per-image loop keeps the top max_nms
+        return None
+
+    # Batched NMS: the per-image loop's float32 boxes (offset by class), grouped by image instead of offset by image,
+    # an image offset would round sub-pixel coordinates and change IoUs at the threshold. Every IoU is computed on the
+    # same coordinates as in the loop, and tiled_nms() keeps the same boxes as torchvision.ops.nms
+    c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
+    boxes, scores = x[:, :4] + c, x[:, 4]  # boxes (offset by class), scores
+    i = tiled_nms(boxes, scores, iou_thres, groups=b)  # NMS, by decreasing confidence
+
+    # Split per image, keeping the confidence order within each image
+    i = i[torch.argsort(b[i] * i.shape[0] + torch.arange(i.shape[0], device=i.device))]
+    for xi, ii in enumerate(i.split(torch.bincount(b[i], minlength=bs).tolist())):
+        if ii.shape[0]:
+            output[xi] = x[ii[:max_det]]  # limit detections
+    return output
+
+
+def weighted_boxes_fusion(preds, conf_thres=0.25, iou_thres=0.55, classes=None, agnostic=False, max_det=300,
+                          weights=None):
+    """Fuses the inference results of several models (Ensemble per-model outputs) with Weighted Boxes Fusion
+    https://arxiv.org/abs/1910.13302. Each model's boxes go through non_max_suppression(), then every box joins the
+    highest-confidence same-class cluster head it overlaps by more than iou_thres and the clusters are averaged
+
+    Returns:
+         list of detections, on (n,6) tensor per image [xyxy, conf, cls]
+    """
+
+    max_wh = 4096  # (pixels) class offset, as in non_max_suppression()
+    weights = torch.tensor(weights or [1.0] * len(preds), device=preds[0].device)  # model weights
+    dets = [non_max_suppression(p, conf_thres, iou_thres, classes, agnostic, max_det=max_det) for p in preds]
+    output = []
+    for xi in range(preds[0].shape[0]):  # image index
+        x = torch.cat([d[xi] for d in dets], 0)  # (n,6) detections of all models
+        if not x.shape[0]:
+            output.append(x)
+            continue
+        w = torch.cat([weights[j].expand(d[xi].shape[0]) for j, d in enumerate(dets)])  # model weight per box
+        s = x[:, 4] * w  # box weights
+
+        # Clusters: heads from NMS over all models, each box assigned to the first (best) head it overlaps
+        boxes = x[:, :4] + x[:, 5:6] * (0 if agnostic else max_wh)  # boxes (offset by class)
+        heads = nms(boxes, s, iou_thres)
+        first = (box_iou(boxes[heads], boxes) > iou_thres).float().argmax(0)  # head index per box
+        m = torch.zeros((heads.shape[0], x.shape[0]), device=x.device)
+        m[first, torch.arange(x.shape[0], device=x.device)] = 1.0  # (heads, n) cluster membership
+
+        # Fused boxes: confidence-weighted mean, confidence rescaled by the share of the ensemble that agrees
+        mw = m @ w
+        box = (m * s) @ x[:, :4] / (m @ s)[:, None]
+        conf = (m @ s) / mw * mw.clamp(max=weights.sum()) / weights.sum()
+        y = torch.cat((box, conf[:, None], x[heads, 5:6]), 1)
+        output.append(y[conf.argsort(descending=True)[:max_det]])
+    return output
+
+
 def strip_optimizer(f='best.pt', s=''):  # from utils.general import *; strip_optimizer()
     # Strip optimizer from 'f' to finalize training, optionally save as 's'
     x = torch.load(f, map_location=torch.device('cpu'))
@@ -715,6 +890,11 @@ def strip_optimizer(f='best.pt', s=''):  # from utils.general import *; strip_op
 
 
 def print_mutation(results, hyp, save_dir, bucket):
+    import pandas as pd
+    import yaml
+    from utils.downloads import gsutil_getsize
+
+    pd.options.display.max_columns = 10
     evolve_csv, results_csv, evolve_yaml = save_dir / 'evolve.csv', save_dir / 'results.csv', save_dir / 'hyp_evolve.yaml'
     keys = ('metrics/precision', 'metrics/recall', 'metrics/mAP_0.5', 'metrics/mAP_0.5:0.95',
             'val/box_loss', 'val/obj_loss', 'val/cls_loss') + tuple(hyp.keys())  # [results + hyps]
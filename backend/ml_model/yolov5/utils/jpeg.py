@@ -0,0 +1,56 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+JPEG header parsing and reduced-resolution decoding, torch-free (also used by the ONNX Runtime path, detect_numpy.py)
+"""
+
+import math
+
+import cv2
+
+
+def jpeg_size(path):
+    # Returns (height, width) from a JPEG's SOF header without decoding, None for other formats or damaged headers
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':  # SOI
+            return None
+        while True:
+            b = f.read(1)
+            while b and b != b'\xff':  # skip to the next marker
+                b = f.read(1)
+            while b == b'\xff':  # fill bytes
+                b = f.read(1)
+            if not b:
+                return None
+            m = b[0]
+            if m == 0x01 or 0xd0 <= m <= 0xd9:  # markers without a length
+                continue
+            n = int.from_bytes(f.read(2), 'big')
+            if 0xc0 <= m <= 0xcf and m not in (0xc4, 0xc8, 0xcc):  # SOFn: precision, height, width
+                d = f.read(5)
+                return (int.from_bytes(d[1:3], 'big'), int.from_bytes(d[3:5], 'big')) if len(d) == 5 else None
+            if n < 2:
+                return None
+            f.seek(n - 2, 1)
+
+
+def imread_reduced(path, img_size=640):
+    # Reads a BGR image, JPEGs decoded at 1/2, 1/4 or 1/8 scale by libjpeg while the long side stays >= img_size.
+    # Returns im, original (height, width) after EXIF rotation. Boxes on im map to the original by the ratio of shapes
+    img_size = max(img_size) if isinstance(img_size, (list, tuple)) else img_size
+    path = str(path)
+    size = jpeg_size(path) if path.split('.')[-1].lower() in ('jpg', 'jpeg') else None
+    f = next((f for f in (8, 4, 2) if size and max(size) / f >= img_size), 1)
+    im = cv2.imread(path, {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                           2: cv2.IMREAD_REDUCED_COLOR_2, 1: cv2.IMREAD_COLOR}[f])  # BGR
+    if im is None:
+        return None, None
+    if f == 1:
+        return im, im.shape[:2]
+    h0, w0 = size
+    shape = (math.ceil(h0 / f), math.ceil(w0 / f))  # libjpeg rounds scaled dimensions up
+    if im.shape[:2] == shape:  # also near-square images whose scaled sides round equal, either mapping is sub-pixel
+        return im, (h0, w0)
+    if im.shape[:2] == shape[::-1]:  # EXIF orientation 5-8 transposes the decoded image
+        return im, (w0, h0)
+    rotated = (im.shape[0] > im.shape[1]) != (h0 > w0)  # decoder rounded differently, compare orientations
+    return im, (w0, h0) if rotated else (h0, w0)
@@ -18,12 +18,6 @@ import torch
 import torch.distributed as dist
 import torch.nn as nn
 import torch.nn.functional as F
-import torchvision
-
-try:
-    import thop  # for FLOPs computation
-except ImportError:
-    thop = None
 
 LOGGER = logging.getLogger(__name__)
 
@@ -99,6 +93,11 @@ def profile(input, ops, n=10, device=None):
     #     m2 = nn.SiLU()
     #     profile(input, [m1, m2], n=100)  # profile over 100 iterations
 
+    try:
+        import thop  # for FLOPs computation
+    except ImportError:
+        thop = None
+
     results = []
     logging.basicConfig(format="%(message)s", level=logging.INFO)
     device = device or select_device()
@@ -244,6 +243,7 @@ def model_info(model, verbose=False, img_size=640):
 
 def load_classifier(name='resnet101', n=2):
     # Loads a pretrained model reshaped to n-class output
+    import torchvision  # second-stage classifier only, keeps torchvision off the inference import path
     model = torchvision.models.__dict__[name](pretrained=True)
 
     # ResNet model properties